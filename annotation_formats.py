@@ -0,0 +1,385 @@
+"""
+Conversión entre las etiquetas YOLO de una sesión y COCO JSON / Pascal VOC XML
+
+Las cajas de muchas imágenes se convierten a la vez con NumPy: se cargan del
+almacén por lotes, se apilan en un array (N, 5) junto con el ancho y alto de
+su imagen (del índice de la sesión, sin abrir las imágenes) y se pasan a
+píxeles absolutos recortadas al borde de la imagen en una sola operación.
+
+    COCO: images/...  annotations/instances.json
+          bbox = [x_min, y_min, ancho, alto] en píxeles; category_id = class_id + 1
+    VOC:  JPEGImages/...  Annotations/{imagen}.xml
+          xmin/ymin/xmax/ymax en píxeles enteros, base 1
+
+El JSON de COCO se genera por bloques mientras se escribe en el ZIP (primero
+la lista de imágenes, luego las anotaciones de cada lote), sin construir el
+diccionario completo en memoria.
+
+Importación: el JSON de COCO se lee en streaming (elemento a elemento de sus
+listas, sin cargar el archivo entero) acumulando las cajas en arrays
+compactos; la conversión a YOLO normalizado y la agrupación por imagen se
+hacen después con operaciones de arrays sobre todas las cajas a la vez.
+"""
+import os
+import json
+import array
+import numpy as np
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from label_store import get_label_store, label_stem
+from session_index import image_dimensions
+from training_export import session_images, EXPORT_BATCH_SIZE
+
+ANNOTATION_FORMATS = ('coco', 'voc')
+COCO_ANNOTATIONS_PATH = "annotations/instances.json"
+
+
+def yolo_to_absolute(boxes, widths, heights):
+    """
+    Cajas YOLO normalizadas (N, 5: clase, xc, yc, w, h) → (clases, array
+    (N, 4) x_min, y_min, x_max, y_max en píxeles) recortadas a cada imagen
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 5)
+    widths = np.asarray(widths, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    half_w = boxes[:, 3] / 2
+    half_h = boxes[:, 4] / 2
+    corners = np.stack([
+        (boxes[:, 1] - half_w) * widths,
+        (boxes[:, 2] - half_h) * heights,
+        (boxes[:, 1] + half_w) * widths,
+        (boxes[:, 2] + half_h) * heights,
+    ], axis=1)
+    limits = np.stack([widths, heights, widths, heights], axis=1)
+    return boxes[:, 0].astype(np.int64), np.clip(corners, 0, limits)
+
+
+def _iter_batches(session, dimensions):
+    """
+    Por lotes de imágenes con dimensiones conocidas: (imágenes, índice de
+    imagen de cada caja, clases, esquinas absolutas)
+    """
+    store = get_label_store(session)
+    images = [name for name in session_images(session) if dimensions.get(name, (None, None))[0]]
+    for start in range(0, len(images), EXPORT_BATCH_SIZE):
+        batch = images[start:start + EXPORT_BATCH_SIZE]
+        labels = store.load_boxes_many(batch)
+        counts = [len(labels.get(name, ())) for name in batch]
+        rows = [box for name in batch for box in labels.get(name, ())]
+        owners = np.repeat(np.arange(len(batch)), counts)
+        sizes = np.array([dimensions[name] for name in batch], dtype=np.float64).reshape(-1, 2)
+        classes, corners = yolo_to_absolute(rows, sizes[owners, 0], sizes[owners, 1])
+        yield start, batch, owners, classes, corners
+
+
+def coco_categories(class_names):
+    return [{'id': index + 1, 'name': name, 'supercategory': ''} for index, name in enumerate(class_names)]
+
+
+def iter_coco_json(session, class_names, dimensions):
+    """Bloques de bytes del JSON de COCO de la sesión"""
+    yield (
+        '{"info": ' + json.dumps({'description': f"Sesión {session}"}) + ', "licenses": [], '
+        '"categories": ' + json.dumps(coco_categories(class_names), ensure_ascii=False) + ', "images": ['
+    ).encode()
+
+    images = [name for name in session_images(session) if dimensions.get(name, (None, None))[0]]
+    for start in range(0, len(images), EXPORT_BATCH_SIZE):
+        batch = [
+            {'id': start + offset + 1, 'file_name': name,
+             'width': dimensions[name][0], 'height': dimensions[name][1]}
+            for offset, name in enumerate(images[start:start + EXPORT_BATCH_SIZE])
+        ]
+        yield ((', ' if start else '') + json.dumps(batch, ensure_ascii=False)[1:-1]).encode()
+    yield b'], "annotations": ['
+
+    next_id = 1
+    for start, batch, owners, classes, corners in _iter_batches(session, dimensions):
+        if not len(classes):
+            continue
+        sizes = corners[:, 2:] - corners[:, :2]
+        bboxes = np.round(np.concatenate([corners[:, :2], sizes], axis=1), 2).tolist()
+        areas = np.round(sizes[:, 0] * sizes[:, 1], 2).tolist()
+        image_ids = (owners + start + 1).tolist()
+        category_ids = (classes + 1).tolist()
+        annotations = [
+            {'id': next_id + i, 'image_id': image_ids[i], 'category_id': category_ids[i],
+             'bbox': bboxes[i], 'area': areas[i], 'iscrowd': 0}
+            for i in range(len(bboxes))
+        ]
+        yield ((', ' if next_id > 1 else '') + json.dumps(annotations)[1:-1]).encode()
+        next_id += len(annotations)
+    yield b']}'
+
+
+VOC_TEMPLATE = (
+    "<annotation>\n"
+    "  <folder>JPEGImages</folder>\n"
+    "  <filename>{filename}</filename>\n"
+    "  <size><width>{width}</width><height>{height}</height><depth>3</depth></size>\n"
+    "  <segmented>0</segmented>\n"
+    "{objects}"
+    "</annotation>\n"
+)
+VOC_OBJECT_TEMPLATE = (
+    "  <object><name>{}</name><pose>Unspecified</pose><truncated>0</truncated><difficult>0</difficult>"
+    "<bndbox><xmin>{}</xmin><ymin>{}</ymin><xmax>{}</xmax><ymax>{}</ymax></bndbox></object>\n"
+)
+
+
+def iter_voc_entries(session, class_names, dimensions):
+    """(nombre en el ZIP, ruta o bytes) del dataset en formato Pascal VOC"""
+    names = [escape(name) for name in class_names]
+    images_path = os.path.join("annotations", session, "images")
+    for start, batch, owners, classes, corners in _iter_batches(session, dimensions):
+        # Píxeles enteros en base 1 (convención de VOC), para todo el lote a la vez
+        pixels = np.rint(corners).astype(np.int64)
+        pixels[:, :2] += 1
+        sizes = np.array([dimensions[name] for name in batch], dtype=np.int64).reshape(-1, 2)
+        pixels = np.minimum(pixels, np.tile(sizes[owners], 2))
+        bounds = np.searchsorted(owners, np.arange(len(batch) + 1))
+        rows = pixels.tolist()
+        class_list = classes.tolist()
+        for offset, filename in enumerate(batch):
+            objects = ''.join(
+                VOC_OBJECT_TEMPLATE.format(
+                    names[class_list[i]] if class_list[i] < len(names) else f"class_{class_list[i]}", *rows[i]
+                )
+                for i in range(bounds[offset], bounds[offset + 1])
+            )
+            width, height = dimensions[filename]
+            yield f"JPEGImages/{filename}", os.path.join(images_path, filename)
+            yield f"Annotations/{label_stem(filename)}.xml", VOC_TEMPLATE.format(
+                filename=escape(filename), width=width, height=height, objects=objects
+            ).encode()
+
+
+def iter_coco_entries(session, class_names, dimensions):
+    """(nombre en el ZIP, ruta o bloques) del dataset en formato COCO"""
+    images_path = os.path.join("annotations", session, "images")
+    for name in session_images(session):
+        if dimensions.get(name, (None, None))[0]:
+            yield f"images/{name}", os.path.join(images_path, name)
+    yield COCO_ANNOTATIONS_PATH, iter_coco_json(session, class_names, dimensions)
+
+
+def iter_annotation_format_entries(session, export_format, class_names):
+    """Entradas del ZIP para format=coco|voc"""
+    dimensions = image_dimensions(session)
+    if export_format == 'coco':
+        return iter_coco_entries(session, class_names, dimensions)
+    return iter_voc_entries(session, class_names, dimensions)
+
+
+# ---------------------------------------------------------------------------
+# Importación
+# ---------------------------------------------------------------------------
+
+JSON_READ_SIZE = 1024 * 1024
+_JSON_WHITESPACE = ' \t\n\r'
+
+
+class _JsonStream:
+    """Lectura incremental de un JSON: buffer de texto que se rellena según se consume"""
+
+    def __init__(self, f, read_size):
+        self.f = f
+        self.read_size = read_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(self.read_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Descartar lo ya consumido para que el buffer no crezca con el archivo
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self, skip=_JSON_WHITESPACE):
+        """Siguiente carácter significativo (saltando `skip`), o '' al final"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in skip:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"JSON inválido: se esperaba '{char}'")
+        self.pos += 1
+
+    def value(self):
+        """Decodificar el siguiente valor completo"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # Un número al final del buffer podría continuar en el siguiente bloque
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_json_items(f, read_size=JSON_READ_SIZE):
+    """
+    Recorrer un objeto JSON de primer nivel sin cargarlo entero: produce
+    (clave, elemento) por cada elemento de las listas de primer nivel y
+    (clave, valor) para el resto de claves. `f` es un archivo de texto.
+    """
+    stream = _JsonStream(f, read_size)
+    stream.expect('{')
+    while True:
+        char = stream.peek(_JSON_WHITESPACE + ',')
+        if char == '}':
+            return
+        key = stream.value()
+        stream.expect(':')
+        if stream.peek() != '[':
+            yield key, stream.value()
+            continue
+        stream.pos += 1
+        while stream.peek(_JSON_WHITESPACE + ',') != ']':
+            yield key, stream.value()
+        stream.pos += 1
+
+
+def read_coco(f):
+    """
+    Leer un JSON de COCO en streaming. Devuelve (imágenes {id: (archivo,
+    ancho, alto)}, categorías {id: nombre}, arrays de image_id, category_id y
+    bbox (N, 4)). Las anotaciones iscrowd (regiones de multitud) se omiten.
+    """
+    images, categories = {}, {}
+    image_ids, category_ids, bboxes = array.array('q'), array.array('q'), array.array('d')
+    for key, item in iter_json_items(f):
+        if key == 'annotations' and isinstance(item, dict):
+            bbox = item.get('bbox')
+            if item.get('iscrowd') or not isinstance(bbox, list) or len(bbox) != 4:
+                continue
+            image_ids.append(int(item['image_id']))
+            category_ids.append(int(item['category_id']))
+            bboxes.extend(float(v) for v in bbox)
+        elif key == 'images' and isinstance(item, dict):
+            images[int(item['id'])] = (str(item['file_name']), item.get('width'), item.get('height'))
+        elif key == 'categories' and isinstance(item, dict):
+            categories[int(item['id'])] = str(item['name'])
+    return (
+        images, categories,
+        np.frombuffer(image_ids, dtype=np.int64), np.frombuffer(category_ids, dtype=np.int64),
+        np.frombuffer(bboxes, dtype=np.float64).reshape(-1, 4)
+    )
+
+
+def absolute_to_yolo(corners, widths, heights):
+    """
+    Esquinas absolutas (N, 4: x_min, y_min, x_max, y_max) → (N, 4) YOLO
+    normalizado (xc, yc, w, h) recortado a la imagen y máscara de cajas válidas
+    (dimensiones de imagen conocidas y área positiva tras recortar)
+    """
+    corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4)
+    widths = np.asarray(widths, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    valid = (widths > 0) & (heights > 0)
+    safe_w = np.where(valid, widths, 1.0)
+    safe_h = np.where(valid, heights, 1.0)
+    x1 = np.clip(corners[:, 0] / safe_w, 0, 1)
+    y1 = np.clip(corners[:, 1] / safe_h, 0, 1)
+    x2 = np.clip(corners[:, 2] / safe_w, 0, 1)
+    y2 = np.clip(corners[:, 3] / safe_h, 0, 1)
+    boxes = np.stack([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], axis=1)
+    valid &= (boxes[:, 2] > 0) & (boxes[:, 3] > 0) & np.isfinite(boxes).all(axis=1)
+    return boxes, valid
+
+
+def group_yolo_lines(owners, classes, boxes, num_images):
+    """Líneas YOLO de cada imagen (lista por índice de imagen) a partir de arrays planos"""
+    order = np.argsort(owners, kind='stable')
+    owners, classes, boxes = owners[order], classes[order], boxes[order]
+    bounds = np.searchsorted(owners, np.arange(num_images + 1))
+    class_list = classes.tolist()
+    rows = np.round(boxes, 6).tolist()
+    return [
+        [f"{class_list[i]} {rows[i][0]:.6f} {rows[i][1]:.6f} {rows[i][2]:.6f} {rows[i][3]:.6f}"
+         for i in range(bounds[n], bounds[n + 1])]
+        for n in range(num_images)
+    ]
+
+
+def coco_to_yolo_labels(images, categories, image_ids, category_ids, bboxes, class_positions):
+    """
+    {archivo de COCO: líneas YOLO} de todas las imágenes (también las que no
+    tienen cajas). `class_positions` traduce id de categoría → class_id de la
+    sesión. Devuelve también el número de cajas descartadas.
+    """
+    ordered_ids = np.array(sorted(images), dtype=np.int64)
+    sizes = np.array(
+        [[images[i][1] or 0, images[i][2] or 0] for i in ordered_ids.tolist()], dtype=np.float64
+    ).reshape(-1, 2)
+    category_keys = np.array(sorted(class_positions), dtype=np.int64)
+    category_values = np.array([class_positions[k] for k in category_keys.tolist()], dtype=np.int64)
+
+    # Índice de imagen y de categoría de cada caja con búsquedas vectorizadas
+    owners = np.searchsorted(ordered_ids, image_ids)
+    known = (owners < len(ordered_ids)) & (ordered_ids[np.minimum(owners, len(ordered_ids) - 1)] == image_ids) \
+        if len(ordered_ids) else np.zeros(len(image_ids), dtype=bool)
+    category_index = np.searchsorted(category_keys, category_ids)
+    if len(category_keys):
+        known &= (category_index < len(category_keys)) & \
+            (category_keys[np.minimum(category_index, len(category_keys) - 1)] == category_ids)
+    else:
+        known[:] = False
+
+    owners, bboxes, category_index = owners[known], bboxes[known], category_index[known]
+    corners = np.concatenate([bboxes[:, :2], bboxes[:, :2] + bboxes[:, 2:]], axis=1)
+    boxes, valid = absolute_to_yolo(corners, sizes[owners, 0], sizes[owners, 1])
+    lines = group_yolo_lines(owners[valid], category_values[category_index[valid]], boxes[valid], len(ordered_ids))
+    dropped = len(image_ids) - int(valid.sum())
+    return {images[image_id][0]: image_lines for image_id, image_lines in zip(ordered_ids.tolist(), lines)}, dropped
+
+
+def parse_voc_xml(data):
+    """(archivo, ancho, alto, [(clase, xmin, ymin, xmax, ymax)]) de un XML de Pascal VOC"""
+    root = ET.fromstring(data)
+    filename = (root.findtext('filename') or '').strip()
+    width = int(float(root.findtext('size/width') or 0))
+    height = int(float(root.findtext('size/height') or 0))
+    objects = []
+    for obj in root.iter('object'):
+        box = obj.find('bndbox')
+        if box is None:
+            continue
+        objects.append((
+            (obj.findtext('name') or '').strip(),
+            *(float(box.findtext(k) or 'nan') for k in ('xmin', 'ymin', 'xmax', 'ymax'))
+        ))
+    return filename, width, height, objects
+
+
+def voc_to_yolo_labels(annotations, class_positions):
+    """
+    {archivo: líneas YOLO} de una lista de parse_voc_xml. Coordenadas VOC en
+    base 1 (xmin - 1, ymin - 1 .. xmax, ymax), como las que genera la exportación.
+    """
+    counts = [len(objects) for _, _, _, objects in annotations]
+    owners = np.repeat(np.arange(len(annotations)), counts)
+    objects = [obj for _, _, _, image_objects in annotations for obj in image_objects]
+    classes = np.array([class_positions[obj[0]] for obj in objects], dtype=np.int64)
+    corners = np.array([obj[1:] for obj in objects], dtype=np.float64).reshape(-1, 4)
+    corners[:, :2] -= 1
+    sizes = np.array([[width, height] for _, width, height, _ in annotations], dtype=np.float64).reshape(-1, 2)
+    boxes, valid = absolute_to_yolo(corners, sizes[owners, 0], sizes[owners, 1])
+    lines = group_yolo_lines(owners[valid], classes[valid], boxes[valid], len(annotations))
+    dropped = len(objects) - int(valid.sum())
+    return {filename: image_lines for (filename, _, _, _), image_lines in zip(annotations, lines)}, dropped
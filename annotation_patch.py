@@ -0,0 +1,205 @@
+"""
+Edición de cajas individuales (añadir / modificar / borrar) con control de
+versión optimista y diario de ediciones por sesión para deshacer
+
+- Versión: hash del contenido actual de las etiquetas de la imagen. El cliente
+  envía la versión que leyó; si otra edición (o un save_annotations completo)
+  la cambió entretanto, el parche se rechaza con la versión y cajas actuales.
+  La comprobación y la escritura las hace el almacén de la sesión de forma
+  atómica (ver label_store), también entre varios procesos.
+- Id de caja: hash de la línea YOLO y de su número de aparición; se mantiene
+  aunque se añadan o borren otras cajas y cambia al modificar la propia caja.
+- Diario: annotations/{sesion}/edit_journal.jsonl, solo se añaden líneas. Cada
+  parche guarda únicamente lo necesario para invertirlo (cajas borradas o su
+  valor anterior), no una copia del archivo de etiquetas.
+"""
+import os
+import json
+import time
+import hashlib
+import secrets
+from collections import Counter
+
+from annotation_utils import parse_yolo_line, validate_annotations, YOLO_FIELDS
+from label_store import get_label_store, label_version, VersionConflict
+
+JOURNAL_FILENAME = "edit_journal.jsonl"
+PATCH_OPERATIONS = ('add', 'update', 'delete')
+
+
+class PatchError(ValueError):
+    """Operación de parche inválida"""
+    pass
+
+
+def box_ids(lines):
+    """Ids estables de las cajas: hash de la línea + número de aparición (por duplicados)"""
+    seen = Counter()
+    ids = []
+    for line in lines:
+        seen[line] += 1
+        ids.append(hashlib.sha1(f"{line}#{seen[line]}".encode()).hexdigest()[:12])
+    return ids
+
+
+def boxes_with_ids(lines):
+    """Cajas de la imagen con su id e índice, para que el cliente pueda parchearlas"""
+    boxes = []
+    for index, (box_id, line) in enumerate(zip(box_ids(lines), lines)):
+        box = parse_yolo_line(line)
+        if box:
+            boxes.append({'id': box_id, 'index': index, **dict(zip(YOLO_FIELDS, box))})
+    return boxes
+
+
+def _resolve_target(operation, lines, ids):
+    if 'id' in operation:
+        try:
+            return ids.index(operation['id'])
+        except ValueError:
+            raise PatchError(f"caja {operation['id']} no encontrada")
+    index = operation.get('index')
+    if isinstance(index, bool) or not isinstance(index, int):
+        raise PatchError("se necesita 'id' o 'index' de la caja")
+    if not 0 <= index < len(lines):
+        raise PatchError(f"índice {index} fuera de rango (hay {len(lines)} cajas)")
+    return index
+
+
+def apply_patch(lines, operations):
+    """
+    Aplicar operaciones a las líneas YOLO. Los índices e ids se refieren a las
+    cajas antes del parche; las cajas nuevas se añaden al final.
+    Devuelve (líneas nuevas, cambios para el diario) o lanza PatchError.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise PatchError("se esperaba una lista de operaciones no vacía")
+
+    ids = box_ids(lines)
+    updated, deleted, added = {}, {}, []
+    for number, operation in enumerate(operations):
+        try:
+            if not isinstance(operation, dict) or operation.get('op') not in PATCH_OPERATIONS:
+                raise PatchError(f"'op' debe ser una de {list(PATCH_OPERATIONS)}")
+            if operation['op'] == 'add':
+                added.extend(validate_annotations([operation.get('box')]))
+                continue
+
+            position = _resolve_target(operation, lines, ids)
+            if position in updated or position in deleted:
+                raise PatchError(f"la caja {position} aparece en varias operaciones")
+            if operation['op'] == 'delete':
+                deleted[position] = lines[position]
+            else:
+                current = parse_yolo_line(lines[position])
+                changes = operation.get('box')
+                if current is None or not isinstance(changes, dict):
+                    raise PatchError("se esperaba 'box' con los campos a modificar")
+                updated[position] = validate_annotations([{**dict(zip(YOLO_FIELDS, current)), **changes}])[0]
+        except (PatchError, ValueError) as e:
+            raise PatchError(f"operación {number}: {e}")
+
+    new_lines = [updated.get(i, line) for i, line in enumerate(lines) if i not in deleted] + added
+    changes = (
+        [{'op': 'update', 'index': i, 'before': lines[i], 'after': line} for i, line in sorted(updated.items())]
+        + [{'op': 'delete', 'index': i, 'box': line} for i, line in sorted(deleted.items())]
+        + [{'op': 'add', 'box': line} for line in added]
+    )
+    return new_lines, changes
+
+
+def revert_changes(lines, changes):
+    """Reconstruir las líneas anteriores a un parche a partir de sus cambios"""
+    added = sum(1 for change in changes if change['op'] == 'add')
+    kept = iter(lines[:len(lines) - added])
+    before = {change['index']: change['before'] for change in changes if change['op'] == 'update'}
+    deleted = {change['index']: change['box'] for change in changes if change['op'] == 'delete'}
+
+    restored = []
+    for index in range(len(lines) - added + len(deleted)):
+        if index in deleted:
+            restored.append(deleted[index])
+        else:
+            line = next(kept)
+            restored.append(before.get(index, line))
+    return restored
+
+
+def journal_path(session):
+    return os.path.join("annotations", session, JOURNAL_FILENAME)
+
+
+def _append_journal(session, entry):
+    with open(journal_path(session), 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+def read_journal(session, image_filename=None):
+    """Entradas del diario (de una imagen o de toda la sesión), en orden"""
+    try:
+        f = open(journal_path(session), 'r')
+    except FileNotFoundError:
+        return []
+    needle = json.dumps(image_filename) if image_filename else None
+    entries = []
+    with f:
+        for line in f:
+            # Filtrar por texto antes de parsear: el diario de la sesión puede ser largo
+            if needle and needle not in line:
+                continue
+            entry = json.loads(line)
+            if image_filename is None or entry['image'] == image_filename:
+                entries.append(entry)
+    return entries
+
+
+def patch_labels(session, image_filename, operations, expected_version=None, user_id=None):
+    """Aplicar un parche a las etiquetas de una imagen y registrarlo en el diario"""
+    changes = []
+
+    def apply(lines):
+        new_lines, patch_changes = apply_patch(lines, operations)
+        changes.extend(patch_changes)
+        return new_lines
+
+    version, new_lines = get_label_store(session).update(image_filename, apply, expected_version)
+    new_version = label_version(new_lines)
+    _append_journal(session, {
+        'id': secrets.token_hex(8), 'op': 'patch', 'image': image_filename, 'user_id': user_id,
+        'timestamp': time.time(), 'version_before': version, 'version_after': new_version,
+        'changes': changes
+    })
+    return new_version, new_lines
+
+
+def undo_last_patch(session, image_filename, expected_version=None, user_id=None):
+    """
+    Deshacer el último parche (no deshecho ya) de la imagen. Solo se puede si
+    las etiquetas siguen exactamente como las dejó ese parche.
+    """
+    entries = read_journal(session, image_filename)
+    undone = {entry['undoes'] for entry in entries if entry['op'] == 'undo'}
+    pending = [entry for entry in entries if entry['op'] == 'patch' and entry['id'] not in undone]
+    if not pending:
+        raise PatchError("No hay ediciones que deshacer en esta imagen")
+    target = pending[-1]
+
+    def revert(lines):
+        if label_version(lines) != target['version_after']:
+            raise VersionConflict(
+                "Las anotaciones se modificaron después de la última edición; no se puede deshacer",
+                label_version(lines), lines, image_filename
+            )
+        restored = revert_changes(lines, target['changes'])
+        if label_version(restored) != target['version_before']:
+            raise PatchError("El diario no coincide con las etiquetas; no se puede deshacer")
+        return restored
+
+    version, restored = get_label_store(session).update(image_filename, revert, expected_version)
+    restored_version = label_version(restored)
+    _append_journal(session, {
+        'id': secrets.token_hex(8), 'op': 'undo', 'undoes': target['id'], 'image': image_filename,
+        'user_id': user_id, 'timestamp': time.time(),
+        'version_before': version, 'version_after': restored_version
+    })
+    return restored_version, restored
@@ -0,0 +1,174 @@
+"""
+Utilidades para leer etiquetas YOLO y serializarlas en los formatos de la API
+"""
+import os
+import math
+
+# Campos de cada caja en el formato completo de /visualize
+BOX_FIELDS = ('class_id', 'x1', 'y1', 'x2', 'y2', 'x_center', 'y_center', 'width', 'height')
+
+# Campos por defecto del formato compacto: solo los normalizados, las
+# coordenadas en píxeles se derivan de ellos con el ancho/alto de la imagen
+COMPACT_DEFAULT_FIELDS = ('class_id', 'x_center', 'y_center', 'width', 'height')
+
+RESPONSE_FORMATS = ('full', 'compact')
+
+# Campos que se guardan en cada línea del archivo de etiquetas
+YOLO_FIELDS = ('class_id', 'x_center', 'y_center', 'width', 'height')
+
+
+def parse_yolo_line(line):
+    """Parsear una línea YOLO a (class_id, x_center, y_center, width, height) o None"""
+    parts = line.split()
+    if len(parts) < 5:
+        return None
+    return int(parts[0]), float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4])
+
+
+def read_yolo_labels(label_path, width, height):
+    """
+    Leer un archivo de etiquetas YOLO y devolver las cajas en formato completo
+    (coordenadas normalizadas y en píxeles)
+    """
+    if not os.path.exists(label_path):
+        return []
+
+    with open(label_path, 'r') as f:
+        return boxes_to_annotations(parse_yolo_lines(f, os.path.basename(label_path)), width, height)
+
+
+def parse_yolo_lines(lines, source=''):
+    """Parsear líneas YOLO a tuplas (class_id, x_center, y_center, width, height), saltando las erróneas"""
+    boxes = []
+    for line_num, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            parsed = parse_yolo_line(line)
+        except (ValueError, IndexError) as e:
+            print(f"Error procesando línea {line_num} en {source}: {e}")
+            continue
+        if parsed is not None:
+            boxes.append(parsed)
+    return boxes
+
+
+def boxes_to_annotations(boxes, width, height):
+    """Convertir tuplas YOLO normalizadas a cajas en formato completo (con píxeles)"""
+    annotations = []
+    for class_id, x_center, y_center, bbox_width, bbox_height in boxes:
+        # Convertir de formato YOLO normalizado a píxeles
+        annotations.append({
+            'class_id': class_id,
+            'x1': int((x_center - bbox_width / 2) * width),
+            'y1': int((y_center - bbox_height / 2) * height),
+            'x2': int((x_center + bbox_width / 2) * width),
+            'y2': int((y_center + bbox_height / 2) * height),
+            'x_center': x_center, 'y_center': y_center,
+            'width': bbox_width, 'height': bbox_height
+        })
+    return annotations
+
+
+def parse_fields(fields):
+    """
+    Validar el parámetro `fields=` (lista separada por comas) para sparse fieldsets.
+    Devuelve la tupla de campos (None si no se especifica) o lanza ValueError
+    si alguno no existe.
+    """
+    if not fields:
+        return None
+
+    selected = tuple(f.strip() for f in fields.split(',') if f.strip())
+    invalid = [f for f in selected if f not in BOX_FIELDS]
+    if invalid:
+        raise ValueError(f"Campos inválidos: {invalid}. Disponibles: {list(BOX_FIELDS)}")
+    return selected or None
+
+
+def to_compact_boxes(annotations, fields=COMPACT_DEFAULT_FIELDS):
+    """Convertir una lista de cajas (dicts) a un layout columnar con arrays paralelos"""
+    return {field: [ann[field] for ann in annotations] for field in fields}
+
+
+def serialize_image_entry(image_data, response_format='full', fields=None):
+    """
+    Serializar la entrada de una imagen para la respuesta de /visualize.
+
+    En formato 'full' se devuelve tal cual; en 'compact' las cajas pasan a
+    `boxes` como columnas paralelas y solo con los campos pedidos.
+    """
+    if response_format != 'compact':
+        if fields:
+            return {
+                **image_data,
+                'annotations': [{f: ann[f] for f in fields} for ann in image_data['annotations']]
+            }
+        return image_data
+
+    return {
+        'name': image_data['name'],
+        'width': image_data['width'],
+        'height': image_data['height'],
+        'labels': image_data['labels'],
+        'boxes': to_compact_boxes(image_data['annotations'], fields or COMPACT_DEFAULT_FIELDS)
+    }
+
+
+def label_path_for(session, image_filename):
+    """Ruta del archivo de etiquetas de una imagen de la sesión"""
+    return os.path.join("annotations", session, "labels", os.path.splitext(image_filename)[0] + '.txt')
+
+
+def duplicate_label_stems(image_filenames):
+    """
+    Imágenes que comparten archivo de etiquetas con otra de la lista (a.jpg y
+    a.png → labels/a.txt), como {imagen: las otras con la misma etiqueta}
+    """
+    by_stem = {}
+    for image_filename in image_filenames:
+        by_stem.setdefault(os.path.splitext(image_filename)[0], []).append(image_filename)
+    return {
+        image_filename: [other for other in group if other != image_filename]
+        for group in by_stem.values() if len(group) > 1 for image_filename in group
+    }
+
+
+def format_yolo_labels(annotations):
+    """
+    Líneas YOLO de las anotaciones que tienen todos los campos (el resto se
+    ignora). Las coordenadas se escriben como float (1 → 1.0), igual que las
+    devuelve SQLite, para que la versión de lo guardado no dependa del backend.
+    """
+    return [
+        f"{int(ann['class_id'])} {float(ann['x_center'])} {float(ann['y_center'])} "
+        f"{float(ann['width'])} {float(ann['height'])}"
+        for ann in annotations
+        if all(key in ann for key in YOLO_FIELDS)
+    ]
+
+
+def validate_annotations(annotations):
+    """
+    Validación estricta de una lista de cajas para guardar: todos los campos
+    presentes, class_id entero no negativo y coordenadas numéricas finitas.
+    Devuelve las líneas YOLO o lanza ValueError.
+    """
+    if not isinstance(annotations, list):
+        raise ValueError("las anotaciones deben ser una lista")
+    for index, ann in enumerate(annotations):
+        if not isinstance(ann, dict):
+            raise ValueError(f"anotación {index}: debe ser un objeto")
+        missing = [key for key in YOLO_FIELDS if key not in ann]
+        if missing:
+            raise ValueError(f"anotación {index}: faltan campos {missing}")
+        class_id = ann['class_id']
+        if isinstance(class_id, bool) or not isinstance(class_id, int) or class_id < 0:
+            raise ValueError(f"anotación {index}: class_id inválido")
+        for key in YOLO_FIELDS[1:]:
+            value = ann[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise ValueError(f"anotación {index}: {key} no es un número válido")
+    return format_yolo_labels(annotations)
+
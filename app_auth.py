@@ -1,11 +1,42 @@
 from fastapi import FastAPI, File, UploadFile, Form, Request, BackgroundTasks, Depends, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse, StreamingResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import os
+import asyncio
 from augment_dataset import augment_session, get_session_stats, AVAILABLE_VARIANTS
+from annotation_utils import (
+    boxes_to_annotations, parse_fields, serialize_image_entry, validate_annotations, format_yolo_labels,
+    duplicate_label_stems, RESPONSE_FORMATS
+)
+from label_writer import flush_pending_labels
+from label_store import get_label_store
+from annotation_patch import (
+    patch_labels, undo_last_patch, boxes_with_ids, label_version, PatchError, VersionConflict
+)
+from session_export import iter_export_entries, session_fingerprint, EXPORT_FORMATS
+from training_export import DEFAULT_VAL_RATIO
+from letterbox_export import LETTERBOX_SIZES
+from tiled_export import DEFAULT_TILE_SIZE, DEFAULT_MIN_VISIBILITY, MIN_TILE_SIZE, MAX_TILE_SIZE, default_stride
+from export_manifest import (
+    load_manifest, touch_manifest, write_manifest, write_delta_manifest, iter_delta_entries, check_delta_options,
+    UnknownExportToken, ExportOptionsMismatch
+)
+from zip_stream import stream_zip, COMPRESSION_PRESETS, EXPORT_COMPRESSION
+from export_cache import export_cache, cache_key
+from image_processing import (
+    create_canvas_with_image, image_to_base64, process_upload, spool_upload,
+    build_preview, get_thumbnail_path, upload_executor, UploadTooLarge, ImageRejected, rejection_metrics,
+    MAX_UPLOAD_WORKERS, MAX_FILE_SIZE, MAX_FILE_SIZE_MB, PREVIEW_MODES, THUMBNAIL_SIZES
+)
+from image_store import dedup_report, release_session, collect_garbage
+from import_dataset import read_class_names, detect_dataset_format, run_import_job, MAX_IMPORT_SIZE
+from chunked_uploads import (
+    create_upload, write_chunk, finalize_upload, discard_upload, expire_uploads,
+    ChunkedUploadError, load_meta as load_upload_meta, get_status as get_upload_status
+)
 from PIL import Image, ImageDraw
 import numpy as np
 import random
@@ -13,15 +44,18 @@ import io
 import base64
 import json
 import zipfile
+from urllib.parse import quote
 from datetime import datetime
 import shutil
+import tempfile
 from sqlalchemy.orm import Session
+from typing import List, Optional
 
 # Importar módulos de autenticación
-from auth.database import create_tables, get_db
+from auth.database import create_tables, get_db, SessionLocal
 from auth.models import User, UserSession
 from auth.routes import router as auth_router
-from auth.classes_routes import router as classes_router
+from auth.classes_routes import router as classes_router, ensure_session_classes, session_class_names
 from auth.session_routes import router as hash_sessions_router
 from auth.dependencies import get_current_user, get_optional_user, verify_session_access
 
@@ -59,6 +93,14 @@ os.makedirs("temp", exist_ok=True)
 # Crear tablas de base de datos
 create_tables()
 
+# Limpiar subidas por fragmentos abandonadas
+expire_uploads()
+
+@app.on_event("shutdown")
+def flush_labels_on_shutdown():
+    """Escribir los guardados de etiquetas agrupados que sigan pendientes"""
+    flush_pending_labels()
+
 # Funciones auxiliares (copiadas del original)
 def create_session_structure(session_name, user_id=None, db=None):
     """Crear estructura de sesión y asociarla con usuario"""
@@ -83,64 +125,13 @@ def create_session_structure(session_name, user_id=None, db=None):
     
     return session_path
 
-def random_color():
-    return tuple(random.randint(0, 255) for _ in range(3))
-
-def create_canvas_with_image(image_bytes, size, x, y, change_bg=True, max_size=800):
-    """Crear canvas con imagen redimensionada automáticamente"""
-    bg_color = random_color() if change_bg else (200, 200, 200)
-    canvas = Image.new('RGB', size, bg_color)
-    
-    # Cargar imagen subida (soporta múltiples formatos incluyendo WebP)
-    img = Image.open(io.BytesIO(image_bytes))
-    
-    # Convertir a RGB si es necesario (para WebP con transparencia, etc.)
-    if img.mode in ('RGBA', 'LA', 'P'):
-        # Crear fondo blanco para transparencias
-        background = Image.new('RGB', img.size, (255, 255, 255))
-        if img.mode == 'P':
-            img = img.convert('RGBA')
-        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-        img = background
-    elif img.mode != 'RGB':
-        img = img.convert('RGB')
-    
-    # Redimensionar imagen si es muy grande manteniendo aspecto
-    original_width, original_height = img.size
-    
-    # Calcular nuevo tamaño manteniendo proporción
-    if original_width > max_size or original_height > max_size:
-        ratio = min(max_size / original_width, max_size / original_height)
-        new_width = int(original_width * ratio)
-        new_height = int(original_height * ratio)
-        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-    
-    # Centrar imagen si es menor que el canvas
-    canvas_width, canvas_height = size
-    img_width, img_height = img.size
-    
-    # Calcular posición centrada o usar coordenadas proporcionadas
-    if x == 0 and y == 0:  # Auto-centrar
-        paste_x = (canvas_width - img_width) // 2
-        paste_y = (canvas_height - img_height) // 2
-    else:
-        # Usar coordenadas proporcionadas pero asegurar que la imagen esté dentro
-        paste_x = min(x, canvas_width - img_width)
-        paste_y = min(y, canvas_height - img_height)
-    
-    paste_x = max(0, paste_x)
-    paste_y = max(0, paste_y)
-    
-    # Pegar imagen en canvas
-    canvas.paste(img, (paste_x, paste_y))
-    
-    return canvas
-
-def image_to_base64(pil_image):
-    buffer = io.BytesIO()
-    pil_image.save(buffer, format='JPEG', quality=90)
-    img_data = base64.b64encode(buffer.getvalue()).decode()
-    return f"data:image/jpeg;base64,{img_data}"
+def get_session_owner_id(session_name, db, default=None):
+    """Usuario propietario de la sesión (sus clases son las de la sesión)"""
+    owner = db.query(UserSession.user_id).filter(
+        UserSession.session_name == session_name,
+        UserSession.is_active == True
+    ).first()
+    return owner[0] if owner else default
 
 def get_user_sessions_list(user: User, db: Session):
     """Obtener lista de nombres de sesiones del usuario (para compatibilidad)"""
@@ -263,6 +254,21 @@ async def auth_middleware(request: Request, call_next):
     response = await call_next(request)
     return response
 
+@app.middleware("http")
+async def upload_size_middleware(request: Request, call_next):
+    """Rechazar subidas demasiado grandes por Content-Length antes de leer el cuerpo"""
+    # En /api/upload/batch el límite se aplica por archivo al copiarlo
+    if request.method == "POST" and request.url.path == "/api/upload":
+        content_length = request.headers.get("content-length")
+        # Margen de 1 MB para el resto de campos del formulario multipart
+        if content_length and content_length.isdigit() and int(content_length) > MAX_FILE_SIZE + 1024 * 1024:
+            return JSONResponse(
+                status_code=413,
+                content={"success": False, "message": f"El archivo supera el tamaño máximo de {MAX_FILE_SIZE_MB} MB"}
+            )
+    
+    return await call_next(request)
+
 # ============================================================================
 # ENDPOINTS PRINCIPALES
 # ============================================================================
@@ -317,7 +323,6 @@ async def sessions_page(
             session_path = os.path.join(sessions_dir, session_name)
             if os.path.isdir(session_path):
                 images_path = os.path.join(session_path, "images")
-                labels_path = os.path.join(session_path, "labels")
                 
                 image_count = 0
                 label_count = 0
@@ -326,9 +331,7 @@ async def sessions_page(
                     image_count = len([f for f in os.listdir(images_path) 
                                      if f.lower().endswith(('.jpg', '.jpeg', '.png'))])
                 
-                if os.path.exists(labels_path):
-                    label_count = len([f for f in os.listdir(labels_path) 
-                                     if f.lower().endswith('.txt')])
+                label_count = get_label_store(session_name).count_labeled()
                 
                 sessions.append({
                     'name': session_name,
@@ -510,15 +513,12 @@ async def list_sessions_api(
             
             if os.path.isdir(session_path):
                 images_path = os.path.join(session_path, "images")
-                labels_path = os.path.join(session_path, "labels")
                 
                 if os.path.exists(images_path):
                     images_count = len([f for f in os.listdir(images_path) 
                                       if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'))])
                 
-                if os.path.exists(labels_path):
-                    labels_count = len([f for f in os.listdir(labels_path) 
-                                      if f.lower().endswith('.txt')])
+                labels_count = get_label_store(session_name).count_labeled()
             
             session_data = {
                 'name': session_name,
@@ -553,18 +553,33 @@ async def get_session_visualize_data(
     session_name: str, 
     limit: int = None, 
     offset: int = 0,
+    format: str = "full",
+    fields: str = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """API endpoint para obtener datos de visualización de una sesión"""
+    """
+    API endpoint para obtener datos de visualización de una sesión.
+    
+    - format=full (por defecto): cada caja como dict con coordenadas normalizadas y en píxeles
+    - format=compact: layout columnar por imagen (`boxes`) sin campos derivados duplicados
+    - fields=class_id,x_center,...: sparse fieldset de campos de caja
+    """
     try:
+        if format not in RESPONSE_FORMATS:
+            return {"success": False, "message": f"Formato inválido: {format}. Disponibles: {list(RESPONSE_FORMATS)}"}
+        
+        try:
+            selected_fields = parse_fields(fields)
+        except ValueError as e:
+            return {"success": False, "message": str(e)}
+        
         # Verificar acceso a la sesión
         if not verify_session_access(current_user, session_name, db):
             return {"success": False, "message": "No tienes acceso a esta sesión"}
         
         session_path = os.path.join("annotations", session_name)
         images_path = os.path.join(session_path, "images")
-        labels_path = os.path.join(session_path, "labels")
         
         if not os.path.exists(session_path):
             return {"success": False, "message": f"Sesión '{session_name}' no encontrada"}
@@ -573,62 +588,32 @@ async def get_session_visualize_data(
         total_labels = 0
         
         if os.path.exists(images_path):
-            for filename in os.listdir(images_path):
-                if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    # Obtener dimensiones de la imagen
-                    from PIL import Image as PILImage
-                    image_path = os.path.join(images_path, filename)
-                    
-                    try:
-                        with PILImage.open(image_path) as img:
-                            width, height = img.size
-                    except:
-                        width, height = 640, 640  # Default si hay error
-                    
-                    # Leer etiquetas para esta imagen
-                    label_filename = os.path.splitext(filename)[0] + '.txt'
-                    label_path = os.path.join(labels_path, label_filename)
-                    
-                    annotations = []
-                    if os.path.exists(label_path):
-                        with open(label_path, 'r') as f:
-                            for line_num, line in enumerate(f):
-                                line = line.strip()
-                                if line:
-                                    try:
-                                        parts = line.split()
-                                        if len(parts) >= 5:
-                                            class_id = int(parts[0])
-                                            x_center = float(parts[1])
-                                            y_center = float(parts[2])
-                                            bbox_width = float(parts[3])
-                                            bbox_height = float(parts[4])
-                                            
-                                            # Convertir de formato YOLO normalizado a píxeles
-                                            x1 = int((x_center - bbox_width/2) * width)
-                                            y1 = int((y_center - bbox_height/2) * height)
-                                            x2 = int((x_center + bbox_width/2) * width)
-                                            y2 = int((y_center + bbox_height/2) * height)
-                                            
-                                            annotations.append({
-                                                'class_id': class_id,
-                                                'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2,
-                                                'x_center': x_center, 'y_center': y_center,
-                                                'width': bbox_width, 'height': bbox_height
-                                            })
-                                    except (ValueError, IndexError) as e:
-                                        print(f"Error procesando línea {line_num} en {label_filename}: {e}")
-                                        continue
-                    
-                    total_labels += len(annotations)
-                    
-                    images_data.append({
-                        'name': filename,
-                        'labels': len(annotations),
-                        'annotations': annotations,
-                        'width': width,
-                        'height': height
-                    })
+            image_files = [f for f in os.listdir(images_path) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+            # Todas las etiquetas de la sesión en una sola lectura del almacén
+            session_boxes = get_label_store(session_name).load_boxes_many(image_files)
+            for filename in image_files:
+                # Obtener dimensiones de la imagen
+                from PIL import Image as PILImage
+                image_path = os.path.join(images_path, filename)
+                
+                try:
+                    with PILImage.open(image_path) as img:
+                        width, height = img.size
+                except:
+                    width, height = 640, 640  # Default si hay error
+                
+                # Etiquetas de esta imagen
+                annotations = boxes_to_annotations(session_boxes.get(filename, []), width, height)
+                
+                total_labels += len(annotations)
+                
+                images_data.append({
+                    'name': filename,
+                    'labels': len(annotations),
+                    'annotations': annotations,
+                    'width': width,
+                    'height': height
+                })
         
         # Aplicar paginación si se especifica
         images_to_return = images_data
@@ -636,9 +621,16 @@ async def get_session_visualize_data(
             end_index = offset + limit
             images_to_return = images_data[offset:end_index]
         
+        if format == "compact" or selected_fields:
+            images_to_return = [
+                serialize_image_entry(image_data, format, selected_fields)
+                for image_data in images_to_return
+            ]
+        
         return {
             "success": True,
             "session_name": session_name,
+            "format": format,
             "total_images": len(images_data),
             "total_labels": total_labels,
             "returned_images": len(images_to_return),
@@ -696,59 +688,431 @@ async def upload_image(
     x: int = Form(0),
     y: int = Form(0),
     change_bg: bool = Form(True),
+    preview_mode: str = Form(None),
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Subir imagen a sesión del usuario"""
+    """
+    Subir imagen a sesión del usuario.
+    
+    preview_mode (o PREVIEW_MODE por defecto): 'url' devuelve la URL cacheable de
+    la imagen y de su miniatura, 'inline' una miniatura pequeña en base64, 'none' nada.
+    """
     try:
+        if preview_mode and preview_mode not in PREVIEW_MODES:
+            return {"success": False, "message": f"Modo de vista previa inválido: {preview_mode}. Disponibles: {list(PREVIEW_MODES)}"}
+        
         # Verificar acceso a la sesión
         if not verify_session_access(current_user, session, db):
             return {"success": False, "message": "No tienes acceso a esta sesión"}
         
-        # Leer archivo
-        image_bytes = await file.read()
+        # Copiar archivo por bloques a un temporal con límite de tamaño
+        try:
+            spooled = await spool_upload(file)
+        except UploadTooLarge as e:
+            return {"success": False, "message": str(e)}
+        
+        # Crear imagen con canvas (decodificando desde el temporal) y guardarla en la sesión.
+        # La cabecera se valida antes de decodificar nada
+        try:
+            result = process_upload(
+                spooled, file.filename, session, (canvas_width, canvas_height), x, y, change_bg
+            )
+        except ImageRejected as e:
+            return {"success": False, "message": str(e)}
+        finally:
+            spooled.close()
         
-        # Crear imagen con canvas
-        canvas_image = create_canvas_with_image(
-            image_bytes, (canvas_width, canvas_height), x, y, change_bg
+        image_filename = result["filename"]
+        return {
+            "success": True,
+            "filename": image_filename,
+            "duplicate": result["duplicate"],
+            **build_preview(session, image_filename, result["canvas"], preview_mode),
+            "message": (f"Imagen ya existente en sesión '{session}'" if result["duplicate"]
+                        else f"Imagen subida a sesión '{session}'")
+        }
+        
+    except Exception as e:
+        return {"success": False, "message": f"Error al subir imagen: {str(e)}"}
+
+@app.post("/api/upload/batch")
+async def upload_images_batch(
+    session: str = Form(...),
+    canvas_width: int = Form(640),
+    canvas_height: int = Form(640),
+    x: int = Form(0),
+    y: int = Form(0),
+    change_bg: bool = Form(True),
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Subir varias imágenes en una sola petición multipart.
+    
+    Las imágenes se procesan en paralelo en el pool de workers (como máximo
+    MAX_UPLOAD_WORKERS a la vez) y el resultado de cada archivo se envía en
+    cuanto termina, una línea JSON por archivo (application/x-ndjson).
+    """
+    # Verificar acceso a la sesión (una sola vez para todo el lote)
+    if not verify_session_access(current_user, session, db):
+        return {"success": False, "message": "No tienes acceso a esta sesión"}
+    
+    # FastAPI cierra los UploadFile al terminar el handler, antes de que se
+    # consuma la respuesta en streaming: copiarlos a temporales propios
+    pending = []
+    for index, upload in enumerate(files):
+        try:
+            pending.append((index, upload.filename, await spool_upload(upload)))
+        except UploadTooLarge as e:
+            pending.append((index, upload.filename, e))
+    
+    semaphore = asyncio.Semaphore(MAX_UPLOAD_WORKERS)
+    loop = asyncio.get_running_loop()
+    
+    async def process_one(index, original_filename, spooled):
+        if isinstance(spooled, UploadTooLarge):
+            return {"index": index, "success": False, "original": original_filename, "message": str(spooled)}
+        async with semaphore:
+            try:
+                result = await loop.run_in_executor(
+                    upload_executor, process_upload,
+                    spooled, original_filename, session,
+                    (canvas_width, canvas_height), x, y, change_bg
+                )
+                return {"index": index, "success": True, "original": original_filename,
+                        "filename": result["filename"], "duplicate": result["duplicate"],
+                        **build_preview(session, result["filename"], None, "url")}
+            except ImageRejected as e:
+                return {"index": index, "success": False, "original": original_filename, "message": str(e)}
+            except Exception as e:
+                return {"index": index, "success": False, "original": original_filename,
+                        "message": f"Error al subir imagen: {str(e)}"}
+            finally:
+                spooled.close()
+    
+    async def stream_results():
+        tasks = [asyncio.create_task(process_one(*item)) for item in pending]
+        completed = 0
+        uploaded = 0
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            completed += 1
+            uploaded += result["success"]
+            yield json.dumps({**result, "completed": completed, "total": len(files)}) + "\n"
+        yield json.dumps({
+            "done": True,
+            "success": uploaded == len(files),
+            "uploaded": uploaded,
+            "failed": len(files) - uploaded,
+            "total": len(files),
+            "message": f"{uploaded} de {len(files)} imágenes subidas a sesión '{session}'"
+        }) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+# ============================================================================
+# SUBIDAS REANUDABLES POR FRAGMENTOS
+# ============================================================================
+def chunked_upload_error(e: ChunkedUploadError):
+    content = {"success": False, "message": str(e)}
+    if e.offset is not None:
+        content["offset"] = e.offset
+    return JSONResponse(status_code=e.status_code, content=content)
+
+def get_owned_upload(upload_id: str, current_user: User):
+    """Cargar la subida y verificar que pertenece al usuario (o es admin)"""
+    meta = load_upload_meta(upload_id)
+    if meta["user_id"] != current_user.id and not current_user.is_admin:
+        raise ChunkedUploadError("Subida no encontrada o expirada", 404)
+    return meta
+
+@app.post("/api/uploads")
+async def create_chunked_upload(
+    session: str = Form(...),
+    filename: str = Form(...),
+    total_size: int = Form(...),
+    kind: str = Form("image"),
+    canvas_width: int = Form(640),
+    canvas_height: int = Form(640),
+    x: int = Form(0),
+    y: int = Form(0),
+    change_bg: bool = Form(True),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Iniciar una subida reanudable. Después el cliente envía el archivo con
+    PUT /api/uploads/{upload_id}?offset=N (cuerpo binario, en fragmentos) y
+    termina con POST /api/uploads/{upload_id}/finalize.
+    """
+    if not verify_session_access(current_user, session, db):
+        return {"success": False, "message": "No tienes acceso a esta sesión"}
+    
+    try:
+        status = create_upload(session, filename, total_size, current_user.id, kind, {
+            "canvas_width": canvas_width, "canvas_height": canvas_height,
+            "x": x, "y": y, "change_bg": change_bg
+        })
+    except ChunkedUploadError as e:
+        return chunked_upload_error(e)
+    
+    return {"success": True, **status}
+
+@app.get("/api/uploads/{upload_id}")
+async def get_chunked_upload_status(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Estado de una subida: el cliente reanuda desde `offset`"""
+    try:
+        get_owned_upload(upload_id, current_user)
+        return {"success": True, **get_upload_status(upload_id)}
+    except ChunkedUploadError as e:
+        return chunked_upload_error(e)
+
+@app.put("/api/uploads/{upload_id}")
+async def put_chunked_upload(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Escribir un fragmento en la posición `offset`, leyendo el cuerpo en streaming"""
+    try:
+        get_owned_upload(upload_id, current_user)
+        status = await write_chunk(upload_id, offset, request.stream())
+        return {"success": True, **status}
+    except ChunkedUploadError as e:
+        return chunked_upload_error(e)
+
+@app.post("/api/uploads/{upload_id}/finalize")
+async def finalize_chunked_upload(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    preview_mode: str = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Completar la subida y entregarla al pipeline de canvas/guardado
+    (kind='image') o a la importación masiva de datasets (kind='archive')
+    """
+    try:
+        get_owned_upload(upload_id, current_user)
+        meta, data_path = finalize_upload(upload_id)
+    except ChunkedUploadError as e:
+        return chunked_upload_error(e)
+    
+    session = meta["session"]
+    if not verify_session_access(current_user, session, db):
+        return {"success": False, "message": "No tienes acceso a esta sesión"}
+    
+    if meta["kind"] == "archive":
+        return start_import_job(
+            data_path, session, current_user, db, background_tasks,
+            cleanup=lambda: discard_upload(upload_id)
         )
+    
+    params = meta["params"]
+    try:
+        loop = asyncio.get_running_loop()
+        with open(data_path, 'rb') as f:
+            result = await loop.run_in_executor(
+                upload_executor, process_upload,
+                f, meta["filename"], session,
+                (params["canvas_width"], params["canvas_height"]),
+                params["x"], params["y"], params["change_bg"]
+            )
+    except ImageRejected as e:
+        discard_upload(upload_id)
+        return {"success": False, "message": str(e)}
+    except Exception as e:
+        return {"success": False, "message": f"Error al procesar imagen: {str(e)}"}
+    
+    discard_upload(upload_id)
+    
+    return {
+        "success": True,
+        "filename": result["filename"],
+        "duplicate": result["duplicate"],
+        **build_preview(session, result["filename"], result["canvas"], preview_mode),
+        "message": f"Imagen subida a sesión '{session}'"
+    }
+
+@app.delete("/api/uploads/{upload_id}")
+async def abort_chunked_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Cancelar una subida y borrar sus datos de staging"""
+    try:
+        get_owned_upload(upload_id, current_user)
+    except ChunkedUploadError as e:
+        return chunked_upload_error(e)
+    
+    discard_upload(upload_id)
+    return {"success": True, "message": "Subida cancelada"}
+
+# ============================================================================
+# IMPORTACIÓN DE DATASETS
+# ============================================================================
+def start_import_job(zip_source, session, current_user, db, background_tasks, cleanup=None):
+    """
+    Preparar la importación de un ZIP (YOLO, COCO o Pascal VOC): crear la
+    sesión y, en YOLO, las clases que falten (una sola inserción), y lanzar
+    la importación en background. En COCO y VOC las clases salen de las
+    anotaciones y se crean durante la importación.
+    """
+    try:
+        with zipfile.ZipFile(zip_source) as zf:
+            dataset_format = detect_dataset_format(zf)
+            class_names = read_class_names(zf) if dataset_format == 'yolo' else None
+    except zipfile.BadZipFile:
+        if cleanup:
+            cleanup()
+        return {"success": False, "message": "El archivo no es un ZIP válido"}
+    
+    create_session_structure(session)
+    class_map = None
+    if class_names:
+        class_map = ensure_session_classes(current_user.id, session, class_names, db)
+    
+    user_id = current_user.id
+    def resolve_classes(names):
+        # La tarea corre tras la respuesta, con la sesión de la petición ya cerrada
+        job_db = SessionLocal()
+        try:
+            return ensure_session_classes(user_id, session, names, job_db)
+        finally:
+            job_db.close()
+    
+    background_tasks.add_task(run_import_job, zip_source, session, class_map, cleanup, resolve_classes)
+    return {
+        "success": True,
+        "message": f"Importación iniciada en sesión '{session}'",
+        "session": session,
+        "format": dataset_format,
+        "classes": class_names or [],
+        "progress_url": f"/api/import/progress/{session}"
+    }
+
+@app.post("/api/import/yolo")
+@app.post("/api/import/dataset")
+async def import_yolo_dataset(
+    background_tasks: BackgroundTasks,
+    session: str = Form(...),
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Importar un dataset en ZIP: YOLO (images/, labels/, classes.txt o
+    data.yaml), COCO (JSON de instancias) o Pascal VOC (XML por imagen); el
+    formato se detecta por el contenido. Para archivos grandes usar la subida
+    reanudable con kind='archive'.
+    """
+    try:
+        if not verify_session_access(current_user, session, db):
+            return {"success": False, "message": "No tienes acceso a esta sesión"}
         
-        # Generar nombre único de archivo
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        image_filename = f"{session}_{timestamp}_{file.filename}"
+        try:
+            spooled = await spool_upload(file, max_bytes=MAX_IMPORT_SIZE)
+        except UploadTooLarge as e:
+            return {"success": False, "message": str(e)}
         
-        # Guardar imagen
-        session_path = os.path.join("annotations", session)
-        image_path = os.path.join(session_path, "images", image_filename)
+        return start_import_job(spooled, session, current_user, db, background_tasks, cleanup=spooled.close)
         
-        # Crear directorio si no existe
-        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+    except Exception as e:
+        return {"success": False, "message": f"Error al importar dataset: {str(e)}"}
+
+@app.get("/api/import/progress/{session}")
+async def get_import_progress(
+    session: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Obtener progreso e informe de la importación"""
+    try:
+        if not verify_session_access(current_user, session, db):
+            return {"success": False, "message": "No tienes acceso a esta sesión"}
         
-        canvas_image.save(image_path)
+        progress_file = f"temp/progress_import_{session}.json"
+        if not os.path.exists(progress_file):
+            return {"success": False, "message": "No hay importación activa"}
         
-        # Convertir a base64 para vista previa
-        preview_b64 = image_to_base64(canvas_image)
+        with open(progress_file, 'r') as f:
+            progress_data = json.load(f)
         
-        return {
-            "success": True,
-            "filename": image_filename,
-            "preview": preview_b64,
-            "message": f"Imagen subida a sesión '{session}'"
-        }
+        return {"success": True, **progress_data}
         
     except Exception as e:
-        return {"success": False, "message": f"Error al subir imagen: {str(e)}"}
+        return {"success": False, "message": f"Error al obtener progreso: {str(e)}"}
+
+@app.get("/api/preview/{session}/{filename}")
+async def get_image_preview(
+    request: Request,
+    session: str,
+    filename: str,
+    max_size: int = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Servir la imagen guardada (o su miniatura con ?max_size=N) con cabeceras de caché.
+    Las miniaturas se generan una sola vez y se guardan en temp/thumbnails/;
+    max_size tiene que ser uno de THUMBNAIL_SIZES.
+    """
+    if not verify_session_access(current_user, session, db):
+        raise HTTPException(status_code=403, detail="No tienes acceso a esta sesión")
+    
+    if filename != os.path.basename(filename) or session != os.path.basename(session):
+        raise HTTPException(status_code=400, detail="Nombre de archivo inválido")
+    
+    if max_size and max_size not in THUMBNAIL_SIZES:
+        raise HTTPException(
+            status_code=400, detail=f"Tamaño de miniatura inválido: {max_size}. Disponibles: {list(THUMBNAIL_SIZES)}"
+        )
+    
+    if max_size:
+        loop = asyncio.get_running_loop()
+        image_path = await loop.run_in_executor(upload_executor, get_thumbnail_path, session, filename, max_size)
+    else:
+        image_path = os.path.join("annotations", session, "images", filename)
+    
+    if not image_path or not os.path.exists(image_path):
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    
+    response = FileResponse(
+        image_path,
+        stat_result=os.stat(image_path),
+        headers={"Cache-Control": "private, max-age=86400"}
+    )
+    
+    # Revalidación: si el cliente ya tiene esta versión, no reenviar el archivo
+    if request.headers.get("if-none-match") == response.headers.get("etag"):
+        return Response(status_code=304, headers={
+            "ETag": response.headers["etag"],
+            "Cache-Control": response.headers["cache-control"]
+        })
+    
+    return response
 
 @app.post("/api/save_annotations")
 async def save_annotations(
     session: str = Form(...),
     filename: str = Form(...),
     annotations: str = Form(...),
+    version: str = Form(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Guardar anotaciones de una imagen"""
+    """
+    Guardar anotaciones de una imagen. Con `version` (la de GET o del guardado
+    anterior) se rechaza con 409 si las anotaciones cambiaron entretanto.
+    """
     try:
         # Verificar acceso a la sesión
         if not verify_session_access(current_user, session, db):
@@ -761,32 +1125,224 @@ async def save_annotations(
             return {"success": False, "message": "Formato de anotaciones inválido"}
         
         # Preparar contenido del archivo de etiquetas
-        label_content = []
-        for ann in annotations_data:
-            if all(key in ann for key in ['class_id', 'x_center', 'y_center', 'width', 'height']):
-                label_line = f"{ann['class_id']} {ann['x_center']} {ann['y_center']} {ann['width']} {ann['height']}"
-                label_content.append(label_line)
+        label_content = format_yolo_labels(annotations_data)
         
-        # Guardar archivo de etiquetas
-        session_path = os.path.join("annotations", session)
-        label_filename = os.path.splitext(filename)[0] + '.txt'
-        label_path = os.path.join(session_path, "labels", label_filename)
+        # Guardar en el almacén de la sesión (txt: escritura atómica; con
+        # LABEL_WRITE_COALESCE_MS los autosaves sin versión se agrupan)
+        try:
+            get_label_store(session).save(filename, label_content, version)
+        except VersionConflict as e:
+            return version_conflict_response(e)
         
-        # Crear directorio si no existe
-        os.makedirs(os.path.dirname(label_path), exist_ok=True)
+        return {
+            "success": True,
+            "message": f"Anotaciones guardadas para {filename}",
+            "annotations_count": len(label_content),
+            "version": label_version(label_content)
+        }
         
-        with open(label_path, 'w') as f:
-            f.write('\n'.join(label_content))
+    except Exception as e:
+        return {"success": False, "message": f"Error al guardar anotaciones: {str(e)}"}
+
+@app.post("/api/save_annotations/batch")
+async def save_annotations_batch(
+    session: str = Form(...),
+    annotations: str = Form(...),
+    versions: str = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Guardar anotaciones de muchas imágenes en una petición.
+    `annotations` es un JSON {nombre_imagen: [anotaciones]}. Se valida todo
+    antes de escribir y los archivos se escriben en modo todo o nada.
+    `versions` (opcional) es un JSON {nombre_imagen: versión}: si alguna de
+    esas imágenes cambió no se guarda nada y se responde 409.
+    """
+    try:
+        # Verificar acceso a la sesión (una sola vez para todo el lote)
+        if not verify_session_access(current_user, session, db):
+            return {"success": False, "message": "No tienes acceso a esta sesión"}
+        
+        try:
+            annotations_map = json.loads(annotations)
+        except json.JSONDecodeError:
+            return {"success": False, "message": "Formato de anotaciones inválido"}
+        if not isinstance(annotations_map, dict) or not annotations_map:
+            return {"success": False, "message": "Se esperaba un objeto {imagen: anotaciones} no vacío"}
+        try:
+            versions_map = json.loads(versions) if versions else {}
+        except json.JSONDecodeError:
+            return {"success": False, "message": "Formato de versiones inválido"}
+        if not isinstance(versions_map, dict) or not all(
+            filename in annotations_map and isinstance(value, str) for filename, value in versions_map.items()
+        ):
+            return {"success": False, "message": "Se esperaba un objeto {imagen del lote: versión}"}
+        
+        images_path = os.path.join("annotations", session, "images")
+        labels = {}
+        errors = {}
+        for filename, image_annotations in annotations_map.items():
+            if os.path.basename(filename) != filename or filename in ('', '.', '..'):
+                errors[filename] = "nombre de archivo inválido"
+            elif not os.path.exists(os.path.join(images_path, filename)):
+                errors[filename] = "la imagen no existe en la sesión"
+            else:
+                try:
+                    labels[filename] = validate_annotations(image_annotations)
+                except ValueError as e:
+                    errors[filename] = str(e)
+        
+        # a.jpg y a.png comparten labels/a.txt: no se sabría cuál guardar
+        for filename, others in duplicate_label_stems(annotations_map).items():
+            errors.setdefault(filename, f"usa el mismo archivo de etiquetas que {', '.join(others)}")
+        
+        if errors:
+            return {
+                "success": False,
+                "message": f"{len(errors)} imágenes con anotaciones inválidas; no se guardó nada",
+                "errors": errors
+            }
+        
+        label_store = get_label_store(session)
+        try:
+            label_store.save_many(labels, versions_map)
+        except VersionConflict as e:
+            return version_conflict_response(e)
+        label_store.update_index(list(labels))
         
         return {
             "success": True,
-            "message": f"Anotaciones guardadas para {filename}",
-            "annotations_count": len(label_content)
+            "message": f"Anotaciones guardadas para {len(labels)} imágenes",
+            "saved": len(labels),
+            "annotations_count": sum(len(lines) for lines in labels.values()),
+            "versions": {filename: label_version(lines) for filename, lines in labels.items()}
         }
         
     except Exception as e:
         return {"success": False, "message": f"Error al guardar anotaciones: {str(e)}"}
 
+def session_image_error(session: str, filename: str):
+    """Mensaje de error si `filename` no es una imagen existente de la sesión (o None)"""
+    if os.path.basename(filename) != filename or filename in ('', '.', '..'):
+        return "Nombre de archivo inválido"
+    if not os.path.exists(os.path.join("annotations", session, "images", filename)):
+        return f"La imagen '{filename}' no existe en la sesión"
+    return None
+
+def version_conflict_response(e: VersionConflict):
+    return JSONResponse(status_code=409, content={
+        "success": False,
+        "message": str(e),
+        "filename": e.image,
+        "version": e.version,
+        "boxes": boxes_with_ids(e.lines)
+    })
+
+@app.get("/api/annotations/{session}/{filename}")
+async def get_image_annotations(
+    session: str,
+    filename: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Cajas de una imagen con su id estable y la versión actual (para PATCH)"""
+    try:
+        if not verify_session_access(current_user, session, db):
+            return {"success": False, "message": "No tienes acceso a esta sesión"}
+        error = session_image_error(session, filename)
+        if error:
+            return {"success": False, "message": error}
+        
+        lines = get_label_store(session).load(filename) or []
+        return {
+            "success": True,
+            "filename": filename,
+            "version": label_version(lines),
+            "boxes": boxes_with_ids(lines)
+        }
+        
+    except Exception as e:
+        return {"success": False, "message": f"Error al leer anotaciones: {str(e)}"}
+
+@app.patch("/api/annotations/{session}/{filename}")
+async def patch_image_annotations(
+    session: str,
+    filename: str,
+    operations: str = Form(...),
+    version: str = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Añadir, modificar o borrar cajas sueltas de una imagen.
+    `operations` es un JSON [{"op": "add", "box": {...}}, {"op": "update",
+    "id" | "index": ..., "box": {campos}}, {"op": "delete", "id" | "index": ...}].
+    Con `version` (la devuelta por GET o por el parche anterior) se rechaza
+    con 409 si las anotaciones cambiaron entretanto.
+    """
+    try:
+        if not verify_session_access(current_user, session, db):
+            return {"success": False, "message": "No tienes acceso a esta sesión"}
+        error = session_image_error(session, filename)
+        if error:
+            return {"success": False, "message": error}
+        
+        try:
+            operations_data = json.loads(operations)
+        except json.JSONDecodeError:
+            return {"success": False, "message": "Formato de operaciones inválido"}
+        
+        try:
+            new_version, lines = patch_labels(session, filename, operations_data, version, current_user.id)
+        except VersionConflict as e:
+            return version_conflict_response(e)
+        except PatchError as e:
+            return {"success": False, "message": str(e)}
+        
+        return {
+            "success": True,
+            "filename": filename,
+            "version": new_version,
+            "boxes": boxes_with_ids(lines)
+        }
+        
+    except Exception as e:
+        return {"success": False, "message": f"Error al editar anotaciones: {str(e)}"}
+
+@app.post("/api/annotations/{session}/{filename}/undo")
+async def undo_image_annotations(
+    session: str,
+    filename: str,
+    version: str = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Deshacer la última edición por parche de la imagen (usando el diario de la sesión)"""
+    try:
+        if not verify_session_access(current_user, session, db):
+            return {"success": False, "message": "No tienes acceso a esta sesión"}
+        error = session_image_error(session, filename)
+        if error:
+            return {"success": False, "message": error}
+        
+        try:
+            new_version, lines = undo_last_patch(session, filename, version, current_user.id)
+        except VersionConflict as e:
+            return version_conflict_response(e)
+        except PatchError as e:
+            return {"success": False, "message": str(e)}
+        
+        return {
+            "success": True,
+            "filename": filename,
+            "version": new_version,
+            "boxes": boxes_with_ids(lines)
+        }
+        
+    except Exception as e:
+        return {"success": False, "message": f"Error al deshacer: {str(e)}"}
+
 @app.post("/api/augment")
 async def augment_dataset_api(
     background_tasks: BackgroundTasks,
@@ -842,7 +1398,7 @@ async def get_augment_progress(
     """Obtener progreso de augmentación"""
     try:
         # Verificar acceso a la sesión solo si hay usuario autenticado
-        if current_user and not verify_session_access(current_user, session, db):
+        if not verify_session_access(current_user, session, db):
             return {"success": False, "message": "No tienes acceso a esta sesión"}
         
         progress_file = f"temp/progress_{session}.json"
@@ -877,6 +1433,8 @@ async def get_session_stats_api(
             return {"success": False, "message": "No tienes acceso a esta sesión"}
         
         stats = get_session_stats(session)
+        if stats is not None:
+            stats['annotations'] = get_label_store(session).summary()
         return {
             "success": True,
             "session": session,
@@ -886,13 +1444,38 @@ async def get_session_stats_api(
     except Exception as e:
         return {"success": False, "message": f"Error al obtener estadísticas: {str(e)}"}
 
+def attachment_header(filename: str):
+    """Content-Disposition de descarga (mismo formato que FileResponse)"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
 @app.get("/api/download/{session}")
 async def download_session(
     session: str,
+    compression: Optional[str] = None,
+    format: str = 'raw',
+    val_ratio: float = DEFAULT_VAL_RATIO,
+    seed: int = 0,
+    imgsz: Optional[int] = None,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    tile_stride: Optional[int] = None,
+    min_visibility: float = DEFAULT_MIN_VISIBILITY,
+    keep_empty: bool = False,
+    since: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Descargar sesión como archivo ZIP"""
+    """
+    Descargar sesión como archivo ZIP. format=raw: carpeta de la sesión tal
+    cual; format=ultralytics: images/ y labels/ divididos en train/val
+    (val_ratio, seed) con data.yaml, y con imgsz las imágenes redimensionadas
+    con letterbox y letterbox.json; format=coco|voc: etiquetas convertidas
+    a COCO JSON o Pascal VOC XML; format=tiles: mosaicos solapados
+    (tile_size, tile_stride, min_visibility, keep_empty) divididos en train/val. Con since=<X-Export-Token de una
+    descarga anterior> solo incluye lo nuevo o modificado y delta.json
+    """
     try:
         # Verificar acceso a la sesión
         if not verify_session_access(current_user, session, db):
@@ -903,23 +1486,106 @@ async def download_session(
         if not os.path.exists(session_path):
             raise HTTPException(status_code=404, detail=f"Sesión '{session}' no encontrada")
         
-        # Crear archivo ZIP temporal
-        zip_filename = f"{session}_dataset.zip"
-        zip_path = os.path.join("temp", zip_filename)
+        if compression is not None and compression not in COMPRESSION_PRESETS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Compresión inválida: {compression}. Disponibles: {list(COMPRESSION_PRESETS)}"
+            )
         
-        os.makedirs("temp", exist_ok=True)
+        if format not in EXPORT_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Formato inválido: {format}. Disponibles: {list(EXPORT_FORMATS)}"
+            )
         
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for root, dirs, files in os.walk(session_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, session_path)
-                    zipf.write(file_path, arcname)
+        options = {'format': format, 'compression': compression or EXPORT_COMPRESSION}
+        class_names = None
+        if format != 'raw':
+            class_names = session_class_names(get_session_owner_id(session, db, current_user.id), session, db)
+            # Las clases viven en la base de datos: forman parte de la clave de caché
+            options['classes'] = class_names
+        if format in ('ultralytics', 'tiles'):
+            if not 0 <= val_ratio < 1:
+                raise HTTPException(status_code=400, detail="val_ratio debe estar entre 0 y 1")
+            options.update(val_ratio=val_ratio, seed=seed)
+        if format == 'tiles':
+            tile_stride = tile_stride or default_stride(tile_size)
+            if not MIN_TILE_SIZE <= tile_size <= MAX_TILE_SIZE or not 0 < tile_stride <= tile_size:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"tile_size debe estar entre {MIN_TILE_SIZE} y {MAX_TILE_SIZE} y tile_stride entre 1 y tile_size"
+                )
+            if not 0 < min_visibility <= 1:
+                raise HTTPException(status_code=400, detail="min_visibility debe estar entre 0 y 1")
+            options.update(
+                tile_size=tile_size, tile_stride=tile_stride, min_visibility=min_visibility, keep_empty=keep_empty
+            )
+        if format == 'ultralytics' and imgsz is not None:
+            if imgsz not in LETTERBOX_SIZES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"imgsz inválido: {imgsz}. Disponibles: {list(LETTERBOX_SIZES)}"
+                )
+            options['imgsz'] = imgsz
+        
+        previous = None
+        if since:
+            try:
+                previous = load_manifest(session, since)
+                check_delta_options(previous, options)
+            except UnknownExportToken as e:
+                raise HTTPException(status_code=404, detail=str(e))
+            except ExportOptionsMismatch as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            options['since'] = since
+        
+        # El ZIP se genera mientras se envía (sin esperar a tenerlo entero) y se
+        # guarda en la caché de exportaciones mientras la sesión no cambie. La
+        # clave es también el token para pedir después una exportación delta.
+        fingerprint = session_fingerprint(session)
+        key = cache_key(fingerprint, options)
+        
+        def save_manifest():
+            # Antes del primer byte, también si el ZIP sale de la caché: el
+            # token sirve aunque la descarga se corte y la poda no lo borra
+            if touch_manifest(session, key):
+                return
+            entries = iter_export_entries(session, options, class_names)
+            if previous:
+                write_delta_manifest(session, entries, previous, key, options)
+            else:
+                write_manifest(session, entries, key, options)
+        
+        def build():
+            entries = iter_export_entries(session, options, class_names)
+            if previous:
+                entries = iter_delta_entries(entries, load_manifest(session, key))
+            return stream_zip(entries, compression=options['compression'])
+        
+        def export_chunks():
+            # Se ejecuta en el hilo de StreamingResponse, no en el bucle de eventos
+            save_manifest()
+            yield from export_cache.stream(
+                key,
+                build,
+                is_current=lambda: session_fingerprint(session) == fingerprint
+            )
         
-        return FileResponse(
-            path=zip_path,
+        suffix = "dataset" if format == 'raw' else format
+        if options.get('imgsz'):
+            suffix += f"_{imgsz}"
+        elif format == 'tiles':
+            suffix += f"_{tile_size}"
+        if previous:
+            suffix += "_delta"
+        return StreamingResponse(
+            export_chunks(),
             media_type='application/zip',
-            filename=zip_filename
+            headers={
+                "Content-Disposition": attachment_header(f"{session}_{suffix}.zip"),
+                "X-Export-Token": key,
+                "X-Export-Cache": export_cache.status(key) if export_cache.enabled else 'disabled'
+            }
         )
         
     except HTTPException:
@@ -954,6 +1620,10 @@ async def delete_session_api(
         if os.path.exists(session_path):
             shutil.rmtree(session_path)
         
+        # Las imágenes son hardlinks a blobs compartidos: liberar los que ya
+        # no usa ninguna otra sesión
+        collect_garbage(release_session(session_name))
+        
         return {
             "success": True,
             "message": f"Sesión '{session_name}' eliminada exitosamente"
@@ -1012,6 +1682,29 @@ async def list_all_sessions(
         ]
     }
 
+@app.get("/api/admin/metrics")
+async def get_metrics(
+    current_user: User = Depends(get_current_user)
+):
+    """Contadores del proceso (imágenes rechazadas por validación de cabecera)"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Acceso denegado")
+    
+    return {"success": True, "upload_rejections": rejection_metrics()}
+
+@app.get("/api/admin/dedup-report")
+async def get_dedup_report(
+    hash_contents: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Informe de deduplicación de imágenes en annotations/ (solo admins)"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Acceso denegado")
+    
+    loop = asyncio.get_running_loop()
+    report = await loop.run_in_executor(None, dedup_report, "annotations", hash_contents)
+    return {"success": True, "report": report}
+
 # ============================================================================
 # ENDPOINT PARA SERVIR IMÁGENES DE SESIONES
 # ============================================================================
@@ -6,6 +6,8 @@ import numpy as np
 import json
 from datetime import datetime
 
+from label_store import get_label_store
+
 # Configuración de variantes disponibles
 AVAILABLE_VARIANTS = {
     'negativo': {
@@ -59,17 +61,18 @@ def rotate_image(img, angle):
     rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
     return cv2.warpAffine(img, rotation_matrix, (width, height))
 
-def adjust_label_for_mirror(label_path, aug_label_path):
+def mirror_label_lines(lines):
     """
-    Ajusta la coordenada x_center para el efecto espejo en formato YOLO.
+    Ajusta la coordenada x_center para el efecto espejo en líneas YOLO.
     """
-    with open(label_path, 'r') as f_in, open(aug_label_path, 'w') as f_out:
-        for line in f_in:
-            parts = line.strip().split()
-            if len(parts) == 5:
-                # clase, x_center, y_center, ancho, alto
-                parts[1] = str(1 - float(parts[1]))
-            f_out.write(' '.join(parts) + '\n')
+    mirrored = []
+    for line in lines:
+        parts = line.strip().split()
+        if len(parts) == 5:
+            # clase, x_center, y_center, ancho, alto
+            parts[1] = str(1 - float(parts[1]))
+        mirrored.append(' '.join(parts))
+    return mirrored
 
 def augment_session(session_name, selected_variants=None, progress_callback=None):
     """
@@ -80,14 +83,10 @@ def augment_session(session_name, selected_variants=None, progress_callback=None
     
     session_path = f"annotations/{session_name}"
     images_path = os.path.join(session_path, "images")
-    labels_path = os.path.join(session_path, "labels")
     
     if not os.path.exists(images_path):
         raise Exception(f"No se encontró la carpeta de imágenes: {images_path}")
     
-    # Crear carpeta de labels si no existe
-    os.makedirs(labels_path, exist_ok=True)
-    
     # Crear carpeta temp si no existe
     os.makedirs("temp", exist_ok=True)
     
@@ -121,10 +120,14 @@ def augment_session(session_name, selected_variants=None, progress_callback=None
     # Inicializar progreso
     update_progress()
     
+    # Etiquetas de todas las imágenes originales en una sola lectura del almacén
+    label_store = get_label_store(session_name)
+    session_labels = label_store.load_many(image_files)
+    
     for img_name in image_files:
         img_path = os.path.join(images_path, img_name)
-        label_name = os.path.splitext(img_name)[0] + '.txt'
-        label_path = os.path.join(labels_path, label_name)
+        label_lines = session_labels.get(img_name)
+        aug_labels = {}
         
         # Leer imagen original
         img = cv2.imread(img_path)
@@ -159,20 +162,21 @@ def augment_session(session_name, selected_variants=None, progress_callback=None
                 cv2.imwrite(aug_path, aug_img)
                 
                 # Manejar etiquetas
-                aug_label_name = f"{base_name}_{variant_key}.txt"
-                aug_label_path = os.path.join(labels_path, aug_label_name)
-                
-                if os.path.exists(label_path):
+                if label_lines is not None:
                     if variant_config['modify_label']:
-                        adjust_label_for_mirror(label_path, aug_label_path)
+                        aug_labels[aug_name] = mirror_label_lines(label_lines)
                     else:
-                        shutil.copy(label_path, aug_label_path)
+                        aug_labels[aug_name] = label_lines
                 
                 results['created_variants'] += 1
                 
             except Exception as e:
                 results['errors'].append(f'Error procesando {img_name} con variante {variant_key}: {str(e)}')
         
+        # Etiquetas de todas las variantes de la imagen en una escritura
+        if aug_labels:
+            label_store.save_many(aug_labels)
+        
         results['processed_images'] += 1
     
     # Marcar como completado
@@ -205,7 +209,6 @@ def get_session_stats(session_name):
     """
     session_path = f"annotations/{session_name}"
     images_path = os.path.join(session_path, "images")
-    labels_path = os.path.join(session_path, "labels")
     
     if not os.path.exists(images_path):
         return None
@@ -213,10 +216,6 @@ def get_session_stats(session_name):
     image_files = [f for f in os.listdir(images_path) 
                    if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.bmp'))]
     
-    label_files = []
-    if os.path.exists(labels_path):
-        label_files = [f for f in os.listdir(labels_path) if f.endswith('.txt')]
-    
     # Detectar si ya hay variantes (archivos con sufijos)
     original_images = []
     variant_images = []
@@ -234,7 +233,7 @@ def get_session_stats(session_name):
         'total_images': len(image_files),
         'original_images': len(original_images),
         'variant_images': len(variant_images),
-        'label_files': len(label_files),
+        'label_files': get_label_store(session_name).count_labeled(),
         'available_variants': AVAILABLE_VARIANTS
     }
 
@@ -282,7 +281,9 @@ def augment_images():
                 aug_label_path = os.path.join(labels_path, aug_label_name)
                 if os.path.exists(label_path):
                     if mirror_label:
-                        adjust_label_for_mirror(label_path, aug_label_path)
+                        with open(label_path, 'r') as f_in, open(aug_label_path, 'w') as f_out:
+                            for line in mirror_label_lines(f_in):
+                                f_out.write(line + '\n')
                     else:
                         shutil.copy(label_path, aug_label_path)
                 else:
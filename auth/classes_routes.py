@@ -45,7 +45,7 @@ async def get_user_classes(
         # Solo clases globales/generales (sin sesión específica)
         query = query.filter(AnnotationClass.session_name.is_(None))
     
-    classes = query.order_by(AnnotationClass.created_at).all()
+    classes = query.order_by(AnnotationClass.created_at, AnnotationClass.id).all()
     
     # Si no tiene clases, crear las por defecto
     if not classes and not session_name:
@@ -289,10 +289,11 @@ async def import_classes_from_annotations(
 ):
     """Importar clases automáticamente desde anotaciones existentes"""
     
-    # Leer archivos de anotaciones de la sesión
+    # Leer las anotaciones de la sesión (txt o SQLite, ver label_store)
     import os
+    from label_store import get_label_store
     
-    session_path = os.path.join("annotations", session_name, "labels")
+    session_path = os.path.join("annotations", session_name)
     if not os.path.exists(session_path):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -300,22 +301,7 @@ async def import_classes_from_annotations(
         )
     
     # Encontrar todas las clases usadas
-    used_class_ids = set()
-    
-    for filename in os.listdir(session_path):
-        if filename.endswith('.txt'):
-            filepath = os.path.join(session_path, filename)
-            try:
-                with open(filepath, 'r') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line:
-                            parts = line.split()
-                            if len(parts) >= 5:
-                                class_id = int(parts[0])
-                                used_class_ids.add(class_id)
-            except:
-                continue
+    used_class_ids = get_label_store(session_name).class_ids()
     
     # Crear clases automáticamente
     created_classes = []
@@ -353,3 +339,53 @@ async def import_classes_from_annotations(
         "created_classes": created_classes,
         "found_class_ids": list(used_class_ids)
     }
+
+def _session_classes(user_id: int, session_name: str, db: Session) -> List[AnnotationClass]:
+    """Clases de la sesión en el orden que define su class_id (el de la lista del anotador)"""
+    return db.query(AnnotationClass).filter(
+        AnnotationClass.is_active == True,
+        (AnnotationClass.user_id == user_id) | (AnnotationClass.is_global == True),
+        (AnnotationClass.session_name == session_name) | (AnnotationClass.session_name.is_(None))
+    ).order_by(AnnotationClass.created_at, AnnotationClass.id).all()
+
+def session_class_names(user_id: int, session_name: str, db: Session) -> List[str]:
+    """Nombres de clase indexados por class_id, para exportar (data.yaml, COCO...)"""
+    return [cls.name for cls in _session_classes(user_id, session_name, db)]
+
+def ensure_session_classes(user_id: int, session_name: str, names: List[str], db: Session) -> List[int]:
+    """
+    Asegurar que existen clases con estos nombres para la sesión y devolver,
+    para cada nombre, su índice en la lista de clases de la sesión (el
+    class_id que usan las etiquetas). Las que faltan se crean en una sola
+    inserción.
+    """
+    session_classes = _session_classes(user_id, session_name, db)
+    
+    positions = {}
+    for index, cls in enumerate(session_classes):
+        positions.setdefault(cls.name, index)
+    
+    colors = ["#ff0000", "#00ff00", "#0000ff", "#ffff00", "#ff00ff", "#00ffff",
+              "#ff8800", "#ff0088", "#8800ff", "#88ff00", "#0088ff", "#00ff88"]
+    
+    # La columna guarda 50 caracteres: la búsqueda usa el mismo nombre
+    # truncado para no duplicar la clase en cada importación
+    keys = [name[:50] for name in names]
+    new_classes = []
+    for name in keys:
+        if name in positions:
+            continue
+        positions[name] = len(session_classes) + len(new_classes)
+        new_classes.append(AnnotationClass(
+            name=name,
+            color=colors[positions[name] % len(colors)],
+            user_id=user_id,
+            session_name=session_name,
+            is_global=False
+        ))
+    
+    if new_classes:
+        db.add_all(new_classes)
+        db.commit()
+    
+    return [positions[name] for name in keys]
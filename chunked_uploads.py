@@ -0,0 +1,185 @@
+"""
+Subidas reanudables por fragmentos (crear → PUT fragmento con offset → finalizar)
+
+Cada subida vive en temp/uploads/{upload_id}/ con un meta.json y el archivo
+`data`, donde los fragmentos se escriben directamente en su posición. El
+offset actual es siempre el tamaño de `data`, así que una subida interrumpida
+se reanuda consultando el estado y enviando desde ahí.
+"""
+import os
+import json
+import time
+import shutil
+import secrets
+import asyncio
+from collections import defaultdict
+
+UPLOADS_DIR = os.path.join("temp", "uploads")
+MAX_CHUNKED_UPLOAD_MB = int(os.getenv("MAX_CHUNKED_UPLOAD_MB", "2048"))
+MAX_CHUNKED_UPLOAD_SIZE = MAX_CHUNKED_UPLOAD_MB * 1024 * 1024
+UPLOAD_TTL_HOURS = float(os.getenv("UPLOAD_TTL_HOURS", "24"))
+
+# Tamaño de fragmento recomendado al cliente
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Tipos de subida y a qué pipeline se entregan al finalizar:
+# 'image' → canvas/guardado, 'archive' → importación de dataset YOLO
+UPLOAD_KINDS = ('image', 'archive')
+
+# Un PUT a la vez por subida (dentro de este proceso)
+_upload_locks = defaultdict(asyncio.Lock)
+
+
+class ChunkedUploadError(Exception):
+    """Error de protocolo en una subida por fragmentos"""
+
+    def __init__(self, message, status_code=400, offset=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+def _upload_dir(upload_id):
+    # upload_id viene de la URL: solo se aceptan ids generados por create_upload
+    if not upload_id.isalnum():
+        raise ChunkedUploadError("Identificador de subida inválido", 400)
+    return os.path.join(UPLOADS_DIR, upload_id)
+
+
+def _data_path(upload_id):
+    return os.path.join(_upload_dir(upload_id), "data")
+
+
+def create_upload(session, filename, total_size, user_id, kind='image', params=None):
+    """Registrar una nueva subida y crear su archivo de staging vacío"""
+    if kind not in UPLOAD_KINDS:
+        raise ChunkedUploadError(f"Tipo de subida inválido: {kind}. Disponibles: {list(UPLOAD_KINDS)}")
+    if total_size <= 0:
+        raise ChunkedUploadError("El tamaño total debe ser mayor que 0")
+    if total_size > MAX_CHUNKED_UPLOAD_SIZE:
+        raise ChunkedUploadError(
+            f"El archivo supera el tamaño máximo de {MAX_CHUNKED_UPLOAD_MB} MB", 413
+        )
+
+    expire_uploads()
+
+    upload_id = secrets.token_hex(16)
+    upload_dir = _upload_dir(upload_id)
+    os.makedirs(upload_dir)
+    meta = {
+        'upload_id': upload_id,
+        'session': session,
+        'filename': os.path.basename(filename),
+        'total_size': total_size,
+        'user_id': user_id,
+        'kind': kind,
+        'params': params or {},
+        'created_at': time.time()
+    }
+    with open(os.path.join(upload_dir, "meta.json"), 'w') as f:
+        json.dump(meta, f)
+    open(_data_path(upload_id), 'wb').close()
+    return get_status(upload_id)
+
+
+def load_meta(upload_id):
+    try:
+        with open(os.path.join(_upload_dir(upload_id), "meta.json"), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ChunkedUploadError("Subida no encontrada o expirada", 404)
+
+
+def get_status(upload_id):
+    """Estado de la subida: offset actual (bytes ya recibidos) y tamaño total"""
+    meta = load_meta(upload_id)
+    offset = os.path.getsize(_data_path(upload_id))
+    return {
+        'upload_id': upload_id,
+        'session': meta['session'],
+        'filename': meta['filename'],
+        'kind': meta['kind'],
+        'offset': offset,
+        'total_size': meta['total_size'],
+        'complete': offset == meta['total_size'],
+        'chunk_size': CHUNK_SIZE,
+        'expires_at': os.path.getmtime(_data_path(upload_id)) + UPLOAD_TTL_HOURS * 3600
+    }
+
+
+async def write_chunk(upload_id, offset, chunks):
+    """
+    Escribir un fragmento (iterador asíncrono de bytes) en la posición `offset`.
+
+    `offset` debe coincidir con los bytes ya recibidos; si no, se lanza un
+    ChunkedUploadError 409 con el offset correcto para que el cliente reanude.
+    """
+    async with _upload_locks[upload_id]:
+        meta = load_meta(upload_id)
+        data_path = _data_path(upload_id)
+        current = os.path.getsize(data_path)
+        if offset != current:
+            raise ChunkedUploadError(
+                f"Offset incorrecto: se esperaba {current}", 409, offset=current
+            )
+
+        written = 0
+        overflow = False
+        with open(data_path, 'r+b') as f:
+            f.seek(offset)
+            try:
+                async for chunk in chunks:
+                    if offset + written + len(chunk) > meta['total_size']:
+                        overflow = True
+                        raise ChunkedUploadError(
+                            "El fragmento supera el tamaño total declarado", 413, offset=offset
+                        )
+                    f.write(chunk)
+                    written += len(chunk)
+            finally:
+                # Lo recibido hasta un corte de conexión queda escrito y cuenta
+                # para el offset; un fragmento que desborda se descarta entero
+                f.truncate(offset if overflow else offset + written)
+
+    return get_status(upload_id)
+
+
+def finalize_upload(upload_id):
+    """
+    Comprobar que la subida está completa y devolver (meta, ruta del archivo).
+    El archivo sigue en staging hasta que se llame a discard_upload().
+    """
+    status = get_status(upload_id)
+    if not status['complete']:
+        raise ChunkedUploadError(
+            f"Subida incompleta: {status['offset']} de {status['total_size']} bytes",
+            409, offset=status['offset']
+        )
+    return load_meta(upload_id), _data_path(upload_id)
+
+
+def discard_upload(upload_id):
+    _upload_locks.pop(upload_id, None)
+    shutil.rmtree(_upload_dir(upload_id), ignore_errors=True)
+
+
+def expire_uploads(ttl_hours=None):
+    """Eliminar subidas abandonadas sin actividad durante más de UPLOAD_TTL_HOURS"""
+    ttl_seconds = (UPLOAD_TTL_HOURS if ttl_hours is None else ttl_hours) * 3600
+    if not os.path.isdir(UPLOADS_DIR):
+        return 0
+
+    now = time.time()
+    expired = 0
+    for upload_id in os.listdir(UPLOADS_DIR):
+        upload_dir = os.path.join(UPLOADS_DIR, upload_id)
+        data_path = os.path.join(upload_dir, "data")
+        try:
+            last_activity = os.path.getmtime(data_path if os.path.exists(data_path) else upload_dir)
+        except FileNotFoundError:
+            continue
+        if now - last_activity > ttl_seconds:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            _upload_locks.pop(upload_id, None)
+            expired += 1
+    return expired
@@ -0,0 +1,162 @@
+"""
+Caché de los ZIP de exportación
+
+Clave: huella barata del contenido de la sesión (nombres, tamaños y mtimes de
+sus archivos, sin leerlos) más las opciones de exportación. Mientras la
+sesión no cambie, las descargas siguientes sirven el ZIP ya generado.
+
+- Single-flight: la primera petición genera el ZIP, lo envía en streaming y a
+  la vez lo escribe en la caché; las peticiones idénticas que llegan mientras
+  tanto esperan a que termine y sirven el archivo. Si el cliente que genera
+  se desconecta, el siguiente en espera toma el relevo. La espera ocupa un
+  hilo del pool sin enviar nada: pasados EXPORT_CACHE_WAIT_SECONDS, quien
+  espera genera su propio ZIP (sin guardarlo) en vez de seguir parado.
+- Si la sesión cambió durante la generación, el ZIP se envía pero no se
+  guarda (su contenido ya no corresponde a la clave).
+- Expulsión LRU por tamaño total (EXPORT_CACHE_MAX_MB; 0 desactiva la caché).
+  El mtime de cada artefacto es su último uso, así que el orden se conserva
+  entre reinicios.
+"""
+import os
+import json
+import hashlib
+import secrets
+import threading
+
+from zip_stream import ZIP_CHUNK_SIZE
+
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", os.path.join("temp", "export_cache"))
+EXPORT_CACHE_MAX_MB = int(os.getenv("EXPORT_CACHE_MAX_MB", "2048"))
+EXPORT_CACHE_WAIT_SECONDS = float(os.getenv("EXPORT_CACHE_WAIT_SECONDS", "10"))
+
+
+def cache_key(fingerprint, options=None):
+    """Clave del artefacto: huella de la sesión + opciones de exportación"""
+    payload = json.dumps({'fingerprint': fingerprint, 'options': options or {}}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class ExportCache:
+    """Artefactos de exportación en disco con single-flight y expulsión LRU"""
+
+    def __init__(self, directory, max_bytes, wait_seconds=EXPORT_CACHE_WAIT_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.wait_seconds = wait_seconds
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.zip")
+
+    def status(self, key):
+        """'hit', 'shared' (otra petición lo está generando) o 'miss'"""
+        with self._lock:
+            if os.path.exists(self.path_for(key)):
+                return 'hit'
+            return 'shared' if key in self._flights else 'miss'
+
+    def _open_cached(self, key):
+        # Abrir bajo el lock: una expulsión posterior no afecta al archivo ya abierto
+        path = self.path_for(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return f
+
+    def stream(self, key, build, is_current=None, chunk_size=ZIP_CHUNK_SIZE):
+        """
+        Bloques del artefacto `key`. `build()` genera los bloques si no está en
+        caché; `is_current()` dice, al terminar, si el resultado sigue
+        correspondiendo a la clave y se puede guardar.
+        """
+        if not self.enabled:
+            yield from build()
+            return
+
+        while True:
+            with self._lock:
+                cached = self._open_cached(key)
+                flight = None
+                if cached is None:
+                    flight = self._flights.get(key)
+                    leader = flight is None
+                    if leader:
+                        flight = self._flights[key] = threading.Event()
+            if cached is not None:
+                with cached:
+                    while True:
+                        chunk = cached.read(chunk_size)
+                        if not chunk:
+                            return
+                        yield chunk
+            if leader:
+                break
+            if not flight.wait(self.wait_seconds):
+                yield from build()
+                return
+
+        os.makedirs(self.directory, exist_ok=True)
+        partial = f"{self.path_for(key)}.{secrets.token_hex(4)}.part"
+        completed = False
+        try:
+            with open(partial, 'wb') as f:
+                for chunk in build():
+                    f.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            # También al desconectarse el cliente (GeneratorExit en el yield)
+            with self._lock:
+                if completed and (is_current is None or is_current()):
+                    os.replace(partial, self.path_for(key))
+                elif os.path.exists(partial):
+                    os.remove(partial)
+                del self._flights[key]
+                flight.set()
+            if completed:
+                self.evict()
+
+    def evict(self):
+        """Borrar los artefactos usados hace más tiempo hasta quedar dentro del presupuesto"""
+        with self._lock:
+            try:
+                names = [name for name in os.listdir(self.directory) if name.endswith('.zip')]
+            except FileNotFoundError:
+                return []
+            artifacts = []
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                artifacts.append((stat.st_mtime_ns, stat.st_size, name))
+            artifacts.sort()
+
+            total = sum(size for _, size, _ in artifacts)
+            evicted = []
+            for _, size, name in artifacts:
+                if total <= self.max_bytes:
+                    break
+                os.remove(os.path.join(self.directory, name))
+                total -= size
+                evicted.append(name[:-len('.zip')])
+            return evicted
+
+    def size(self):
+        try:
+            return sum(
+                os.path.getsize(os.path.join(self.directory, name))
+                for name in os.listdir(self.directory) if name.endswith('.zip')
+            )
+        except FileNotFoundError:
+            return 0
+
+
+export_cache = ExportCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_MB * 1024 * 1024)
@@ -0,0 +1,202 @@
+"""
+Manifiestos de exportación y exportación incremental (delta)
+
+Cada exportación guarda, bajo un token, qué entradas contenía el ZIP con su
+tamaño, mtime y hash (temp/export_manifests/{sesion}/{token}.json). Una
+descarga con `since=<token>` compara la exportación actual con ese manifiesto
+y solo incluye las entradas nuevas o modificadas, más un delta.json con las
+eliminadas.
+
+- Archivos (imágenes...): si tamaño y mtime coinciden con el manifiesto no se
+  leen; si cambiaron se calcula el hash y solo se envían si el contenido es
+  distinto (un `touch` no los reenvía). Las exportaciones completas no
+  calculan hashes de archivos, solo guardan tamaño y mtime.
+- Contenido generado en memoria (etiquetas): siempre con hash, es barato.
+- Contenido generado por bloques (COCO JSON): no se puede comparar sin
+  generarlo entero, así que se incluye siempre en la delta.
+
+El manifiesto se guarda antes de enviar el ZIP, con una pasada previa por
+las entradas (son deterministas para la misma huella y opciones): así el
+token sirve aunque la descarga se corte, y las descargas servidas desde la
+caché solo lo refrescan (touch_manifest) para que la poda no lo borre
+mientras el ZIP sigue en uso. Los archivos de esa pasada solo se leen con
+stat; el contenido generado (etiquetas, imágenes con letterbox...) se
+genera dos veces.
+
+Si un archivo cambia entre la pasada previa y el envío, el manifiesto queda
+con el estado anterior y la siguiente delta lo vuelve a enviar.
+"""
+import os
+import json
+import time
+import hashlib
+import secrets
+
+EXPORT_MANIFEST_DIR = os.path.join("temp", "export_manifests")
+EXPORT_MANIFESTS_KEEP = int(os.getenv("EXPORT_MANIFESTS_KEEP", "20"))
+DELTA_FILENAME = "delta.json"
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Opciones que no cambian qué entradas lleva el ZIP: pueden variar entre la
+# exportación base y la delta
+DELTA_IGNORED_OPTIONS = ('since', 'compression')
+
+
+class UnknownExportToken(Exception):
+    """El token no corresponde a ninguna exportación guardada de la sesión"""
+    pass
+
+
+class ExportOptionsMismatch(Exception):
+    """La delta se pidió con opciones distintas a las de la exportación base"""
+    pass
+
+
+def manifest_path(session, token):
+    # El token viene de la URL: solo se aceptan tokens generados por la exportación
+    if not token or not token.isalnum():
+        raise UnknownExportToken("Token de exportación inválido")
+    return os.path.join(EXPORT_MANIFEST_DIR, session, f"{token}.json")
+
+
+def load_manifest(session, token):
+    try:
+        with open(manifest_path(session, token), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        raise UnknownExportToken("Token de exportación desconocido o caducado; descarga la sesión completa")
+
+
+def _save_manifest(session, manifest):
+    path = manifest_path(session, manifest['token'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+    _prune_manifests(session)
+
+
+def _prune_manifests(session):
+    """Conservar solo los EXPORT_MANIFESTS_KEEP manifiestos más recientes de la sesión"""
+    directory = os.path.join(EXPORT_MANIFEST_DIR, session)
+    manifests = []
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            try:
+                manifests.append((os.stat(os.path.join(directory, name)).st_mtime_ns, name))
+            except FileNotFoundError:
+                continue
+    for _, name in sorted(manifests, reverse=True)[EXPORT_MANIFESTS_KEEP:]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _new_manifest(session, token, options, since=None):
+    return {
+        'token': token, 'session': session, 'since': since, 'created_at': time.time(),
+        'options': options, 'files': {}
+    }
+
+
+def touch_manifest(session, token):
+    """Marcar el manifiesto como usado ahora (la poda conserva los más recientes); False si no existe"""
+    try:
+        os.utime(manifest_path(session, token))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _entry_record(source):
+    """[tamaño, mtime, hash] de una entrada sin leer los archivos ni consumir los generadores"""
+    if isinstance(source, (bytes, bytearray)):
+        return [len(source), None, hashlib.sha1(source).hexdigest()]
+    if isinstance(source, str):
+        stat = os.stat(source)
+        return [stat.st_size, stat.st_mtime_ns, None]
+    return [None, None, None]
+
+
+def write_manifest(session, entries, token, options):
+    """Guardar el manifiesto de una exportación completa a partir de sus entradas"""
+    manifest = _new_manifest(session, token, options)
+    for arcname, source in entries:
+        manifest['files'][arcname] = _entry_record(source)
+    _save_manifest(session, manifest)
+    return manifest
+
+
+def check_delta_options(previous, options):
+    """
+    Comprobar que la delta usa las mismas opciones (formato, clases, división,
+    mosaicos...) que la exportación base: con otras las entradas no son
+    comparables y la delta mezclaría los dos datasets
+    """
+    def relevant(values):
+        return {key: value for key, value in (values or {}).items() if key not in DELTA_IGNORED_OPTIONS}
+
+    before, current = relevant(previous.get('options')), relevant(options)
+    if before != current:
+        changed = sorted(key for key in set(before) | set(current) if before.get(key) != current.get(key))
+        raise ExportOptionsMismatch(
+            f"La exportación {previous['token']} se generó con otras opciones ({', '.join(changed)}); "
+            "repite esas opciones o descarga la sesión completa"
+        )
+
+
+def write_delta_manifest(session, entries, previous, token, options):
+    """
+    Comparar las entradas con el manifiesto `previous` y guardar el de esta
+    exportación (completo: sirve de base para la siguiente delta) con las
+    entradas nuevas, modificadas y eliminadas en manifest['delta']
+    """
+    check_delta_options(previous, options)
+    manifest = _new_manifest(session, token, options, since=previous['token'])
+    files = manifest['files']
+    previous_files = previous['files']
+    added, modified = [], []
+    for arcname, source in entries:
+        before = previous_files.get(arcname)
+        if isinstance(source, str):
+            stat = os.stat(source)
+            if before and before[0] == stat.st_size and before[1] == stat.st_mtime_ns:
+                files[arcname] = before
+                continue
+            current = [stat.st_size, stat.st_mtime_ns, _file_hash(source)]
+        else:
+            current = _entry_record(source)
+        files[arcname] = current
+
+        if before is None:
+            added.append(arcname)
+        elif before[2] != current[2] or current[2] is None:
+            modified.append(arcname)
+
+    manifest['delta'] = {'added': added, 'modified': modified, 'deleted': sorted(set(previous_files) - set(files))}
+    _save_manifest(session, manifest)
+    return manifest
+
+
+def iter_delta_entries(entries, manifest):
+    """Entradas nuevas o modificadas según el manifiesto de la delta y, al final, delta.json"""
+    delta = manifest['delta']
+    changed = set(delta['added']) | set(delta['modified'])
+    for arcname, source in entries:
+        if arcname in changed:
+            yield arcname, source
+    yield DELTA_FILENAME, json.dumps({'token': manifest['token'], 'since': manifest['since'], **delta}, indent=2).encode()
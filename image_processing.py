@@ -0,0 +1,444 @@
+"""
+Pipeline de procesamiento de imágenes subidas: canvas, guardado y vista previa
+"""
+import os
+import io
+import base64
+import random
+import secrets
+import shutil
+import tempfile
+import threading
+import urllib.parse
+from collections import Counter
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+import image_store
+from image_store import DEDUP_UPLOADS
+
+# Número máximo de imágenes procesándose a la vez en subidas por lotes
+MAX_UPLOAD_WORKERS = int(os.getenv("MAX_UPLOAD_WORKERS", "4"))
+
+# Tamaño máximo por archivo subido
+MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "50"))
+MAX_FILE_SIZE = MAX_FILE_SIZE_MB * 1024 * 1024
+
+# Las subidas se copian por bloques a un temporal que pasa a disco al superar
+# SPOOL_MAX_MEMORY, así la memoria por subida en curso queda acotada
+UPLOAD_CHUNK_SIZE = 256 * 1024
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+# Validación de cabecera antes de decodificar (protección frente a
+# "decompression bombs"): formato, dimensiones y número de frames
+ALLOWED_IMAGE_EXTENSIONS = os.getenv("ALLOWED_IMAGE_EXTENSIONS", "jpg,jpeg,png,webp,gif,bmp")
+MAX_IMAGE_MEGAPIXELS = float(os.getenv("MAX_IMAGE_MEGAPIXELS", "100"))
+MAX_IMAGE_PIXELS = int(MAX_IMAGE_MEGAPIXELS * 1_000_000)
+MAX_IMAGE_SIDE = int(os.getenv("MAX_IMAGE_SIDE", "20000"))
+MAX_IMAGE_FRAMES = int(os.getenv("MAX_IMAGE_FRAMES", "100"))
+
+# Red de seguridad para cualquier Image.open del proceso (miniaturas,
+# importación...): PIL lanza DecompressionBombError por encima del doble
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Lado máximo de la imagen dentro del canvas (las mayores se reducen)
+CANVAS_MAX_SIZE = 800
+
+# Calidad del redimensionado al subir: 'quality' (LANCZOS) o 'fast' (BILINEAR).
+# reducing_gap controla cuánto se reduce antes del remuestreo final con
+# draft() (escalado DCT en JPEG) y reduce(): más alto = mejor calidad, más lento
+RESIZE_MODES = {
+    'quality': {'resample': Image.Resampling.LANCZOS, 'reducing_gap': 3.0},
+    'fast': {'resample': Image.Resampling.BILINEAR, 'reducing_gap': 2.0},
+}
+RESIZE_QUALITY = os.getenv("RESIZE_QUALITY", "quality")
+if RESIZE_QUALITY not in RESIZE_MODES:
+    # Fallar al arrancar y no en la primera subida o exportación
+    raise ValueError(f"RESIZE_QUALITY inválido: {RESIZE_QUALITY}. Disponibles: {list(RESIZE_MODES)}")
+
+# Vista previa en la respuesta de subida: 'none', 'url' (URL cacheable, por
+# defecto) o 'inline' (miniatura pequeña en base64)
+PREVIEW_MODES = ('none', 'url', 'inline')
+PREVIEW_MODE = os.getenv("PREVIEW_MODE", "url")
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+# Tamaños de miniatura que se sirven (cada uno se guarda en caché aparte)
+THUMBNAIL_SIZES = tuple(sorted({THUMBNAIL_SIZE} | {
+    int(size) for size in os.getenv("THUMBNAIL_SIZES", "128,256,512,1024").split(',') if size.strip()
+}))
+THUMBNAILS_DIR = os.path.join("temp", "thumbnails")
+
+# Pool compartido para el trabajo de CPU (decodificar, redimensionar, codificar).
+# PIL libera el GIL en la mayor parte de estas operaciones.
+upload_executor = ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS, thread_name_prefix="upload")
+
+
+class UploadTooLarge(Exception):
+    """El archivo subido supera el tamaño máximo permitido"""
+    pass
+
+
+class ImageRejected(Exception):
+    """La cabecera de la imagen no supera la validación (formato, tamaño, frames)"""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+# Contador de imágenes rechazadas por motivo (ver /api/admin/metrics)
+_rejections = Counter()
+_rejections_lock = threading.Lock()
+
+
+def _allowed_formats():
+    extensions = Image.registered_extensions()
+    formats = {extensions.get(f".{ext.strip().lower()}") for ext in ALLOWED_IMAGE_EXTENSIONS.split(',')}
+    if 'JPEG' in formats:
+        formats.add('MPO')  # JPEG de móviles con varias imágenes (PIL lo detecta como MPO)
+    return formats - {None}
+
+
+ALLOWED_IMAGE_FORMATS = _allowed_formats()
+
+
+def _reject(message, reason):
+    with _rejections_lock:
+        _rejections[reason] += 1
+    raise ImageRejected(message, reason)
+
+
+def rejection_metrics():
+    """Rechazos acumulados desde el arranque, por motivo"""
+    with _rejections_lock:
+        counts = dict(_rejections)
+    return {'total': sum(counts.values()), 'by_reason': counts}
+
+
+def validate_image_header(image_source, filename=None):
+    """
+    Validar la imagen leyendo solo su cabecera, sin decodificar píxeles:
+    formato permitido, dimensiones dentro de MAX_IMAGE_SIDE/MAX_IMAGE_PIXELS y
+    como mucho MAX_IMAGE_FRAMES frames. Lanza ImageRejected con un mensaje
+    claro; devuelve (formato, (ancho, alto), frames) si es válida.
+    """
+    name = f"'{filename}' " if filename else ""
+    if isinstance(image_source, (bytes, bytearray)):
+        image_source = io.BytesIO(image_source)
+    try:
+        image_source.seek(0)
+        with Image.open(image_source) as img:
+            image_format, (width, height) = img.format, img.size
+            if image_format not in ALLOWED_IMAGE_FORMATS:
+                _reject(f"Formato de imagen {name}no permitido: {image_format}", 'format')
+            if width > MAX_IMAGE_SIDE or height > MAX_IMAGE_SIDE:
+                _reject(
+                    f"La imagen {name}mide {width}x{height}; el lado máximo es {MAX_IMAGE_SIDE} px",
+                    'dimensions'
+                )
+            if width * height > MAX_IMAGE_PIXELS:
+                _reject(
+                    f"La imagen {name}tiene {width * height / 1e6:.0f} MP; el máximo es {MAX_IMAGE_MEGAPIXELS:g} MP",
+                    'pixels'
+                )
+            frames = getattr(img, 'n_frames', 1)
+            if frames > MAX_IMAGE_FRAMES:
+                _reject(f"La imagen {name}tiene {frames} frames; el máximo es {MAX_IMAGE_FRAMES}", 'frames')
+            return image_format, (width, height), frames
+    except ImageRejected:
+        raise
+    except Image.DecompressionBombError:
+        _reject(f"La imagen {name}supera el máximo de {MAX_IMAGE_MEGAPIXELS:g} MP", 'pixels')
+    except Exception:
+        _reject(f"El archivo {name}no es una imagen válida o está dañado", 'invalid')
+    finally:
+        image_source.seek(0)
+
+
+def random_color():
+    return tuple(random.randint(0, 255) for _ in range(3))
+
+
+async def spool_upload(upload, max_bytes=None):
+    """
+    Copiar un UploadFile por bloques a un SpooledTemporaryFile propio.
+    Lanza UploadTooLarge en cuanto se supera `max_bytes`, sin leer el resto.
+    """
+    max_bytes = MAX_FILE_SIZE if max_bytes is None else max_bytes
+    too_large = UploadTooLarge(
+        f"El archivo '{upload.filename}' supera el tamaño máximo de {max_bytes // (1024 * 1024)} MB"
+    )
+
+    # Rechazo inmediato si el tamaño ya se conoce
+    if upload.size is not None and upload.size > max_bytes:
+        raise too_large
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    written = 0
+    try:
+        await upload.seek(0)
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > max_bytes:
+                raise too_large
+            spooled.write(chunk)
+    except BaseException:
+        spooled.close()
+        raise
+
+    spooled.seek(0)
+    return spooled
+
+
+def create_canvas_with_image(image_source, size, x, y, change_bg=True, max_size=CANVAS_MAX_SIZE, resize_quality=None):
+    """
+    Crear canvas con imagen redimensionada automáticamente.
+    `image_source` puede ser bytes o un archivo abierto en modo binario.
+    """
+    resize_mode = RESIZE_MODES[resize_quality or RESIZE_QUALITY]
+    bg_color = random_color() if change_bg else (200, 200, 200)
+    canvas = Image.new('RGB', size, bg_color)
+
+    # Cargar imagen subida (soporta múltiples formatos incluyendo WebP)
+    if isinstance(image_source, (bytes, bytearray)):
+        image_source = io.BytesIO(image_source)
+    img = Image.open(image_source)
+
+    # Calcular nuevo tamaño manteniendo proporción si es muy grande
+    original_width, original_height = img.size
+    needs_resize = original_width > max_size or original_height > max_size
+    if needs_resize:
+        ratio = min(max_size / original_width, max_size / original_height)
+        new_width = int(original_width * ratio)
+        new_height = int(original_height * ratio)
+
+        # JPEG: decodificar directamente a 1/2, 1/4 u 1/8 de la resolución
+        # (escalado en el dominio DCT) en vez de decodificar a tamaño completo
+        gap = resize_mode['reducing_gap']
+        img.draft(None, (int(new_width * gap), int(new_height * gap)))
+
+    # Normalizar modo antes de redimensionar (las paletas no se pueden remuestrear).
+    # Paletas sin transparencia pasan directamente a RGB (sin canal alfa que mezclar)
+    if img.mode == 'P':
+        img = img.convert('RGBA' if 'transparency' in img.info or img.palette.mode == 'RGBA' else 'RGB')
+    elif img.mode not in ('RGB', 'RGBA', 'LA'):
+        img = img.convert('RGB')
+
+    # Redimensionar: reduce() por un factor entero y remuestreo final al tamaño exacto
+    if needs_resize:
+        img = img.resize(
+            (new_width, new_height), resize_mode['resample'],
+            reducing_gap=resize_mode['reducing_gap']
+        )
+
+    # Centrar imagen si es menor que el canvas
+    canvas_width, canvas_height = size
+    img_width, img_height = img.size
+
+    # Calcular posición centrada o usar coordenadas proporcionadas
+    if x == 0 and y == 0:  # Auto-centrar
+        paste_x = (canvas_width - img_width) // 2
+        paste_y = (canvas_height - img_height) // 2
+    else:
+        # Usar coordenadas proporcionadas pero asegurar que la imagen esté dentro
+        paste_x = min(x, canvas_width - img_width)
+        paste_y = min(y, canvas_height - img_height)
+
+    paste_x = max(0, paste_x)
+    paste_y = max(0, paste_y)
+
+    # Pegar imagen en canvas. Con transparencia se rellena de blanco la zona
+    # de la imagen y se mezcla directamente sobre el canvas usando su alfa como
+    # máscara: una sola pasada, sin imágenes intermedias del tamaño completo
+    if img.mode in ('RGBA', 'LA'):
+        box = (paste_x, paste_y, paste_x + img_width, paste_y + img_height)
+        canvas.paste((255, 255, 255), box)
+        canvas.paste(img, box, mask=img)
+    else:
+        canvas.paste(img, (paste_x, paste_y))
+
+    return canvas
+
+
+def is_passthrough(image_source, size, ext, max_size=CANVAS_MAX_SIZE):
+    """
+    Comprobar solo con la cabecera si la imagen puede guardarse tal cual:
+    ya tiene el tamaño del canvas (sin redimensionar ni fondo visible), es RGB
+    opaca de un solo frame, sin rotación EXIF, y su formato coincide con la
+    extensión con la que se va a guardar.
+    """
+    if isinstance(image_source, (bytes, bytearray)):
+        image_source = io.BytesIO(image_source)
+    try:
+        image_source.seek(0)
+        # Image.open solo lee la cabecera; los píxeles no se decodifican
+        img = Image.open(image_source)
+        return (
+            img.size == tuple(size)
+            and max(img.size) <= max_size
+            and img.mode == 'RGB'
+            and 'transparency' not in img.info
+            and getattr(img, 'n_frames', 1) == 1
+            and img.format == Image.registered_extensions().get(ext.lower())
+            and img.getexif().get(0x0112, 1) == 1
+        )
+    except Exception:
+        # Que lo rechace (o procese) la ruta normal con su propio mensaje
+        return False
+    finally:
+        image_source.seek(0)
+
+
+def write_source_atomic(image_source, path):
+    """Escribir los bytes originales (bytes o archivo) en `path` de forma atómica"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    with open(tmp_path, 'wb') as f:
+        if isinstance(image_source, (bytes, bytearray)):
+            f.write(image_source)
+        else:
+            image_source.seek(0)
+            shutil.copyfileobj(image_source, f, UPLOAD_CHUNK_SIZE)
+    os.replace(tmp_path, path)
+
+
+def image_to_base64(pil_image):
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format='JPEG', quality=90)
+    img_data = base64.b64encode(buffer.getvalue()).decode()
+    return f"data:image/jpeg;base64,{img_data}"
+
+
+def make_thumbnail(pil_image, max_size=None):
+    """Copia reducida de la imagen (lado mayor <= max_size) para vistas previas"""
+    max_size = max_size or THUMBNAIL_SIZE
+    thumbnail = pil_image.copy()
+    thumbnail.thumbnail((max_size, max_size), Image.Resampling.BILINEAR)
+    return thumbnail
+
+
+def get_thumbnail_path(session, filename, max_size=None):
+    """
+    Devolver la ruta de la miniatura de una imagen de la sesión, generándola
+    en temp/thumbnails/ la primera vez o si la imagen original cambió.
+    Devuelve None si la imagen no existe.
+    """
+    max_size = max_size or THUMBNAIL_SIZE
+    image_path = os.path.join("annotations", session, "images", filename)
+    if not os.path.exists(image_path):
+        return None
+
+    # Con la extensión: a.png y a.jpg de la misma sesión tienen miniaturas distintas
+    thumb_path = os.path.join(THUMBNAILS_DIR, session, str(max_size), filename + '.jpg')
+    if os.path.exists(thumb_path) and os.path.getmtime(thumb_path) >= os.path.getmtime(image_path):
+        return thumb_path
+
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    with Image.open(image_path) as img:
+        img.draft('RGB', (max_size, max_size))
+        thumbnail = make_thumbnail(img.convert('RGB'), max_size)
+
+    # Escritura atómica: nunca se sirve una miniatura a medio escribir. Varios
+    # hilos del mismo proceso pueden generar la misma miniatura a la vez
+    tmp_path = f"{thumb_path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    thumbnail.save(tmp_path, format='JPEG', quality=85)
+    os.replace(tmp_path, thumb_path)
+    return thumb_path
+
+
+def build_preview(session, image_filename, canvas_image, preview_mode=None):
+    """Campos de vista previa para la respuesta de subida según el modo configurado"""
+    preview_mode = preview_mode or PREVIEW_MODE
+    # El nombre original (con espacios, '#', '?'...) forma parte del archivo guardado
+    quoted = [urllib.parse.quote(part, safe='') for part in (session, image_filename)]
+    preview_url = f"/api/preview/{quoted[0]}/{quoted[1]}"
+    if preview_mode == 'none':
+        return {}
+    if preview_mode == 'inline':
+        if canvas_image is None:
+            with Image.open(os.path.join("annotations", session, "images", image_filename)) as img:
+                img.draft('RGB', (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                canvas_image = img.convert('RGB')
+        return {"preview": image_to_base64(make_thumbnail(canvas_image))}
+    return {"preview": preview_url, "thumbnail_url": f"{preview_url}?max_size={THUMBNAIL_SIZE}"}
+
+
+def process_upload(image_source, original_filename, session, size, x=0, y=0, change_bg=True):
+    """
+    Componer la imagen subida (bytes o archivo) en el canvas y guardarla en la sesión.
+
+    Con DEDUP_UPLOADS activo la imagen se guarda en el almacén direccionado por
+    contenido y la sesión recibe un hardlink; una resubida idéntica devuelve el
+    archivo ya existente sin decodificar ni recodificar nada.
+
+    Si la imagen ya coincide con el canvas (ver is_passthrough) se guardan
+    sus bytes originales tal cual.
+
+    Devuelve un dict con `filename`, `canvas` (None si no hubo que procesar la
+    imagen) y `duplicate` (la imagen ya estaba en esta sesión).
+    """
+    ext = os.path.splitext(original_filename)[1] or '.png'
+
+    # Rechazo inmediato (sin decodificar) de formatos, tamaños o frames no permitidos
+    validate_image_header(image_source, original_filename)
+
+    if DEDUP_UPLOADS:
+        key = image_store.source_key(image_source, {
+            'size': list(size), 'x': x, 'y': y, 'change_bg': change_bg, 'ext': ext.lower()
+        })
+        blob_name = image_store.lookup_source(key)
+        if blob_name:
+            existing = image_store.find_in_session(blob_name, session)
+            if existing:
+                return {'filename': existing, 'canvas': None, 'duplicate': True}
+            image_filename = _new_image_filename(session, original_filename)
+            image_store.link_into_session(blob_name, session, image_filename)
+            return {'filename': image_filename, 'canvas': None, 'duplicate': False}
+
+    if is_passthrough(image_source, size, ext):
+        # La imagen ya es el canvas: se guardan los bytes originales sin
+        # decodificar ni recodificar (sin pérdida de generación)
+        image_filename = _new_image_filename(session, original_filename)
+        if DEDUP_UPLOADS:
+            blob_name = image_store.store_source(image_source, ext)
+            image_store.record_source(key, blob_name)
+            existing = image_store.find_in_session(blob_name, session)
+            if existing:
+                return {'filename': existing, 'canvas': None, 'duplicate': True}
+            image_store.link_into_session(blob_name, session, image_filename)
+        else:
+            write_source_atomic(image_source, os.path.join("annotations", session, "images", image_filename))
+        return {'filename': image_filename, 'canvas': None, 'duplicate': False}
+
+    canvas_image = create_canvas_with_image(image_source, size, x, y, change_bg)
+    image_filename = _new_image_filename(session, original_filename)
+
+    if DEDUP_UPLOADS:
+        # Mismo canvas ya almacenado (p. ej. misma imagen con otro nombre): no se recodifica
+        blob_name = image_store.store_canvas(canvas_image, ext)
+        image_store.record_source(key, blob_name)
+        existing = image_store.find_in_session(blob_name, session)
+        if existing:
+            return {'filename': existing, 'canvas': canvas_image, 'duplicate': True}
+        image_store.link_into_session(blob_name, session, image_filename)
+        return {'filename': image_filename, 'canvas': canvas_image, 'duplicate': False}
+
+    # Guardar imagen
+    image_path = os.path.join("annotations", session, "images", image_filename)
+    os.makedirs(os.path.dirname(image_path), exist_ok=True)
+    canvas_image.save(image_path)
+
+    return {'filename': image_filename, 'canvas': canvas_image, 'duplicate': False}
+
+
+def _new_image_filename(session, original_filename):
+    """
+    Generar nombre único de archivo: {sesion}_{fecha}_{hora}-{aleatorio}_{original}.
+    El sufijo aleatorio evita que dos imágenes con el mismo nombre subidas en
+    el mismo segundo (p. ej. en un lote) se sobrescriban.
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{session}_{timestamp}-{secrets.token_hex(4)}_{original_filename}"
@@ -0,0 +1,334 @@
+"""
+Almacén de imágenes direccionado por contenido con deduplicación de subidas
+
+Cada canvas procesado se guarda una sola vez en BLOB_STORE_DIR/objects con su
+SHA-256 como nombre; las entradas de images/ de cada sesión son hardlinks a ese
+blob (o copias si el sistema de archivos no admite enlaces), por lo que el
+resto de la aplicación sigue leyendo annotations/{sesion}/images/ como siempre.
+
+Índices (archivos pequeños escritos de forma atómica):
+- sources/{sha}: blob resultante de una subida (bytes originales + parámetros),
+  permite detectar una resubida sin decodificar la imagen
+- refs/{blob}/{sesion}: nombre del archivo que referencia el blob en la sesión
+
+Al borrar una sesión se eliminan sus refs (release_session) y se recogen los
+blobs que ya no usa nadie (collect_garbage): sin refs vigentes y sin otros
+hardlinks. `python image_store.py --gc` recorre todo el almacén.
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import secrets
+import time
+
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "blobs")
+# Los blobs más recientes no se recogen: una subida en curso puede haberlo
+# guardado y aún no haberlo enlazado en su sesión
+GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", "600"))
+DEDUP_UPLOADS = os.getenv("DEDUP_UPLOADS", "true").lower() in ("1", "true", "yes")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _tmp_name(path):
+    # Varios hilos del pool de subidas pueden escribir la misma ruta a la vez
+    return f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+
+
+def _write_atomic(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = _tmp_name(path)
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def source_key(image_source, params):
+    """SHA-256 de los bytes subidos más los parámetros que afectan al canvas"""
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+    if isinstance(image_source, (bytes, bytearray)):
+        digest.update(image_source)
+    else:
+        image_source.seek(0)
+        for chunk in iter(lambda: image_source.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        image_source.seek(0)
+    return digest.hexdigest()
+
+
+def canvas_digest(canvas_image):
+    """SHA-256 de los píxeles del canvas procesado (antes de codificarlo)"""
+    digest = hashlib.sha256(f"{canvas_image.mode}:{canvas_image.size}:".encode())
+    digest.update(canvas_image.tobytes())
+    return digest.hexdigest()
+
+
+def blob_path(blob_name):
+    """Ruta del blob: objects/ab/abcdef...{ext}"""
+    return os.path.join(BLOB_STORE_DIR, "objects", blob_name[:2], blob_name)
+
+
+def lookup_source(key):
+    """Blob de una subida anterior idéntica, o None si no existe (o se borró)"""
+    blob_name = _read(os.path.join(BLOB_STORE_DIR, "sources", key))
+    if blob_name and os.path.exists(blob_path(blob_name)):
+        return blob_name
+    return None
+
+
+def record_source(key, blob_name):
+    _write_atomic(os.path.join(BLOB_STORE_DIR, "sources", key), blob_name)
+
+
+def store_canvas(canvas_image, ext):
+    """
+    Guardar el canvas en el almacén si aún no existe un blob con los mismos
+    píxeles. Devuelve el nombre del blob; solo se codifica la primera vez.
+    """
+    blob_name = canvas_digest(canvas_image) + ext.lower()
+    path = blob_path(blob_name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = _tmp_name(path) + ext
+        canvas_image.save(tmp_path)
+        os.replace(tmp_path, path)
+    return blob_name
+
+
+def store_source(image_source, ext):
+    """
+    Guardar los bytes subidos sin procesar (imágenes que no necesitan canvas).
+    El nombre del blob es el SHA-256 del archivo.
+    """
+    digest = hashlib.sha256()
+    if isinstance(image_source, (bytes, bytearray)):
+        digest.update(image_source)
+    else:
+        image_source.seek(0)
+        for chunk in iter(lambda: image_source.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    blob_name = digest.hexdigest() + ext.lower()
+    path = blob_path(blob_name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = _tmp_name(path)
+        with open(tmp_path, 'wb') as f:
+            if isinstance(image_source, (bytes, bytearray)):
+                f.write(image_source)
+            else:
+                image_source.seek(0)
+                shutil.copyfileobj(image_source, f, HASH_CHUNK_SIZE)
+        os.replace(tmp_path, path)
+    return blob_name
+
+
+def find_in_session(blob_name, session):
+    """Nombre del archivo de la sesión que ya apunta a este blob, o None"""
+    filename = _read(os.path.join(BLOB_STORE_DIR, "refs", blob_name, session))
+    if not filename:
+        return None
+    image_path = os.path.join("annotations", session, "images", filename)
+    try:
+        if os.path.samefile(image_path, blob_path(blob_name)) or _same_content(image_path, blob_path(blob_name)):
+            return filename
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def _same_content(path_a, path_b):
+    if os.path.getsize(path_a) != os.path.getsize(path_b):
+        return False
+    with open(path_a, 'rb') as a, open(path_b, 'rb') as b:
+        while True:
+            chunk_a, chunk_b = a.read(HASH_CHUNK_SIZE), b.read(HASH_CHUNK_SIZE)
+            if chunk_a != chunk_b:
+                return False
+            if not chunk_a:
+                return True
+
+
+def link_into_session(blob_name, session, filename):
+    """Crear annotations/{sesion}/images/{filename} como hardlink al blob"""
+    image_path = os.path.join("annotations", session, "images", filename)
+    os.makedirs(os.path.dirname(image_path), exist_ok=True)
+
+    tmp_path = _tmp_name(image_path)
+    try:
+        os.link(blob_path(blob_name), tmp_path)
+    except OSError:
+        # Sin soporte de hardlinks (otro dispositivo, FAT...): copia normal
+        shutil.copyfile(blob_path(blob_name), tmp_path)
+    os.replace(tmp_path, image_path)
+    # rename() no hace nada si las dos rutas ya son enlaces al mismo inodo
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+
+    _write_atomic(os.path.join(BLOB_STORE_DIR, "refs", blob_name, session), filename)
+    return image_path
+
+
+def release_session(session):
+    """Borrar las refs de la sesión (ya eliminada). Devuelve los blobs que referenciaba."""
+    refs_dir = os.path.join(BLOB_STORE_DIR, "refs")
+    released = []
+    try:
+        blob_names = os.listdir(refs_dir)
+    except FileNotFoundError:
+        return released
+    for blob_name in blob_names:
+        try:
+            os.remove(os.path.join(refs_dir, blob_name, session))
+        except FileNotFoundError:
+            continue
+        released.append(blob_name)
+        try:
+            os.rmdir(os.path.join(refs_dir, blob_name))
+        except OSError:
+            pass  # otras sesiones lo siguen usando
+    return released
+
+
+def _live_refs(blob_name):
+    """Sesiones cuyo archivo referenciado sigue existiendo; borra las refs obsoletas"""
+    refs_dir = os.path.join(BLOB_STORE_DIR, "refs", blob_name)
+    try:
+        sessions = os.listdir(refs_dir)
+    except FileNotFoundError:
+        return []
+    live = []
+    for session in sessions:
+        filename = _read(os.path.join(refs_dir, session))
+        if filename and os.path.exists(os.path.join("annotations", session, "images", filename)):
+            live.append(session)
+        else:
+            try:
+                os.remove(os.path.join(refs_dir, session))
+            except FileNotFoundError:
+                pass
+    if not live:
+        try:
+            os.rmdir(refs_dir)
+        except OSError:
+            pass
+    return live
+
+
+def collect_garbage(blob_names=None):
+    """
+    Eliminar los blobs sin refs vigentes ni otros hardlinks (st_nlink == 1),
+    solo `blob_names` o todo el almacén. Devuelve {'blobs': n, 'bytes': b}.
+    """
+    if blob_names is None:
+        objects_dir = os.path.join(BLOB_STORE_DIR, "objects")
+        blob_names = [
+            name
+            for prefix in (os.listdir(objects_dir) if os.path.isdir(objects_dir) else [])
+            for name in os.listdir(os.path.join(objects_dir, prefix))
+            if '.tmp' not in name
+        ]
+    removed, freed = set(), 0
+    now = time.time()
+    for blob_name in blob_names:
+        path = blob_path(blob_name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if stat.st_nlink > 1 or now - stat.st_mtime < GC_GRACE_SECONDS or _live_refs(blob_name):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed.add(blob_name)
+        freed += stat.st_size
+
+    # Índice de subidas: las entradas que apuntaban a blobs eliminados ya no sirven
+    sources_dir = os.path.join(BLOB_STORE_DIR, "sources")
+    if removed and os.path.isdir(sources_dir):
+        for key in os.listdir(sources_dir):
+            if _read(os.path.join(sources_dir, key)) in removed:
+                try:
+                    os.remove(os.path.join(sources_dir, key))
+                except FileNotFoundError:
+                    pass
+    return {'blobs': len(removed), 'bytes': freed}
+
+
+def dedup_report(annotations_dir="annotations", hash_contents=False):
+    """
+    Informe de deduplicación de las imágenes de todas las sesiones.
+
+    - logical_bytes: lo que ocuparían todas las entradas de images/ por separado
+    - physical_bytes: lo que ocupan realmente (cada inodo cuenta una vez)
+    Con hash_contents=True además se detectan archivos idénticos que no están
+    enlazados (subidos antes de activar el almacén) y lo que se ahorraría.
+    """
+    inodes = {}
+    contents = {}
+    total_files = 0
+    logical_bytes = 0
+
+    if os.path.isdir(annotations_dir):
+        for session_name in sorted(os.listdir(annotations_dir)):
+            images_path = os.path.join(annotations_dir, session_name, "images")
+            if not os.path.isdir(images_path):
+                continue
+            for filename in os.listdir(images_path):
+                path = os.path.join(images_path, filename)
+                stat = os.stat(path)
+                total_files += 1
+                logical_bytes += stat.st_size
+                inode = (stat.st_dev, stat.st_ino)
+                if inode in inodes:
+                    continue
+                inodes[inode] = stat.st_size
+                if hash_contents:
+                    digest = hashlib.sha256()
+                    with open(path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                            digest.update(chunk)
+                    contents.setdefault(digest.hexdigest(), stat.st_size)
+
+    physical_bytes = sum(inodes.values())
+    report = {
+        'files': total_files,
+        'unique_files': len(inodes),
+        'logical_bytes': logical_bytes,
+        'physical_bytes': physical_bytes,
+        'bytes_saved': logical_bytes - physical_bytes,
+        'dedup_ratio': round(logical_bytes / physical_bytes, 3) if physical_bytes else 1.0
+    }
+    if hash_contents:
+        unique_bytes = sum(contents.values())
+        report['unique_contents'] = len(contents)
+        report['potential_bytes_saved'] = physical_bytes - unique_bytes
+    return report
+
+
+if __name__ == "__main__":
+    if "--gc" in sys.argv:
+        collected = collect_garbage()
+        print(f"🧹 Blobs sin referencias eliminados: {collected['blobs']} "
+              f"({collected['bytes'] / 1024 / 1024:.1f} MB liberados)")
+        sys.exit(0)
+    report = dedup_report(hash_contents="--hash" in sys.argv)
+    print("📦 Informe de deduplicación de annotations/")
+    print(f"   Archivos: {report['files']} ({report['unique_files']} únicos en disco)")
+    print(f"   Tamaño lógico: {report['logical_bytes'] / 1024 / 1024:.1f} MB")
+    print(f"   Tamaño real: {report['physical_bytes'] / 1024 / 1024:.1f} MB")
+    print(f"   Ahorrado: {report['bytes_saved'] / 1024 / 1024:.1f} MB (ratio {report['dedup_ratio']}x)")
+    if 'potential_bytes_saved' in report:
+        print(f"   Ahorro posible enlazando duplicados existentes: "
+              f"{report['potential_bytes_saved'] / 1024 / 1024:.1f} MB")
@@ -0,0 +1,548 @@
+"""
+Importación masiva de datasets YOLO, COCO y Pascal VOC desde un ZIP
+
+YOLO (con o sin carpeta raíz, con o sin subcarpetas train/val):
+    images/...      imágenes
+    labels/...      etiquetas .txt con la misma ruta relativa que su imagen
+    classes.txt     (opcional) un nombre de clase por línea
+    data.yaml       (opcional) clave `names` en formato Ultralytics
+
+COCO: uno o varios JSON de instancias (annotations/instances_train.json...)
+y las imágenes en cualquier carpeta. El JSON se lee en streaming y las cajas
+se convierten a YOLO de una vez con numpy (ver annotation_formats).
+
+Pascal VOC: un XML por imagen (Annotations/*.xml) y las imágenes en
+cualquier carpeta (JPEGImages/...).
+
+En COCO y VOC las clases se crean en la sesión por nombre, todas en una
+transacción, y las imágenes se enlazan con sus anotaciones por nombre de archivo.
+
+Las entradas se leen en streaming desde el ZIP (solo se carga en memoria la
+entrada que se está procesando) sin extraer el archivo a temp/. Las etiquetas
+se validan antes de escribir nada y las imágenes se procesan en paralelo en el
+pool de subidas, con un número acotado de entradas en vuelo. Las etiquetas se
+guardan en el almacén de la sesión (ver label_store) por lotes.
+"""
+import io
+import os
+import re
+import json
+import math
+import secrets
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from collections import Counter
+from concurrent.futures import wait, FIRST_COMPLETED
+from PIL import Image
+
+from image_processing import (
+    upload_executor, validate_image_header, MAX_UPLOAD_WORKERS, MAX_FILE_SIZE, _new_image_filename
+)
+from session_index import IMAGE_EXTENSIONS
+from label_store import get_label_store
+from annotation_formats import read_coco, coco_to_yolo_labels, parse_voc_xml, voc_to_yolo_labels
+
+# Tamaño máximo del ZIP de un dataset
+MAX_IMPORT_SIZE_MB = int(os.getenv("MAX_IMPORT_SIZE_MB", "2048"))
+MAX_IMPORT_SIZE = MAX_IMPORT_SIZE_MB * 1024 * 1024
+
+MAX_LABEL_FILE_SIZE = 1024 * 1024
+CLASS_FILES = ('classes.txt', 'data.yaml', 'data.yml')
+
+# Errores detallados que se devuelven como máximo en el informe
+MAX_REPORTED_ERRORS = 50
+
+# Etiquetas que se acumulan antes de guardarlas en el almacén de la sesión
+LABEL_BATCH_SIZE = 500
+
+
+class DatasetImportError(Exception):
+    """El ZIP no es un dataset YOLO válido"""
+    pass
+
+
+def _split_dataset_path(name, folder):
+    """
+    'raiz/images/train/a.jpg' con folder='images' → ('raiz', 'train/a').
+    Devuelve None si la ruta no está bajo esa carpeta.
+    """
+    parts = name.split('/')
+    if folder not in parts[:-1]:
+        return None
+    position = parts.index(folder)
+    prefix = '/'.join(parts[:position])
+    relative = '/'.join(parts[position + 1:])
+    return prefix, posixpath.splitext(relative)[0]
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        return value[1:-1]
+    return value
+
+
+def parse_data_yaml_names(text):
+    """
+    Leer la clave `names` de un data.yaml de Ultralytics sin depender de PyYAML.
+    Soporta lista en línea (`names: [a, b]`), lista en bloque (`- a`) y
+    diccionario índice → nombre (`0: a`).
+    """
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        match = re.match(r'^names\s*:\s*(.*)$', line)
+        if not match:
+            continue
+        inline = match.group(1).split(' #')[0].strip()
+        if inline.startswith('['):
+            return [_unquote(item) for item in inline.strip('[]').split(',') if item.strip()]
+        if inline.startswith('{'):
+            entries = [item.split(':', 1) for item in inline.strip('{}').split(',') if ':' in item]
+            by_index = {int(k): _unquote(v) for k, v in entries}
+            return [by_index[k] for k in sorted(by_index)]
+
+        as_list, by_index = [], {}
+        for block_line in lines[i + 1:]:
+            stripped = block_line.split(' #')[0].strip()
+            if not stripped:
+                continue
+            if not block_line[0].isspace() and not stripped.startswith('-'):
+                break
+            if stripped.startswith('-'):
+                as_list.append(_unquote(stripped[1:]))
+            elif ':' in stripped:
+                key, value = stripped.split(':', 1)
+                by_index[int(key)] = _unquote(value)
+        if by_index:
+            return [by_index[k] for k in sorted(by_index)]
+        return as_list
+    return None
+
+
+def read_class_names(zf):
+    """Nombres de clase del classes.txt o data.yaml menos anidado del ZIP, o None"""
+    candidates = [
+        info for info in zf.infolist()
+        if posixpath.basename(info.filename) in CLASS_FILES and info.file_size <= MAX_LABEL_FILE_SIZE
+    ]
+    if not candidates:
+        return None
+    info = min(candidates, key=lambda i: (i.filename.count('/'), CLASS_FILES.index(posixpath.basename(i.filename))))
+    text = zf.read(info).decode('utf-8', errors='replace')
+    if info.filename.endswith('classes.txt'):
+        return [line.strip() for line in text.splitlines() if line.strip()]
+    return parse_data_yaml_names(text)
+
+
+def validate_label_text(text, num_classes=None):
+    """
+    Validar un archivo de etiquetas YOLO de detección.
+    Devuelve la lista de cajas (class_id, [x_center, y_center, width, height]
+    como texto original) o lanza ValueError con la línea errónea.
+    """
+    boxes = []
+    for line_num, line in enumerate(text.splitlines(), 1):
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) != 5:
+            raise ValueError(f"línea {line_num}: se esperaban 5 valores y hay {len(parts)}")
+        try:
+            class_id = int(parts[0])
+            values = [float(v) for v in parts[1:]]
+        except ValueError:
+            raise ValueError(f"línea {line_num}: valores no numéricos")
+        if class_id < 0 or (num_classes is not None and class_id >= num_classes):
+            raise ValueError(f"línea {line_num}: clase {class_id} fuera de rango")
+        if not all(math.isfinite(v) and 0.0 <= v <= 1.0 for v in values) or values[2] <= 0 or values[3] <= 0:
+            raise ValueError(f"línea {line_num}: coordenadas fuera de [0, 1]")
+        boxes.append((class_id, parts[1:]))
+    return boxes
+
+
+def scan_archive(zf):
+    """
+    Emparejar imágenes y etiquetas leyendo solo el directorio central del ZIP.
+    Devuelve (pares [(info_imagen, info_etiqueta o None)], etiquetas huérfanas).
+    """
+    labels = {}
+    images = []
+    for info in zf.infolist():
+        if info.is_dir() or posixpath.basename(info.filename).startswith('.'):
+            continue
+        name = info.filename
+        lowered = name.lower()
+        if lowered.endswith('.txt'):
+            key = _split_dataset_path(name, 'labels')
+            if key:
+                labels[key] = info
+        elif lowered.endswith(IMAGE_EXTENSIONS):
+            key = _split_dataset_path(name, 'images')
+            if key:
+                images.append((key, info))
+
+    pairs = [(info, labels.pop(key, None)) for key, info in images]
+    return pairs, len(labels)
+
+
+def _safe_image_name(image_name, keep_path=False):
+    """
+    'images/train/a b.jpg' → 'train_a_b.jpg' (sin separadores de ruta). Fuera
+    de images/ solo se usa el nombre del archivo, o la ruta completa con
+    keep_path ('train2017/1.jpg' → 'train2017_1.jpg')
+    """
+    split = _split_dataset_path(image_name, 'images')
+    if split:
+        relative = split[1]
+    elif keep_path:
+        relative = posixpath.splitext(image_name)[0]
+    else:
+        relative = posixpath.splitext(posixpath.basename(image_name))[0]
+    ext = posixpath.splitext(image_name)[1].lower()
+    return re.sub(r'[^\w.\-]', '_', relative.replace('/', '_')) + ext
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _import_pair(zf, session, image_info, image_name):
+    """Validar y guardar una imagen. Se ejecuta en el pool."""
+    if image_info.file_size > MAX_FILE_SIZE:
+        raise ValueError(f"supera el tamaño máximo de {MAX_FILE_SIZE // (1024 * 1024)} MB")
+    data = zf.read(image_info)
+    validate_image_header(data)
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+    except Exception as e:
+        raise ValueError(f"imagen no válida ({e})")
+
+    image_filename = _new_image_filename(session, image_name)
+    # Las etiquetas YOLO están normalizadas a la imagen original: se guarda tal cual
+    _write_atomic(os.path.join("annotations", session, "images", image_filename), data)
+    return image_filename
+
+
+def _new_report(**extra):
+    return {'images': 0, 'labels': 0, 'boxes': 0, 'skipped': 0, 'orphan_labels': 0, 'errors': [], **extra}
+
+
+def _record_error(report, name, message):
+    report['skipped'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append(f"{name}: {message}")
+
+
+def _import_images(zf, session, items, total, report, progress_callback=None, image_names=None):
+    """
+    Guardar las imágenes de `items` en el pool (con un número acotado en vuelo)
+    y sus etiquetas en el almacén por lotes. Cada elemento es (info de la
+    imagen, líneas YOLO o None), o None si la entrada ya se descartó.
+    `image_names` ({ruta en el ZIP: nombre}) fija el nombre de las imágenes;
+    por defecto se usa _safe_image_name.
+
+    Los lotes de etiquetas también se guardan en el pool, en paralelo con las
+    imágenes; solo hay un lote en escritura a la vez (SQLite admite un único
+    escritor).
+    """
+    session_path = os.path.join("annotations", session)
+    os.makedirs(os.path.join(session_path, "images"), exist_ok=True)
+    os.makedirs(os.path.join(session_path, "labels"), exist_ok=True)
+    label_store = get_label_store(session)
+    pending_labels = {}
+    label_write = None
+    imported = []
+
+    def save_labels():
+        nonlocal label_write
+        if label_write is not None:
+            label_write.result()
+            label_write = None
+        if pending_labels:
+            label_write = upload_executor.submit(label_store.save_many, dict(pending_labels))
+            pending_labels.clear()
+
+    in_flight = {}
+    completed = 0
+    max_in_flight = MAX_UPLOAD_WORKERS * 2
+
+    def collect(done):
+        nonlocal completed
+        for future in done:
+            image_info, label_lines = in_flight.pop(future)
+            completed += 1
+            try:
+                image_filename = future.result()
+                imported.append(image_filename)
+                report['images'] += 1
+                if label_lines is not None:
+                    pending_labels[image_filename] = label_lines
+                    report['labels'] += 1
+                    report['boxes'] += len(label_lines)
+            except Exception as e:
+                _record_error(report, image_info.filename, str(e))
+            if progress_callback:
+                progress_callback(completed, total)
+        if len(pending_labels) >= LABEL_BATCH_SIZE:
+            save_labels()
+
+    for item in items:
+        if item is None:
+            completed += 1
+            continue
+        image_info, label_lines = item
+        if len(in_flight) >= max_in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+        image_name = (image_names or {}).get(image_info.filename) or _safe_image_name(image_info.filename)
+        future = upload_executor.submit(_import_pair, zf, session, image_info, image_name)
+        in_flight[future] = (image_info, label_lines)
+
+    collect(wait(in_flight)[0])
+    save_labels()
+    save_labels()
+
+    # Un solo recálculo del índice con todas las imágenes nuevas
+    label_store.update_index(imported)
+
+
+def _import_yolo(zf, session, class_map, progress_callback):
+    pairs, orphan_labels = scan_archive(zf)
+    if not pairs:
+        raise DatasetImportError("El ZIP no contiene imágenes en una carpeta images/")
+
+    num_classes = len(class_map) if class_map else None
+    report = _new_report(orphan_labels=orphan_labels)
+
+    def items():
+        for image_info, label_info in pairs:
+            label_lines = None
+            if label_info is not None:
+                # Las etiquetas se validan aquí (son pequeñas) para no escribir
+                # una imagen cuya etiqueta es inválida
+                try:
+                    if label_info.file_size > MAX_LABEL_FILE_SIZE:
+                        raise ValueError("archivo de etiquetas demasiado grande")
+                    text = zf.read(label_info).decode('utf-8')
+                    boxes = validate_label_text(text, num_classes)
+                except (ValueError, UnicodeDecodeError) as e:
+                    _record_error(report, label_info.filename, str(e))
+                    yield None
+                    continue
+                label_lines = [
+                    f"{class_map[class_id] if class_map else class_id} {' '.join(coords)}"
+                    for class_id, coords in boxes
+                ]
+            yield image_info, label_lines
+
+    _import_images(zf, session, items(), len(pairs), report, progress_callback)
+    report['total'] = len(pairs)
+    return report
+
+
+def import_yolo_zip(zip_source, session, class_map=None, progress_callback=None):
+    """
+    Importar un dataset YOLO (ruta o archivo abierto de un ZIP) en la sesión.
+
+    `class_map` traduce el índice de clase del dataset al índice de clase de la
+    sesión (ver ensure_session_classes); sin él se conservan los índices.
+    `progress_callback(completed, total)` se llama tras cada imagen.
+    """
+    try:
+        zf = zipfile.ZipFile(zip_source)
+    except zipfile.BadZipFile:
+        raise DatasetImportError("El archivo no es un ZIP válido")
+    with zf:
+        return _import_yolo(zf, session, class_map, progress_callback)
+
+
+# Bytes del principio de cada .json que se miran para reconocer un COCO
+COCO_SNIFF_SIZE = 1024 * 1024
+
+
+def _is_coco_json(zf, info):
+    with zf.open(info) as f:
+        head = f.read(COCO_SNIFF_SIZE).decode('utf-8', errors='replace')
+    return head.lstrip().startswith('{') and ('"images"' in head or '"annotations"' in head)
+
+
+def detect_dataset_format(zf):
+    """'yolo' (labels/*.txt), 'coco' (JSON con images/annotations) o 'voc' (XML por imagen)"""
+    infos = [
+        info for info in zf.infolist()
+        if not info.is_dir() and not posixpath.basename(info.filename).startswith('.')
+    ]
+    if any(info.filename.lower().endswith('.txt') and _split_dataset_path(info.filename, 'labels') for info in infos):
+        return 'yolo'
+    if any(info.filename.lower().endswith('.json') and _is_coco_json(zf, info) for info in infos):
+        return 'coco'
+    if any(info.filename.lower().endswith('.xml') for info in infos):
+        return 'voc'
+    return 'yolo'
+
+
+class _ImageIndex:
+    """Imágenes del ZIP por nombre, para enlazarlas con las anotaciones de COCO/VOC"""
+
+    def __init__(self, zf):
+        self.by_name = {}
+        self.by_stem = {}
+        for info in zf.infolist():
+            basename = posixpath.basename(info.filename)
+            if info.is_dir() or basename.startswith('.') or not basename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            self.by_name.setdefault(basename, []).append(info)
+            self.by_stem.setdefault(posixpath.splitext(basename)[0], []).append(info)
+        self.used = set()
+
+    def find(self, file_name):
+        """Entrada del ZIP para un file_name de COCO/VOC (puede traer ruta o no traer extensión)"""
+        file_name = file_name.replace('\\', '/')
+        basename = posixpath.basename(file_name)
+        candidates = self.by_name.get(basename) or self.by_stem.get(posixpath.splitext(basename)[0], [])
+        for info in candidates:
+            if info.filename == file_name or info.filename.endswith('/' + file_name):
+                return info
+        return candidates[0] if candidates else None
+
+    def unused(self):
+        return [info for infos in self.by_name.values() for info in infos if info.filename not in self.used]
+
+
+def _import_converted(zf, session, labels, images, report, progress_callback):
+    """Importar imágenes con etiquetas ya convertidas {file_name: líneas} y el resto sin etiquetas"""
+    items = []
+    for file_name, lines in labels.items():
+        info = images.find(file_name)
+        if info is None or info.filename in images.used:
+            report['orphan_labels'] += 1
+            continue
+        images.used.add(info.filename)
+        items.append((info, lines))
+    # Imágenes del ZIP sin anotaciones: se importan sin etiquetas, como en YOLO
+    items += [(info, None) for info in images.unused()]
+    if not items:
+        raise DatasetImportError("El ZIP no contiene imágenes")
+
+    # Imágenes con el mismo nombre en carpetas distintas (train2017/1.jpg y
+    # val2017/1.jpg) conservan su ruta en el nombre para poder distinguirlas
+    names = Counter(_safe_image_name(info.filename) for info, _ in items)
+    image_names = {
+        info.filename: _safe_image_name(info.filename, keep_path=names[_safe_image_name(info.filename)] > 1)
+        for info, _ in items
+    }
+    _import_images(zf, session, items, len(items), report, progress_callback, image_names)
+    report['total'] = len(items)
+    return report
+
+
+def _resolve(names, resolve_classes):
+    positions = resolve_classes(names) if resolve_classes and names else list(range(len(names)))
+    return dict(zip(names, positions))
+
+
+def _import_coco(zf, session, resolve_classes, progress_callback):
+    parsed = []
+    for info in zf.infolist():
+        if info.filename.lower().endswith('.json') and not info.is_dir() and _is_coco_json(zf, info):
+            with zf.open(info) as raw:
+                try:
+                    parsed.append(read_coco(io.TextIOWrapper(raw, encoding='utf-8')))
+                except (ValueError, KeyError, TypeError) as e:
+                    raise DatasetImportError(f"{info.filename}: JSON de COCO no válido ({e})")
+
+    # Todas las categorías de todos los JSON (train/val...) se crean de una vez
+    names = list(dict.fromkeys(
+        name for _, categories, _, _, _ in parsed for _, name in sorted(categories.items())
+    ))
+    positions = _resolve(names, resolve_classes)
+
+    report = _new_report(format='coco', dropped_boxes=0)
+    labels = {}
+    for images, categories, image_ids, category_ids, bboxes in parsed:
+        class_positions = {category_id: positions[name] for category_id, name in categories.items()}
+        converted, dropped = coco_to_yolo_labels(images, categories, image_ids, category_ids, bboxes, class_positions)
+        labels.update(converted)
+        report['dropped_boxes'] += dropped
+    return _import_converted(zf, session, labels, _ImageIndex(zf), report, progress_callback)
+
+
+def _import_voc(zf, session, resolve_classes, progress_callback):
+    report = _new_report(format='voc', dropped_boxes=0)
+    annotations = []
+    for info in sorted(zf.infolist(), key=lambda i: i.filename):
+        if info.is_dir() or not info.filename.lower().endswith('.xml'):
+            continue
+        try:
+            if info.file_size > MAX_LABEL_FILE_SIZE:
+                raise ValueError("archivo de anotaciones demasiado grande")
+            filename, width, height, objects = parse_voc_xml(zf.read(info))
+        except (ValueError, ET.ParseError) as e:
+            _record_error(report, info.filename, str(e))
+            continue
+        annotations.append((filename or posixpath.splitext(posixpath.basename(info.filename))[0], width, height, objects))
+
+    names = list(dict.fromkeys(obj[0] for _, _, _, objects in annotations for obj in objects))
+    labels, dropped = voc_to_yolo_labels(annotations, _resolve(names, resolve_classes))
+    report['dropped_boxes'] = dropped
+    return _import_converted(zf, session, labels, _ImageIndex(zf), report, progress_callback)
+
+
+def import_dataset_zip(zip_source, session, class_map=None, resolve_classes=None, progress_callback=None):
+    """
+    Importar un dataset YOLO, COCO o Pascal VOC (se detecta por su contenido).
+
+    YOLO usa `class_map` (ver import_yolo_zip). En COCO y VOC los nombres de
+    clase salen de las anotaciones: `resolve_classes(nombres)` devuelve su
+    class_id en la sesión (crea las que falten en una sola transacción); sin
+    él se numeran en orden de aparición.
+    """
+    try:
+        zf = zipfile.ZipFile(zip_source)
+    except zipfile.BadZipFile:
+        raise DatasetImportError("El archivo no es un ZIP válido")
+    with zf:
+        dataset_format = detect_dataset_format(zf)
+        if dataset_format == 'coco':
+            return _import_coco(zf, session, resolve_classes, progress_callback)
+        if dataset_format == 'voc':
+            return _import_voc(zf, session, resolve_classes, progress_callback)
+        return {'format': 'yolo', **_import_yolo(zf, session, class_map, progress_callback)}
+
+
+def run_import_job(zip_path, session, class_map=None, cleanup=None, resolve_classes=None):
+    """
+    Tarea en background: importar el ZIP publicando el progreso en
+    temp/progress_import_{sesion}.json (mismo formato que la augmentación).
+    """
+    progress_file = f"temp/progress_import_{session}.json"
+    os.makedirs("temp", exist_ok=True)
+
+    def write_progress(data):
+        tmp_path = f"{progress_file}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, progress_file)
+
+    def on_progress(completed, total):
+        # Publicar cada ~2% para no reescribir el archivo por cada imagen
+        if completed == total or completed % max(1, total // 50) == 0:
+            write_progress({
+                'completed': False, 'current': completed, 'total': total,
+                'percentage': round(completed / total * 100, 1)
+            })
+
+    try:
+        write_progress({'completed': False, 'current': 0, 'total': 0, 'percentage': 0})
+        report = import_dataset_zip(zip_path, session, class_map, resolve_classes, on_progress)
+        write_progress({'completed': True, 'percentage': 100, 'current': report['total'], **report})
+    except Exception as e:
+        write_progress({'completed': True, 'error': str(e)})
+    finally:
+        if cleanup:
+            cleanup()
@@ -0,0 +1,496 @@
+"""
+Almacenamiento de las anotaciones de una sesión (backends intercambiables)
+
+- txt:    un archivo YOLO por imagen en annotations/{sesion}/labels/ (por defecto)
+- sqlite: una base de datos por sesión (annotations/{sesion}/labels.sqlite3) con
+          una fila por caja, indexada por imagen y por clase; los .txt solo se
+          generan al exportar
+
+Ambos backends trabajan con líneas YOLO ("clase xc yc w h") y se identifican
+las etiquetas por el nombre de la imagen sin extensión, igual que los .txt.
+El backend de una sesión lo decide la presencia de su base de datos; las
+sesiones nuevas usan ANNOTATION_STORAGE. Para cambiar una sesión existente de
+backend: scripts/migrate_labels.py.
+
+Control de versión optimista: la versión de las etiquetas de una imagen es un
+hash de sus líneas. save, save_many y update aceptan la versión que leyó el
+cliente y la comprueban en el propio almacén, entre hilos y procesos: txt lee,
+compara y escribe con el bloqueo de la sesión (label_writer.label_lock);
+SQLite guarda la versión en cada fila y escribe con un UPDATE condicionado a
+ella. Si no coincide se lanza VersionConflict y no se escribe nada.
+"""
+import os
+import time
+import hashlib
+import sqlite3
+from contextlib import closing
+from itertools import groupby
+
+from annotation_utils import parse_yolo_line, parse_yolo_lines
+from label_writer import (
+    save_label_file, write_label_file, write_label_files, replace_label_files, flush_pending_labels,
+    label_lock, LABEL_FSYNC
+)
+from session_index import update_session_index, summarize_index, IMAGE_EXTENSIONS
+
+LABEL_STORAGE_BACKENDS = ('txt', 'sqlite')
+ANNOTATION_STORAGE = os.getenv("ANNOTATION_STORAGE", "txt")
+LABEL_DB_FILENAME = "labels.sqlite3"
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    image TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL,
+    version TEXT
+);
+CREATE TABLE IF NOT EXISTS boxes (
+    image TEXT NOT NULL REFERENCES labels(image) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    class_id INTEGER NOT NULL,
+    x_center REAL NOT NULL,
+    y_center REAL NOT NULL,
+    width REAL NOT NULL,
+    height REAL NOT NULL,
+    PRIMARY KEY (image, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS boxes_by_class ON boxes (class_id, image);
+"""
+# PRAGMA user_version de las bases con la columna labels.version
+SQLITE_SCHEMA_VERSION = 1
+
+
+class VersionConflict(Exception):
+    """Las etiquetas cambiaron desde la versión que envió el cliente"""
+
+    def __init__(self, message, version, lines, image=None):
+        super().__init__(message)
+        self.version = version
+        self.lines = lines
+        self.image = image
+
+
+def label_version(lines):
+    return hashlib.sha1('\n'.join(lines).encode()).hexdigest()[:16]
+
+
+def _conflict(lines, image_filename):
+    return VersionConflict(
+        "Las anotaciones cambiaron desde la versión enviada; recarga y vuelve a aplicar",
+        label_version(lines), lines, image_filename
+    )
+
+
+def check_version(lines, expected_version, image_filename=None):
+    """Versión de `lines`; VersionConflict si no es la esperada (None: sin comprobar)"""
+    version = label_version(lines)
+    if expected_version is not None and expected_version != version:
+        raise _conflict(lines, image_filename)
+    return version
+
+
+def label_stem(image_filename):
+    """Clave de las etiquetas de una imagen: su nombre sin extensión"""
+    return os.path.splitext(image_filename)[0]
+
+
+def _count_images(session):
+    images_path = os.path.join("annotations", session, "images")
+    if not os.path.isdir(images_path):
+        return 0
+    return sum(1 for f in os.listdir(images_path) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+class TxtLabelStore:
+    """Un archivo .txt por imagen (formato YOLO en disco)"""
+
+    backend = 'txt'
+
+    def __init__(self, session):
+        self.session = session
+        self.labels_path = os.path.join("annotations", session, "labels")
+
+    def _path(self, stem):
+        return os.path.join(self.labels_path, stem + '.txt')
+
+    def _read(self, path):
+        try:
+            with open(path, 'r') as f:
+                return [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            return None
+
+    def load(self, image_filename):
+        """Líneas YOLO de la imagen, o None si no tiene etiquetas"""
+        flush_pending_labels(self.session)
+        return self._read(self._path(label_stem(image_filename)))
+
+    def load_many(self, image_filenames):
+        """{imagen: líneas} de las imágenes que tienen etiquetas"""
+        flush_pending_labels(self.session)
+        labels = {}
+        for image_filename in image_filenames:
+            lines = self._read(self._path(label_stem(image_filename)))
+            if lines is not None:
+                labels[image_filename] = lines
+        return labels
+
+    def load_boxes_many(self, image_filenames):
+        """{imagen: [(class_id, xc, yc, w, h)]} de las imágenes que tienen etiquetas"""
+        return {
+            image_filename: parse_yolo_lines(lines, image_filename)
+            for image_filename, lines in self.load_many(image_filenames).items()
+        }
+
+    def save(self, image_filename, lines, expected_version=None):
+        """
+        Guardado individual. Sin versión (autosave) se agrupa si
+        LABEL_WRITE_COALESCE_MS está activo; con versión se escribe ya, solo si coincide.
+        """
+        if expected_version is None:
+            save_label_file(self._path(label_stem(image_filename)), lines)
+        else:
+            self.save_many({image_filename: lines}, {image_filename: expected_version})
+
+    def save_many(self, labels, expected_versions=None):
+        """
+        Guardar {imagen: líneas} en modo todo o nada; con expected_versions
+        ({imagen: versión}) solo si ninguna de esas imágenes cambió
+        """
+        if expected_versions:
+            # La versión actual incluye los autosaves pendientes
+            flush_pending_labels(self.session)
+
+        def check():
+            for image_filename, expected in (expected_versions or {}).items():
+                check_version(self._read(self._path(label_stem(image_filename))) or [], expected, image_filename)
+
+        write_label_files(self.session, labels, check)
+
+    def update(self, image_filename, func, expected_version=None):
+        """
+        Leer las líneas de la imagen, comprobar la versión y guardar
+        func(líneas) sin que otra escritura se cuele entre medias. Devuelve
+        (versión anterior, líneas nuevas).
+        """
+        flush_pending_labels(self.session)
+        with label_lock(self.session):
+            lines = self._read(self._path(label_stem(image_filename))) or []
+            version = check_version(lines, expected_version, image_filename)
+            new_lines = func(lines)
+            replace_label_files(self.session, {image_filename: new_lines})
+        return version, new_lines
+
+    def update_index(self, image_filenames):
+        """Recalcular en el índice de la sesión solo las entradas de estas imágenes"""
+        flush_pending_labels(self.session)
+        return update_session_index(self.session, image_filenames)
+
+    def count_labeled(self):
+        if not os.path.isdir(self.labels_path):
+            return 0
+        return sum(1 for f in os.listdir(self.labels_path) if f.endswith('.txt'))
+
+    def class_ids(self):
+        """Clases usadas en las etiquetas de la sesión"""
+        class_ids = set()
+        for _, data in self.iter_label_files():
+            for line in data.decode(errors='replace').splitlines():
+                try:
+                    box = parse_yolo_line(line)
+                except ValueError:
+                    continue
+                if box:
+                    class_ids.add(box[0])
+        return class_ids
+
+    def summary(self):
+        flush_pending_labels(self.session)
+        return summarize_index(update_session_index(self.session))
+
+    def iter_label_files(self):
+        """(nombre del .txt, contenido) de todas las etiquetas, para exportar"""
+        flush_pending_labels(self.session)
+        if not os.path.isdir(self.labels_path):
+            return
+        for filename in sorted(os.listdir(self.labels_path)):
+            if filename.endswith('.txt'):
+                with open(os.path.join(self.labels_path, filename), 'rb') as f:
+                    yield filename, f.read()
+
+
+class SqliteLabelStore:
+    """Cajas de la sesión en una tabla SQLite indexada por imagen y por clase"""
+
+    backend = 'sqlite'
+
+    def __init__(self, session, db_path=None):
+        self.session = session
+        self.db_path = db_path or os.path.join("annotations", session, LABEL_DB_FILENAME)
+
+    def _connect(self):
+        created = not os.path.exists(self.db_path)
+        if created:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # check_same_thread=False: los generadores (iter_label_files) se
+        # consumen por pasos desde el pool de hilos de StreamingResponse
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        # journal_mode queda guardado en la base, pero se pide siempre: las
+        # bases migradas desde txt llegan en modo DELETE (ver migrate_session)
+        conn.execute("PRAGMA journal_mode=WAL")
+        if created:
+            conn.executescript(SQLITE_SCHEMA)
+            conn.execute(f"PRAGMA user_version={SQLITE_SCHEMA_VERSION}")
+        elif conn.execute("PRAGMA user_version").fetchone()[0] < SQLITE_SCHEMA_VERSION:
+            self._add_versions(conn)
+        # Misma política de durabilidad que los .txt (ver label_writer)
+        conn.execute(f"PRAGMA synchronous={'NORMAL' if LABEL_FSYNC == 'none' else 'FULL'}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _add_versions(self, conn):
+        """Bases anteriores a labels.version: añadir la columna y calcularla para cada imagen"""
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= SQLITE_SCHEMA_VERSION:
+                return
+            conn.execute("ALTER TABLE labels ADD COLUMN version TEXT")
+            boxes = dict(
+                (stem, self._format(row[1:] for row in rows))
+                for stem, rows in groupby(conn.execute(
+                    "SELECT image, class_id, x_center, y_center, width, height FROM boxes ORDER BY image, position"
+                ), key=lambda row: row[0])
+            )
+            conn.executemany("UPDATE labels SET version = ? WHERE image = ?", [
+                (label_version(boxes.get(stem, [])), stem)
+                for (stem,) in conn.execute("SELECT image FROM labels").fetchall()
+            ])
+            conn.execute(f"PRAGMA user_version={SQLITE_SCHEMA_VERSION}")
+
+    @staticmethod
+    def _rows(stem, lines):
+        rows = []
+        for position, line in enumerate(lines):
+            box = parse_yolo_line(line)
+            if box:
+                rows.append((stem, position, *box))
+        return rows
+
+    @staticmethod
+    def _format(rows):
+        return [f"{class_id} {x} {y} {w} {h}" for class_id, x, y, w, h in rows]
+
+    def _write(self, conn, labels):
+        now = time.time()
+        for stem, lines in labels.items():
+            rows = self._rows(stem, lines)
+            # La versión de lo que devolverá load, no de las líneas recibidas
+            version = label_version(self._format(row[2:] for row in rows))
+            conn.execute(
+                "INSERT INTO labels (image, updated_at, version) VALUES (?, ?, ?) "
+                "ON CONFLICT (image) DO UPDATE SET updated_at = excluded.updated_at, version = excluded.version",
+                (stem, now, version)
+            )
+            conn.execute("DELETE FROM boxes WHERE image = ?", (stem,))
+            conn.executemany(
+                "INSERT INTO boxes (image, position, class_id, x_center, y_center, width, height) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def _claim(self, conn, image_filename, expected_version):
+        """
+        UPDATE condicionado a la versión: toma el bloqueo de escritura de la
+        base y falla con VersionConflict si la fila ya no tiene esa versión
+        """
+        stem = label_stem(image_filename)
+        if expected_version == label_version([]):
+            # Una imagen sin etiquetas todavía no tiene fila
+            cursor = conn.execute(
+                "INSERT INTO labels (image, updated_at, version) VALUES (?, ?, ?) "
+                "ON CONFLICT (image) DO UPDATE SET updated_at = excluded.updated_at WHERE labels.version = ?",
+                (stem, time.time(), expected_version, expected_version)
+            )
+        else:
+            cursor = conn.execute(
+                "UPDATE labels SET updated_at = ? WHERE image = ? AND version = ?",
+                (time.time(), stem, expected_version)
+            )
+        if cursor.rowcount == 0:
+            lines = self._format(conn.execute(
+                "SELECT class_id, x_center, y_center, width, height FROM boxes WHERE image = ? ORDER BY position",
+                (stem,)
+            ))
+            raise _conflict(lines, image_filename)
+
+    def load(self, image_filename):
+        return self.load_many([image_filename]).get(image_filename)
+
+    def load_boxes_many(self, image_filenames):
+        """{imagen: [(class_id, xc, yc, w, h)]} directamente de las filas, sin pasar por texto"""
+        by_stem = {label_stem(f): f for f in image_filenames}
+        boxes = {}
+        with closing(self._connect()) as conn:
+            conn.execute("CREATE TEMP TABLE wanted (image TEXT PRIMARY KEY)")
+            conn.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((stem,) for stem in by_stem))
+            for (stem,) in conn.execute("SELECT image FROM labels JOIN wanted USING (image)"):
+                boxes[by_stem[stem]] = []
+            for stem, rows in groupby(conn.execute(
+                "SELECT image, class_id, x_center, y_center, width, height "
+                "FROM boxes JOIN wanted USING (image) ORDER BY image, position"
+            ), key=lambda row: row[0]):
+                boxes[by_stem[stem]] = [row[1:] for row in rows]
+        return boxes
+
+    def load_many(self, image_filenames):
+        return {
+            image_filename: self._format(boxes)
+            for image_filename, boxes in self.load_boxes_many(image_filenames).items()
+        }
+
+    def save(self, image_filename, lines, expected_version=None):
+        expected_versions = None if expected_version is None else {image_filename: expected_version}
+        self.save_many({image_filename: lines}, expected_versions)
+
+    def save_many(self, labels, expected_versions=None):
+        """
+        Guardar {imagen: líneas} en una sola transacción; con expected_versions
+        ({imagen: versión}) solo si ninguna de esas imágenes cambió
+        """
+        with closing(self._connect()) as conn, conn:
+            for image_filename, expected in (expected_versions or {}).items():
+                self._claim(conn, image_filename, expected)
+            self._write(conn, {label_stem(f): lines for f, lines in labels.items()})
+
+    def update(self, image_filename, func, expected_version=None):
+        """
+        Leer las líneas de la imagen, comprobar la versión y guardar
+        func(líneas) condicionado a que nadie la haya cambiado entretanto.
+        Devuelve (versión anterior, líneas nuevas).
+        """
+        lines = self.load(image_filename) or []
+        version = check_version(lines, expected_version, image_filename)
+        new_lines = func(lines)
+        self.save_many({image_filename: new_lines}, {image_filename: version})
+        return version, new_lines
+
+    def import_label_files(self, labels):
+        """Guardar {nombre sin extensión: líneas} (p. ej. .txt migrados) en una transacción"""
+        with closing(self._connect()) as conn, conn:
+            self._write(conn, labels)
+
+    def update_index(self, image_filenames):
+        """Recalcular en el índice de la sesión (dimensiones de las imágenes) solo estas entradas"""
+        return update_session_index(self.session, image_filenames)
+
+    def count_labeled(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def class_ids(self):
+        with closing(self._connect()) as conn:
+            return {class_id for (class_id,) in conn.execute("SELECT DISTINCT class_id FROM boxes")}
+
+    def summary(self):
+        """Mismos totales que summarize_index, calculados con el índice por clase"""
+        with closing(self._connect()) as conn:
+            class_counts = dict(conn.execute(
+                "SELECT class_id, COUNT(*) FROM boxes GROUP BY class_id ORDER BY class_id"
+            ))
+            labeled = conn.execute("SELECT COUNT(DISTINCT image) FROM boxes").fetchone()[0]
+        return {
+            'images': _count_images(self.session),
+            'labeled_images': labeled,
+            'boxes': sum(class_counts.values()),
+            'class_counts': class_counts
+        }
+
+    def iter_label_files(self):
+        """Materializar los .txt (nombre, contenido) a partir de las filas, en streaming"""
+        with closing(self._connect()) as conn:
+            boxes = groupby(conn.execute(
+                "SELECT image, class_id, x_center, y_center, width, height "
+                "FROM boxes ORDER BY image, position"
+            ), key=lambda row: row[0])
+            stem, rows = next(boxes, (None, None))
+            for (image,) in conn.execute("SELECT image FROM labels ORDER BY image").fetchall():
+                lines = []
+                if image == stem:
+                    lines = self._format(row[1:] for row in rows)
+                    stem, rows = next(boxes, (None, None))
+                yield image + '.txt', '\n'.join(lines).encode()
+
+
+def _has_txt_labels(session):
+    labels_path = os.path.join("annotations", session, "labels")
+    if not os.path.isdir(labels_path):
+        return False
+    with os.scandir(labels_path) as entries:
+        return any(entry.name.endswith('.txt') for entry in entries)
+
+
+def get_label_store(session):
+    """
+    Backend de la sesión: SQLite si existe su base de datos; si no, el de
+    ANNOTATION_STORAGE para sesiones sin etiquetas todavía y txt para el resto
+    """
+    if os.path.exists(os.path.join("annotations", session, LABEL_DB_FILENAME)):
+        return SqliteLabelStore(session)
+    if ANNOTATION_STORAGE == 'sqlite' and not _has_txt_labels(session):
+        return SqliteLabelStore(session)
+    return TxtLabelStore(session)
+
+
+def is_label_db_file(filename):
+    """Archivos de la base de datos de etiquetas (incluidos -wal y -shm), que no se exportan"""
+    return filename.startswith(LABEL_DB_FILENAME)
+
+
+def migrate_session(session, backend):
+    """
+    Pasar las etiquetas de la sesión al backend indicado. Devuelve el número de
+    archivos de etiquetas migrados (0 si ya estaba en ese backend).
+
+    El origen solo se elimina cuando el destino está completo: a SQLite se
+    escribe en una base temporal que sustituye a la definitiva de una vez; a
+    txt se borra la base de datos después de escribir todos los archivos.
+    """
+    if backend not in LABEL_STORAGE_BACKENDS:
+        raise ValueError(f"Backend inválido: {backend}. Disponibles: {list(LABEL_STORAGE_BACKENDS)}")
+    session_path = os.path.join("annotations", session)
+    if not os.path.isdir(session_path):
+        raise ValueError(f"Sesión '{session}' no encontrada")
+
+    db_path = os.path.join(session_path, LABEL_DB_FILENAME)
+    labels_path = os.path.join(session_path, "labels")
+    has_db = os.path.exists(db_path)
+
+    if backend == 'sqlite':
+        if has_db:
+            return 0
+        files = list(TxtLabelStore(session).iter_label_files())
+        tmp_path = f"{db_path}.{os.getpid()}.tmp"
+        try:
+            SqliteLabelStore(session, db_path=tmp_path).import_label_files({
+                os.path.splitext(name)[0]: data.decode().splitlines() for name, data in files
+            })
+            # Pasar todo el WAL a la base antes de moverla
+            with closing(sqlite3.connect(tmp_path)) as conn:
+                conn.execute("PRAGMA journal_mode=DELETE")
+            os.replace(tmp_path, db_path)
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(tmp_path + suffix):
+                    os.remove(tmp_path + suffix)
+        for name, _ in files:
+            os.remove(os.path.join(labels_path, name))
+        return len(files)
+
+    if not has_db:
+        return 0
+    files = list(SqliteLabelStore(session).iter_label_files())
+    for name, data in files:
+        write_label_file(os.path.join(labels_path, name), data.decode().splitlines())
+    for filename in os.listdir(session_path):
+        if is_label_db_file(filename):
+            os.remove(os.path.join(session_path, filename))
+    return len(files)
@@ -0,0 +1,255 @@
+"""
+Escritura de archivos de etiquetas: atómica, con fsync configurable y
+agrupación opcional de guardados seguidos (autosave) de la misma imagen
+
+Todas las escrituras van a un temporal en el mismo directorio que después
+sustituye al archivo con os.replace, así ningún lector (visualize, augment,
+descarga) ve nunca un archivo a medio escribir.
+
+LABEL_FSYNC:
+- none: sin fsync (lo decide el sistema operativo)
+- file: fsync del temporal antes de sustituir (el contenido llega a disco)
+- dir:  además fsync del directorio (el cambio de nombre también es durable)
+
+LABEL_WRITE_COALESCE_MS > 0 activa la agrupación: los guardados de una misma
+imagen dentro de esa ventana se convierten en una sola escritura con la
+última versión.
+
+Todas las sustituciones de archivos de una sesión se hacen con su bloqueo
+(flock sobre temp/label_locks/{sesion}.lock), compartido por los hilos y los
+procesos del servidor: label_store lo usa para leer, comprobar la versión y
+escribir sin que otra escritura se cuele entre medias.
+"""
+import os
+import fcntl
+import shutil
+import secrets
+import threading
+from contextlib import contextmanager
+
+from annotation_utils import label_path_for, duplicate_label_stems
+
+FSYNC_POLICIES = ('none', 'file', 'dir')
+LABEL_FSYNC = os.getenv("LABEL_FSYNC", "none")
+LABEL_WRITE_COALESCE_MS = int(os.getenv("LABEL_WRITE_COALESCE_MS", "0"))
+LABEL_LOCK_DIR = os.path.join("temp", "label_locks")
+
+
+@contextmanager
+def label_lock(session):
+    """
+    Bloqueo exclusivo de las etiquetas de la sesión entre hilos y procesos.
+    No es reentrante, y dentro no se puede volcar ni descartar nada del
+    coalescer (su volcado toma este bloqueo).
+    """
+    os.makedirs(LABEL_LOCK_DIR, exist_ok=True)
+    with open(os.path.join(LABEL_LOCK_DIR, f"{session}.lock"), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_tmp(tmp_path, lines, fsync_policy):
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines))
+        if fsync_policy != 'none':
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def write_label_file(path, lines, fsync_policy=None):
+    """Escribir un archivo de etiquetas de forma atómica (temporal + os.replace)"""
+    fsync_policy = fsync_policy or LABEL_FSYNC
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    tmp_path = f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    try:
+        _write_tmp(tmp_path, lines, fsync_policy)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+    if fsync_policy == 'dir':
+        _fsync_dir(directory)
+
+
+def write_label_file_locked(path, lines):
+    """write_label_file con el bloqueo de la sesión (annotations/{sesion}/labels/x.txt)"""
+    with label_lock(os.path.basename(os.path.dirname(os.path.dirname(path)))):
+        write_label_file(path, lines)
+
+
+class LabelWriteCoalescer:
+    """
+    Agrupa escrituras del mismo archivo: la primera programa un volcado a los
+    `window` segundos y las siguientes solo sustituyen el contenido pendiente,
+    así una ráfaga de autosaves produce una escritura con la última versión
+    (latencia acotada a `window` aunque los guardados no paren).
+    """
+
+    def __init__(self, window, writer=write_label_file):
+        self.window = window
+        self.writer = writer
+        self._pending = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def submit(self, path, lines):
+        with self._lock:
+            self._pending[path] = lines
+            if path not in self._timers:
+                timer = threading.Timer(self.window, self.flush, args=(path,))
+                timer.daemon = True
+                self._timers[path] = timer
+                timer.start()
+
+    def flush(self, path):
+        """Escribir ya la versión pendiente del archivo (si la hay)"""
+        with self._lock:
+            lines = self._pending.pop(path, None)
+            timer = self._timers.pop(path, None)
+            if timer:
+                timer.cancel()
+            # Escribir dentro del lock: un submit posterior no puede adelantarse
+            if lines is not None:
+                self.writer(path, lines)
+
+    def discard(self, path):
+        """Olvidar la versión pendiente (se va a escribir otra más nueva)"""
+        with self._lock:
+            self._pending.pop(path, None)
+            timer = self._timers.pop(path, None)
+            if timer:
+                timer.cancel()
+
+    def flush_all(self, prefix=None):
+        """Volcar todo lo pendiente (o solo las rutas bajo `prefix`)"""
+        with self._lock:
+            paths = [p for p in self._pending if prefix is None or p.startswith(prefix)]
+        for path in paths:
+            self.flush(path)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+
+coalescer = (
+    LabelWriteCoalescer(LABEL_WRITE_COALESCE_MS / 1000, writer=write_label_file_locked)
+    if LABEL_WRITE_COALESCE_MS > 0 else None
+)
+
+
+def save_label_file(path, lines):
+    """Guardar etiquetas de una imagen: agrupado si está activo, si no atómico inmediato"""
+    if coalescer:
+        coalescer.submit(path, lines)
+    else:
+        write_label_file_locked(path, lines)
+
+
+def flush_pending_labels(session=None):
+    """
+    Volcar los guardados agrupados pendientes antes de leer etiquetas del disco
+    (de una sesión o de todas)
+    """
+    if coalescer:
+        prefix = os.path.join("annotations", session, "labels") + os.sep if session else None
+        coalescer.flush_all(prefix)
+
+
+def discard_pending_labels(session, image_filenames):
+    """Olvidar los autosaves pendientes de esas imágenes (se va a escribir algo más nuevo)"""
+    if coalescer:
+        for image_filename in image_filenames:
+            coalescer.discard(label_path_for(session, image_filename))
+
+
+def write_label_files(session, labels, check=None):
+    """
+    Escribir varios archivos de etiquetas ({imagen: líneas}) en modo todo o
+    nada, con el bloqueo de la sesión. `check`, si se indica, se llama ya con
+    el bloqueo tomado y antes de escribir (p. ej. para comprobar versiones);
+    si lanza una excepción no se escribe nada.
+    """
+    discard_pending_labels(session, labels)
+    with label_lock(session):
+        if check:
+            check()
+        replace_label_files(session, labels)
+
+
+def replace_label_files(session, labels):
+    """
+    Sustitución todo o nada de write_label_files, para quien ya tiene el
+    bloqueo de la sesión.
+
+    Primero se escriben todos los temporales; después se sustituyen los
+    archivos con os.replace guardando un hardlink del contenido anterior, que
+    se restaura si alguna sustitución falla. Dos imágenes con el mismo archivo
+    de etiquetas (a.jpg y a.png) se rechazan antes de escribir nada.
+    """
+    duplicates = duplicate_label_stems(labels)
+    if duplicates:
+        raise ValueError(f"Imágenes con el mismo archivo de etiquetas: {sorted(duplicates)}")
+    os.makedirs(os.path.join("annotations", session, "labels"), exist_ok=True)
+    suffix = f".{os.getpid()}.{secrets.token_hex(4)}"
+
+    staged = [label_path_for(session, image_filename) for image_filename in labels]
+    written = []
+    try:
+        for path, lines in zip(staged, labels.values()):
+            written.append(path + suffix + ".tmp")
+            _write_tmp(written[-1], lines, LABEL_FSYNC)
+    except BaseException:
+        for tmp_path in written:
+            _remove_quietly(tmp_path)
+        raise
+
+    replaced = []
+    try:
+        for path in staged:
+            backup = None
+            if os.path.exists(path):
+                backup = path + suffix + ".bak"
+                try:
+                    os.link(path, backup)
+                except OSError:
+                    shutil.copyfile(path, backup)
+            os.replace(path + suffix + ".tmp", path)
+            replaced.append((path, backup))
+    except BaseException:
+        # Deshacer: restaurar lo sustituido y borrar los temporales pendientes
+        for path, backup in replaced:
+            if backup:
+                os.replace(backup, path)
+            else:
+                _remove_quietly(path)
+        for path in staged[len(replaced):]:
+            _remove_quietly(path + suffix + ".tmp")
+            _remove_quietly(path + suffix + ".bak")
+        raise
+
+    for _, backup in replaced:
+        if backup:
+            _remove_quietly(backup)
+    if LABEL_FSYNC == 'dir':
+        _fsync_dir(os.path.join("annotations", session, "labels"))
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,173 @@
+"""
+Exportación para entrenar con las imágenes ya redimensionadas (letterbox)
+
+Con format=ultralytics&imgsz=640 cada imagen se escala para que su lado mayor
+mida imgsz y se centra en un lienzo cuadrado imgsz×imgsz relleno de gris
+(114, 114, 114), como el letterbox de Ultralytics: el cargador de datos ya no
+tiene que decodificar la resolución completa y redimensionar en cada época.
+
+- Las imágenes se procesan en un pool de hilos (PIL libera el GIL al
+  decodificar, redimensionar y codificar) con un número acotado en vuelo, y
+  se entregan a stream_zip en el orden de la sesión.
+- Las etiquetas YOLO se ajustan a la escala y el relleno con NumPy, para
+  todas las cajas de un lote a la vez. Las dimensiones originales salen del
+  índice de la sesión, sin abrir las imágenes.
+- letterbox.json registra la transformación de cada imagen (tamaño original,
+  escala y relleno) para poder deshacerla sobre las predicciones.
+
+Las JPEG se vuelven a codificar como JPEG y el resto como PNG.
+"""
+import io
+import os
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+from image_processing import RESIZE_MODES, RESIZE_QUALITY
+from label_store import get_label_store, label_stem
+from session_index import image_dimensions
+from training_export import data_yaml, session_images, split_for, training_class_names, EXPORT_BATCH_SIZE
+from annotation_formats import group_yolo_lines
+
+LETTERBOX_SIZES = (320, 640, 1280)
+LETTERBOX_COLOR = (114, 114, 114)
+LETTERBOX_METADATA = "letterbox.json"
+LETTERBOX_JPEG_QUALITY = int(os.getenv("LETTERBOX_JPEG_QUALITY", "95"))
+LETTERBOX_WORKERS = int(os.getenv("LETTERBOX_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+letterbox_executor = ThreadPoolExecutor(max_workers=max(1, LETTERBOX_WORKERS), thread_name_prefix="letterbox")
+
+
+def letterbox_geometry(widths, heights, size):
+    """
+    (escala, ancho y alto escalados, relleno izquierdo y superior) de cada
+    imagen, como arrays. El redondeo es el mismo que usa letterbox_image.
+    """
+    widths = np.asarray(widths, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    scale = np.minimum(size / widths, size / heights)
+    new_w = np.clip(np.rint(widths * scale), 1, size).astype(np.int64)
+    new_h = np.clip(np.rint(heights * scale), 1, size).astype(np.int64)
+    return scale, new_w, new_h, (size - new_w) // 2, (size - new_h) // 2
+
+
+def letterbox_boxes(boxes, widths, heights, size):
+    """
+    Cajas YOLO normalizadas (N, 4: xc, yc, w, h) de imágenes widths×heights →
+    normalizadas al lienzo size×size con letterbox
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    _, new_w, new_h, pad_x, pad_y = letterbox_geometry(widths, heights, size)
+    return np.stack([
+        (boxes[:, 0] * new_w + pad_x) / size,
+        (boxes[:, 1] * new_h + pad_y) / size,
+        boxes[:, 2] * new_w / size,
+        boxes[:, 3] * new_h / size,
+    ], axis=1)
+
+
+def is_jpeg(filename):
+    return filename.lower().endswith(('.jpg', '.jpeg'))
+
+
+def letterbox_filename(filename):
+    """Nombre de la imagen en el ZIP (las que no son JPEG pasan a PNG)"""
+    return filename if is_jpeg(filename) else f"{os.path.splitext(filename)[0]}.png"
+
+
+def letterbox_image(path, size):
+    """Bytes de la imagen redimensionada y centrada en un lienzo size×size. Se ejecuta en el pool."""
+    resize_mode = RESIZE_MODES[RESIZE_QUALITY]
+    with Image.open(path) as img:
+        _, (new_w,), (new_h,), (pad_x,), (pad_y,) = letterbox_geometry([img.width], [img.height], size)
+        # JPEG: decodificar ya reducido en el dominio DCT cuando la imagen es mucho mayor
+        gap = resize_mode['reducing_gap']
+        img.draft(None, (int(new_w * gap), int(new_h * gap)))
+        if img.mode == 'P':
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        elif img.mode not in ('RGB', 'RGBA', 'LA'):
+            img = img.convert('RGB')
+        if img.size != (new_w, new_h):
+            img = img.resize((int(new_w), int(new_h)), resize_mode['resample'], reducing_gap=gap)
+
+        canvas = Image.new('RGB', (size, size), LETTERBOX_COLOR)
+        box = (int(pad_x), int(pad_y))
+        canvas.paste(img, box, mask=img if img.mode in ('RGBA', 'LA') else None)
+
+    buffer = io.BytesIO()
+    if is_jpeg(path):
+        canvas.save(buffer, format='JPEG', quality=LETTERBOX_JPEG_QUALITY)
+    else:
+        canvas.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def iter_in_pool(executor, func, items, workers):
+    """
+    func(*item) de cada elemento de `items` en el pool, en orden, con hasta
+    2 × workers (los hilos del pool) en vuelo
+    """
+    window = deque()
+    max_inflight = 2 * max(1, workers)
+    for item in items:
+        window.append(executor.submit(func, *item))
+        if len(window) >= max_inflight:
+            yield window.popleft().result()
+    while window:
+        yield window.popleft().result()
+
+
+def iter_letterbox_entries(session, class_names, size, val_ratio, seed, executor=None, workers=None):
+    """
+    (nombre en el ZIP, bytes) del dataset de Ultralytics con imágenes
+    size×size, etiquetas ajustadas y letterbox.json al final. Con otro
+    `executor`, `workers` son sus hilos (por defecto el pool compartido).
+    """
+    executor, workers = executor or letterbox_executor, workers or LETTERBOX_WORKERS
+    yield "data.yaml", data_yaml(training_class_names(session, class_names))
+
+    dimensions = image_dimensions(session)
+    store = get_label_store(session)
+    images_path = os.path.join("annotations", session, "images")
+    # Sin dimensiones conocidas (imagen ilegible) no se puede transformar
+    images = [name for name in session_images(session) if dimensions.get(name, (None, None))[0]]
+    transforms = {}
+    for start in range(0, len(images), EXPORT_BATCH_SIZE):
+        batch = images[start:start + EXPORT_BATCH_SIZE]
+        labels = store.load_boxes_many(batch)
+        sizes = np.array([dimensions[name] for name in batch], dtype=np.float64).reshape(-1, 2)
+
+        # Todas las cajas del lote a la vez
+        counts = [len(labels.get(name, ())) for name in batch]
+        owners = np.repeat(np.arange(len(batch)), counts)
+        rows = np.array([box for name in batch for box in labels.get(name, ())], dtype=np.float64).reshape(-1, 5)
+        boxes = letterbox_boxes(rows[:, 1:], sizes[owners, 0], sizes[owners, 1], size)
+        lines = group_yolo_lines(owners, rows[:, 0].astype(np.int64), boxes, len(batch))
+
+        scale, new_w, new_h, pad_x, pad_y = letterbox_geometry(sizes[:, 0], sizes[:, 1], size)
+        geometry = zip(
+            sizes.astype(np.int64).tolist(), np.stack([new_w, new_h], axis=1).tolist(),
+            scale.tolist(), np.stack([pad_x, pad_y], axis=1).tolist()
+        )
+
+        data = iter_in_pool(
+            executor, letterbox_image, [(os.path.join(images_path, name), size) for name in batch], workers
+        )
+        for offset, (filename, image_bytes, (original, resized, ratio, pad)) in enumerate(zip(batch, data, geometry)):
+            split = split_for(filename, val_ratio, seed)
+            arcname = f"images/{split}/{letterbox_filename(filename)}"
+            transforms[arcname] = {
+                'source': filename, 'original': original, 'resized': resized, 'scale': ratio, 'pad': pad
+            }
+            yield arcname, image_bytes
+            if filename in labels:
+                yield f"labels/{split}/{label_stem(filename)}.txt", '\n'.join(lines[offset]).encode()
+
+    yield LETTERBOX_METADATA, json.dumps({
+        'imgsz': size,
+        'color': list(LETTERBOX_COLOR),
+        # Píxel en la imagen original = (píxel en el lienzo - pad) × original / resized
+        'images': transforms,
+    }, ensure_ascii=False).encode()
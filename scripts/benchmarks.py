@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Benchmarks de rendimiento del YOLO Multi-Class Annotator
+
+Cada benchmark trabaja con datos sintéticos generados en memoria o en un
+directorio temporal, por lo que no necesita MySQL ni el servidor activo.
+
+Uso:
+    python scripts/benchmarks.py              # Ejecutar todos
+    python scripts/benchmarks.py visualize    # Ejecutar uno concreto
+"""
+
+import os
+import sys
+import json
+import time
+import random
+from pathlib import Path
+
+# Permitir importar los módulos del proyecto desde scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def _timeit(func, repeat=3):
+    """Devuelve (mejor tiempo en segundos, resultado de la última ejecución)"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_visualize(num_images=10000, max_boxes=8):
+    """Tamaño del payload y tiempo de serialización de /visualize: full vs compact"""
+    from annotation_utils import serialize_image_entry, parse_fields
+
+    print(f"📊 Respuesta de /visualize con {num_images} imágenes (hasta {max_boxes} cajas por imagen)")
+    rng = random.Random(42)
+    images = []
+    for i in range(num_images):
+        width, height = 640, 640
+        annotations = []
+        for _ in range(rng.randint(0, max_boxes)):
+            xc, yc = rng.random(), rng.random()
+            w, h = rng.uniform(0.01, 0.3), rng.uniform(0.01, 0.3)
+            annotations.append({
+                'class_id': rng.randint(0, 5),
+                'x1': int((xc - w / 2) * width), 'y1': int((yc - h / 2) * height),
+                'x2': int((xc + w / 2) * width), 'y2': int((yc + h / 2) * height),
+                'x_center': xc, 'y_center': yc, 'width': w, 'height': h
+            })
+        images.append({
+            'name': f"sesion_20250101_000000_img{i}.jpg",
+            'labels': len(annotations),
+            'annotations': annotations,
+            'width': width,
+            'height': height
+        })
+
+    cases = [
+        ("full", "full", None),
+        ("compact", "compact", None),
+        ("compact fields=class_id,x1,y1,x2,y2", "compact", parse_fields("class_id,x1,y1,x2,y2")),
+    ]
+    baseline = None
+    for label, response_format, fields in cases:
+        def run():
+            payload = [serialize_image_entry(img, response_format, fields) for img in images]
+            return json.dumps({"success": True, "images": payload})
+        elapsed, body = _timeit(run)
+        size = len(body.encode())
+        baseline = baseline or size
+        print(f"   {label:40s} {size / 1024 / 1024:8.2f} MB  {elapsed * 1000:8.1f} ms  ({size / baseline:.0%})")
+
+
+def bench_decode(resolutions=((4032, 3024), (6000, 4000), (8000, 6000)), max_size=800):
+    """Decodificación + redimensionado de JPEG de cámara: ruta completa vs draft()"""
+    import io
+    import numpy as np
+    from PIL import Image
+    from image_processing import create_canvas_with_image
+
+    def baseline(jpeg):
+        # Ruta anterior: decodificar a resolución nativa y LANCZOS al tamaño final
+        img = Image.open(io.BytesIO(jpeg)).convert('RGB')
+        ratio = min(max_size / img.width, max_size / img.height)
+        return img.resize((int(img.width * ratio), int(img.height * ratio)), Image.Resampling.LANCZOS)
+
+    print(f"📷 Decodificación de JPEG a max_size={max_size}")
+    rng = np.random.default_rng(42)
+    for width, height in resolutions:
+        # Gradiente con ruido para que el JPEG tenga un tamaño realista
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        pixels = (gradient + rng.normal(0, 20, (height, width, 3))).clip(0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+        jpeg = buffer.getvalue()
+
+        print(f"   {width}x{height} ({width * height / 1e6:.0f} MP, {len(jpeg) / 1024 / 1024:.1f} MB)")
+        base_time, _ = _timeit(lambda: baseline(jpeg))
+        print(f"      {'completa + LANCZOS':24s} {base_time * 1000:8.1f} ms")
+        for quality in ('quality', 'fast'):
+            elapsed, _ = _timeit(lambda: create_canvas_with_image(
+                jpeg, (max_size, max_size), 0, 0, resize_quality=quality, max_size=max_size
+            ))
+            print(f"      {'draft + ' + quality:24s} {elapsed * 1000:8.1f} ms  (x{base_time / elapsed:.1f})")
+
+
+def bench_composite(canvas_size=(1024, 1024), image_size=(800, 600)):
+    """
+    Composición del canvas con transparencia: ruta anterior (fondo blanco
+    intermedio + dos paste), composición con arrays NumPy y ruta actual
+    (mezcla con máscara directamente sobre el canvas)
+    """
+    import io
+    import numpy as np
+    from PIL import Image
+    from image_processing import create_canvas_with_image
+
+    bg_color = (200, 200, 200)
+
+    def centered(img):
+        return (canvas_size[0] - img.width) // 2, (canvas_size[1] - img.height) // 2
+
+    def baseline(data):
+        img = Image.open(io.BytesIO(data))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        canvas = Image.new('RGB', canvas_size, bg_color)
+        if img.mode in ('RGBA', 'LA'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        canvas.paste(img, centered(img))
+        return canvas
+
+    def with_numpy(data):
+        # Un array de salida, fondo por difusión de una fila y mezcla alfa
+        # vectorizada; el coste está en copiar de PIL a NumPy y de vuelta
+        img = Image.open(io.BytesIO(data)).convert('RGBA')
+        paste_x, paste_y = centered(img)
+        canvas = np.empty((canvas_size[1], canvas_size[0], 3), dtype=np.uint8)
+        canvas[:] = np.full((canvas_size[0], 3), bg_color, dtype=np.uint8)
+        pixels = np.asarray(img)
+        alpha = pixels[..., 3:].astype(np.uint16)
+        region = canvas[paste_y:paste_y + img.height, paste_x:paste_x + img.width]
+        np.floor_divide(pixels[..., :3] * alpha + 255 * (255 - alpha) + 127, 255, out=region, casting='unsafe')
+        return Image.fromarray(canvas)
+
+    rng = np.random.default_rng(42)
+    width, height = image_size
+    rgba = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    inputs = {}
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, format='WEBP', lossless=True)
+    inputs['WebP RGBA'] = buffer.getvalue()
+    buffer = io.BytesIO()
+    Image.fromarray(rgba[..., :3], 'RGB').quantize(64).save(buffer, format='PNG', transparency=0)
+    inputs['PNG paleta'] = buffer.getvalue()
+
+    print(f"🎨 Composición de {width}x{height} sobre canvas {canvas_size[0]}x{canvas_size[1]} (incluye decodificar)")
+    for label, data in inputs.items():
+        print(f"   {label}")
+        base_time, expected = _timeit(lambda: baseline(data), repeat=5)
+        print(f"      {'anterior':10s} {base_time * 1000:7.1f} ms")
+        for variant, func in (
+            ('NumPy', lambda: with_numpy(data)),
+            ('actual', lambda: create_canvas_with_image(data, canvas_size, 0, 0, change_bg=False)),
+        ):
+            elapsed, result = _timeit(func, repeat=5)
+            diff = np.abs(np.asarray(expected, dtype=np.int16) - np.asarray(result, dtype=np.int16)).max()
+            print(f"      {variant:10s} {elapsed * 1000:7.1f} ms  (x{base_time / elapsed:.2f}, diferencia máx. {diff})")
+
+
+def bench_label_store(num_images=5000, max_boxes=8):
+    """
+    Backends de etiquetas (un .txt por imagen vs SQLite por sesión): guardado
+    individual y por lotes, lectura de toda la sesión (/visualize),
+    estadísticas, clases usadas y materialización de los .txt al exportar
+    """
+    import tempfile
+    from label_store import TxtLabelStore, SqliteLabelStore
+
+    print(f"🗃️  Almacenamiento de etiquetas con {num_images} imágenes (hasta {max_boxes} cajas por imagen)")
+    rng = random.Random(42)
+    labels = {
+        f"img{i:06d}.jpg": [
+            f"{rng.randint(0, 9)} {rng.random()} {rng.random()} {rng.uniform(0.01, 0.3)} {rng.uniform(0.01, 0.3)}"
+            for _ in range(rng.randint(0, max_boxes))
+        ]
+        for i in range(num_images)
+    }
+    names = list(labels)
+
+    cwd = os.getcwd()
+    for backend, store_class in (('txt', TxtLabelStore), ('sqlite', SqliteLabelStore)):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                images_path = os.path.join("annotations", "bench", "images")
+                os.makedirs(images_path)
+                for name in names:
+                    open(os.path.join(images_path, name), 'wb').close()
+                store = store_class("bench")
+
+                print(f"   {backend}")
+                cases = [
+                    ("guardar por lotes", lambda: store.save_many(labels), 1),
+                    ("guardar 200 individuales", lambda: [store.save(n, labels[n]) for n in names[:200]], 3),
+                    ("leer toda la sesión (líneas)", lambda: store.load_many(names), 3),
+                    ("leer toda la sesión (cajas)", lambda: store.load_boxes_many(names), 3),
+                    ("estadísticas (1ª vez)", store.summary, 1),
+                    ("estadísticas", store.summary, 3),
+                    ("clases usadas", store.class_ids, 3),
+                    ("exportar .txt", lambda: sum(len(data) for _, data in store.iter_label_files()), 3),
+                ]
+                for label, func, repeat in cases:
+                    elapsed, _ = _timeit(func, repeat=repeat)
+                    print(f"      {label:28s} {elapsed * 1000:9.1f} ms")
+            finally:
+                os.chdir(cwd)
+
+
+def bench_export_compression(num_images=200, image_size=(1280, 960), max_boxes=8):
+    """
+    Descarga de una sesión con los presets de compresión: tiempo total de
+    generación del ZIP y tamaño final. "deflate todo" comprime también las
+    imágenes (lo que se hacía antes de la política por tipo de archivo)
+    """
+    import tempfile
+    import numpy as np
+    from PIL import Image
+    import zip_stream
+    from zip_stream import stream_zip, COMPRESSION_PRESETS
+    from session_export import iter_session_entries
+
+    print(f"🗜️  Exportación de {num_images} JPEG {image_size[0]}x{image_size[1]} con etiquetas")
+    rng = random.Random(42)
+    np_rng = np.random.default_rng(42)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            session_path = os.path.join("annotations", "bench")
+            os.makedirs(os.path.join(session_path, "images"))
+            os.makedirs(os.path.join(session_path, "labels"))
+            # Degradado con ruido: se parece más a una foto que el ruido puro o un color liso
+            width, height = image_size
+            gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+            for i in range(num_images):
+                noise = np_rng.normal(0, 25, (height, width, 3)).astype(np.float32)
+                pixels = np.clip(gradient * (0.5 + 0.5 * (i % 3)) + noise, 0, 255).astype(np.uint8)
+                Image.fromarray(pixels).save(os.path.join(session_path, "images", f"img{i:04d}.jpg"), quality=90)
+                lines = [
+                    f"{rng.randint(0, 9)} {rng.random():.6f} {rng.random():.6f} "
+                    f"{rng.uniform(0.01, 0.3):.6f} {rng.uniform(0.01, 0.3):.6f}"
+                    for _ in range(rng.randint(0, max_boxes))
+                ]
+                with open(os.path.join(session_path, "labels", f"img{i:04d}.txt"), 'w') as f:
+                    f.write('\n'.join(lines))
+            with open(os.path.join(session_path, "augmentation_log.json"), 'w') as f:
+                json.dump([{'image': f"img{i:04d}.jpg", 'type': 'espejo'} for i in range(num_images)], f)
+
+            def export(preset):
+                return sum(len(chunk) for chunk in stream_zip(iter_session_entries("bench"), compression=preset))
+
+            variants = [(preset, preset) for preset in COMPRESSION_PRESETS]
+            variants.append(("deflate todo", 'balanced'))
+            for label, preset in variants:
+                stored = zip_stream.STORED_EXTENSIONS
+                if label == "deflate todo":
+                    zip_stream.STORED_EXTENSIONS = ()
+                try:
+                    elapsed, size = _timeit(lambda: export(preset), repeat=3)
+                finally:
+                    zip_stream.STORED_EXTENSIONS = stored
+                print(f"      {label:14s} {elapsed * 1000:8.1f} ms  {size / 1024 / 1024:8.2f} MB")
+        finally:
+            os.chdir(cwd)
+
+
+def bench_parallel_compression(num_entries=64, entry_size=256 * 1024, workers=(1, 2, 4, 8)):
+    """
+    Compresión de entradas en paralelo al generar el ZIP: rendimiento (MB/s de
+    datos sin comprimir) con 1 hilo frente a varios, con entradas de texto
+    comprimible del tamaño que se envía al pool
+    """
+    from zip_stream import stream_zip
+
+    print(f"🧵 Compresión paralela de {num_entries} entradas de {entry_size // 1024} KB (CPUs: {os.cpu_count()})")
+    rng = random.Random(42)
+    entries = []
+    for i in range(num_entries):
+        lines, size = [], 0
+        while size < entry_size:
+            line = f"{rng.randint(0, 9)} {rng.random():.6f} {rng.random():.6f} {rng.random():.6f} {rng.random():.6f}\n"
+            lines.append(line)
+            size += len(line)
+        entries.append((f"labels/{i:05d}.txt", ''.join(lines).encode()))
+    total_mb = sum(len(data) for _, data in entries) / 1024 / 1024
+
+    for preset in ('balanced', 'small'):
+        print(f"   {preset}")
+        base_time = None
+        for count in workers:
+            elapsed, size = _timeit(
+                lambda: sum(len(chunk) for chunk in stream_zip(entries, compression=preset, workers=count)), repeat=3
+            )
+            base_time = base_time or elapsed
+            print(f"      {count} hilo(s) {elapsed * 1000:8.1f} ms  {total_mb / elapsed:7.1f} MB/s  "
+                  f"(x{base_time / elapsed:.2f}, {size / 1024 / 1024:.1f} MB)")
+
+
+def bench_coco_conversion(num_images=20000, max_boxes=8):
+    """
+    Conversión YOLO → COCO de una sesión: bucle por caja (como los scripts de
+    conversión habituales) frente a la conversión vectorizada por lotes con
+    NumPy y el JSON generado por bloques
+    """
+    import numpy as np
+    from annotation_formats import yolo_to_absolute
+
+    rng = random.Random(42)
+    dimensions = [(rng.choice((640, 1280, 4000)), rng.choice((480, 960, 3000))) for _ in range(num_images)]
+    labels = [
+        [(rng.randint(0, 9), rng.random(), rng.random(), rng.uniform(0.01, 0.3), rng.uniform(0.01, 0.3))
+         for _ in range(rng.randint(0, max_boxes))]
+        for _ in range(num_images)
+    ]
+    total = sum(len(boxes) for boxes in labels)
+    print(f"🔁 YOLO → COCO de {num_images} imágenes ({total} cajas)")
+
+    def per_box():
+        annotations = []
+        for image_id, (boxes, (width, height)) in enumerate(zip(labels, dimensions), 1):
+            for class_id, xc, yc, w, h in boxes:
+                x1 = max(0.0, (xc - w / 2) * width)
+                y1 = max(0.0, (yc - h / 2) * height)
+                x2 = min(width, (xc + w / 2) * width)
+                y2 = min(height, (yc + h / 2) * height)
+                annotations.append({
+                    'id': len(annotations) + 1, 'image_id': image_id, 'category_id': class_id + 1,
+                    'bbox': [round(x1, 2), round(y1, 2), round(x2 - x1, 2), round(y2 - y1, 2)],
+                    'area': round((x2 - x1) * (y2 - y1), 2), 'iscrowd': 0
+                })
+        return len(json.dumps(annotations))
+
+    def vectorized():
+        counts = [len(boxes) for boxes in labels]
+        owners = np.repeat(np.arange(num_images), counts)
+        sizes = np.array(dimensions, dtype=np.float64)
+        classes, corners = yolo_to_absolute([box for boxes in labels for box in boxes], sizes[owners, 0], sizes[owners, 1])
+        box_sizes = corners[:, 2:] - corners[:, :2]
+        bboxes = np.round(np.concatenate([corners[:, :2], box_sizes], axis=1), 2).tolist()
+        areas = np.round(box_sizes[:, 0] * box_sizes[:, 1], 2).tolist()
+        image_ids = (owners + 1).tolist()
+        category_ids = (classes + 1).tolist()
+        return len(json.dumps([
+            {'id': i + 1, 'image_id': image_ids[i], 'category_id': category_ids[i],
+             'bbox': bboxes[i], 'area': areas[i], 'iscrowd': 0}
+            for i in range(len(bboxes))
+        ]))
+
+    base_time, _ = _timeit(per_box, repeat=3)
+    print(f"      {'por caja':12s} {base_time * 1000:8.1f} ms")
+    elapsed, _ = _timeit(vectorized, repeat=3)
+    print(f"      {'vectorizado':12s} {elapsed * 1000:8.1f} ms  (x{base_time / elapsed:.2f})")
+
+
+def bench_letterbox(num_images=8, image_size=(4000, 3000), imgsz=640, workers=(1, 2, 4)):
+    """
+    Exportación con letterbox: coste por época de un cargador de datos que
+    decodifica y redimensiona la imagen original frente a decodificar la ya
+    redimensionada, y tiempo de exportación con 1 hilo frente a varios
+    """
+    import io
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+    from letterbox_export import letterbox_image
+
+    print(f"📐 Letterbox a {imgsz} de {num_images} JPEG de {image_size[0]}x{image_size[1]} (CPUs: {os.cpu_count()})")
+    with tempfile.TemporaryDirectory() as tmp:
+        rng = random.Random(42)
+        paths = []
+        for i in range(num_images):
+            img = Image.new('RGB', image_size, tuple(rng.randint(0, 255) for _ in range(3)))
+            img.paste((255, 255, 255), (rng.randint(0, 1000), rng.randint(0, 1000), 3000, 2500))
+            path = os.path.join(tmp, f"img{i}.jpg")
+            img.save(path, quality=90)
+            paths.append(path)
+        letterboxed = [letterbox_image(path, imgsz) for path in paths]
+
+        def load_original():
+            for path in paths:
+                with Image.open(path) as img:
+                    img.convert('RGB').resize((imgsz, imgsz * image_size[1] // image_size[0]))
+
+        def load_letterboxed():
+            for data in letterboxed:
+                with Image.open(io.BytesIO(data)) as img:
+                    img.convert('RGB')
+
+        base_time, _ = _timeit(load_original, repeat=2)
+        print(f"      {'época original':18s} {base_time * 1000:8.1f} ms")
+        elapsed, _ = _timeit(load_letterboxed, repeat=2)
+        print(f"      {'época letterbox':18s} {elapsed * 1000:8.1f} ms  (x{base_time / elapsed:.2f})")
+
+        base_time = None
+        for count in workers:
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                elapsed, _ = _timeit(lambda: list(executor.map(lambda p: letterbox_image(p, imgsz), paths)), repeat=2)
+            base_time = base_time or elapsed
+            print(f"      exportar {count} hilo(s) {elapsed * 1000:8.1f} ms  (x{base_time / elapsed:.2f})")
+
+
+def bench_tiles(num_images=200, image_size=(4000, 3000), boxes_per_image=60, tile_size=640, stride=512):
+    """
+    Reparto de cajas en mosaicos solapados: bucle por caja y mosaico (como
+    los scripts de slicing habituales) frente a la intersección vectorizada
+    cajas × mosaicos de tiled_export
+    """
+    import numpy as np
+    from tiled_export import tile_grid, tile_boxes
+
+    rng = random.Random(42)
+    width, height = image_size
+    tiles = tile_grid(width, height, tile_size, stride)
+    images = []
+    for _ in range(num_images):
+        corners = []
+        for _ in range(boxes_per_image):
+            x, y = rng.uniform(0, width - 40), rng.uniform(0, height - 40)
+            corners.append((x, y, x + rng.uniform(8, 40), y + rng.uniform(8, 40)))
+        images.append(np.array(corners))
+    print(f"🧩 Mosaicos {tile_size}/{stride} de {num_images} imágenes {width}x{height} "
+          f"({len(tiles)} mosaicos y {boxes_per_image} cajas por imagen)")
+
+    def per_box():
+        kept = 0
+        tile_list = tiles.tolist()
+        for corners in images:
+            for x1, y1, x2, y2 in corners.tolist():
+                area = (x2 - x1) * (y2 - y1)
+                for tx1, ty1, tx2, ty2 in tile_list:
+                    ix = min(x2, tx2) - max(x1, tx1)
+                    iy = min(y2, ty2) - max(y1, ty1)
+                    if ix > 0 and iy > 0 and ix * iy / area >= 0.25:
+                        kept += 1
+        return kept
+
+    def vectorized():
+        return sum(len(tile_boxes(corners, tiles, 0.25)[0]) for corners in images)
+
+    base_time, expected = _timeit(per_box, repeat=3)
+    print(f"      {'por caja':12s} {base_time * 1000:8.1f} ms  ({expected} cajas en mosaicos)")
+    elapsed, result = _timeit(vectorized, repeat=3)
+    assert result == expected
+    print(f"      {'vectorizado':12s} {elapsed * 1000:8.1f} ms  (x{base_time / elapsed:.2f})")
+
+
+BENCHMARKS = {
+    'visualize': bench_visualize,
+    'decode': bench_decode,
+    'composite': bench_composite,
+    'labels': bench_label_store,
+    'export': bench_export_compression,
+    'parallel_zip': bench_parallel_compression,
+    'coco': bench_coco_conversion,
+    'letterbox': bench_letterbox,
+    'tiles': bench_tiles,
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS.keys())
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        print(f"❌ Benchmarks desconocidos: {unknown}. Disponibles: {list(BENCHMARKS.keys())}")
+        sys.exit(1)
+
+    for name in selected:
+        BENCHMARKS[name]()
+        print()
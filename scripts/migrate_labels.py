@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Migrar las etiquetas de sesiones entre backends de almacenamiento (txt ↔ sqlite)
+
+Uso (desde la raíz del proyecto, con el servidor parado):
+    python scripts/migrate_labels.py --to sqlite sesion1 sesion2
+    python scripts/migrate_labels.py --to txt --all
+"""
+
+import os
+import sys
+import argparse
+from pathlib import Path
+
+# Permitir importar los módulos del proyecto desde scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from label_store import migrate_session, get_label_store, LABEL_STORAGE_BACKENDS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrar etiquetas de sesiones entre backends")
+    parser.add_argument("sessions", nargs="*", help="Sesiones a migrar")
+    parser.add_argument("--to", required=True, choices=LABEL_STORAGE_BACKENDS, help="Backend de destino")
+    parser.add_argument("--all", action="store_true", help="Migrar todas las sesiones de annotations/")
+    args = parser.parse_args(argv)
+
+    sessions = args.sessions
+    if args.all:
+        sessions = sorted(
+            name for name in os.listdir("annotations") if os.path.isdir(os.path.join("annotations", name))
+        ) if os.path.isdir("annotations") else []
+    if not sessions:
+        parser.error("indica al menos una sesión o --all")
+
+    failed = False
+    for session in sessions:
+        try:
+            current = get_label_store(session).backend
+            migrated = migrate_session(session, args.to)
+        except Exception as e:
+            print(f"❌ {session}: {e}")
+            failed = True
+            continue
+        if current == args.to:
+            print(f"⏭️  {session}: ya usa {args.to}")
+        else:
+            print(f"✅ {session}: {migrated} archivos de etiquetas {current} → {args.to}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
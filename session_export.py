@@ -0,0 +1,86 @@
+"""
+Contenido del ZIP de exportación de una sesión
+
+Imágenes y demás archivos de la sesión tal cual están en disco, y las
+etiquetas desde el almacén de la sesión (materializadas como labels/*.txt si
+la sesión usa SQLite). El diario de ediciones y la base de datos de etiquetas
+no forman parte del dataset.
+
+La huella de la sesión (session_fingerprint) solo mira nombres, tamaños y
+mtimes: es lo bastante barata para calcularla en cada descarga y cambia con
+cualquier edición de imágenes o etiquetas (txt o SQLite).
+"""
+import os
+import hashlib
+
+from annotation_patch import JOURNAL_FILENAME
+from label_store import get_label_store, is_label_db_file
+from label_writer import flush_pending_labels
+from training_export import iter_training_entries, training_class_names
+from annotation_formats import iter_annotation_format_entries
+from letterbox_export import iter_letterbox_entries
+from tiled_export import iter_tiled_entries
+
+# raw: la carpeta de la sesión tal cual; ultralytics: train/val + data.yaml
+# (con options['imgsz'], imágenes con letterbox: ver letterbox_export);
+# coco / voc: convertidos desde las etiquetas YOLO (ver annotation_formats);
+# tiles: mosaicos solapados en estructura de Ultralytics (ver tiled_export)
+EXPORT_FORMATS = ('raw', 'ultralytics', 'coco', 'voc', 'tiles')
+
+
+def iter_session_entries(session):
+    """(nombre en el ZIP, ruta o bytes) de todo lo que se exporta de la sesión"""
+    session_path = os.path.join("annotations", session)
+    for root, dirs, files in os.walk(session_path):
+        if root == session_path:
+            dirs[:] = [d for d in dirs if d != "labels"]
+            files = [f for f in files if not is_label_db_file(f) and f != JOURNAL_FILENAME]
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            yield os.path.relpath(file_path, session_path).replace(os.sep, '/'), file_path
+
+    for label_filename, content in get_label_store(session).iter_label_files():
+        yield f"labels/{label_filename}", content
+
+
+def iter_export_entries(session, options, class_names=None):
+    """Entradas del ZIP según options['format'] (ver EXPORT_FORMATS)"""
+    if options['format'] == 'ultralytics' and options.get('imgsz'):
+        return iter_letterbox_entries(
+            session, class_names or [], options['imgsz'], options['val_ratio'], options['seed']
+        )
+    if options['format'] == 'ultralytics':
+        return iter_training_entries(session, class_names or [], options['val_ratio'], options['seed'])
+    if options['format'] == 'tiles':
+        return iter_tiled_entries(
+            session, class_names or [], options['tile_size'], options['tile_stride'],
+            options['min_visibility'], options['keep_empty'], options['val_ratio'], options['seed']
+        )
+    if options['format'] in ('coco', 'voc'):
+        return iter_annotation_format_entries(
+            session, options['format'], training_class_names(session, class_names or [])
+        )
+    return iter_session_entries(session)
+
+
+def session_fingerprint(session):
+    """Hash de (ruta, tamaño, mtime) de los archivos que determinan la exportación"""
+    # Los autosaves agrupados aún en memoria también cambian la exportación
+    flush_pending_labels(session)
+    session_path = os.path.join("annotations", session)
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(session_path):
+        dirs.sort()
+        for file in sorted(files):
+            # El diario no se exporta y el -shm de SQLite cambia también con las lecturas
+            if root == session_path and (file == JOURNAL_FILENAME or file.endswith('-shm')):
+                continue
+            file_path = os.path.join(root, file)
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            relative = os.path.relpath(file_path, session_path)
+            digest.update(f"{relative}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
@@ -0,0 +1,151 @@
+"""
+Índice por sesión de imágenes y etiquetas (temp/index/{sesion}.json)
+
+Guarda por imagen su tamaño, mtime, dimensiones y el recuento de cajas por
+clase de su archivo de etiquetas, para que las estadísticas y las
+exportaciones no tengan que releer todos los .txt ni abrir las imágenes. Es
+un dato derivado: se puede borrar y se reconstruye solo.
+"""
+import os
+import json
+import time
+import secrets
+from collections import Counter
+from PIL import Image
+
+from annotation_utils import parse_yolo_line
+
+SESSION_INDEX_DIR = os.path.join("temp", "index")
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def index_path(session):
+    return os.path.join(SESSION_INDEX_DIR, f"{session}.json")
+
+
+def load_session_index(session):
+    try:
+        with open(index_path(session), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'session': session, 'images': {}}
+
+
+def _save_session_index(index):
+    path = index_path(index['session'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+def _stat_or_none(path):
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+def _image_size(path):
+    """(ancho, alto) leyendo solo la cabecera, o (None, None) si no se puede abrir"""
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return None, None
+
+
+def _image_entry(session, filename, image_stat, label_stat):
+    width, height = _image_size(os.path.join("annotations", session, "images", filename))
+    entry = {
+        'size': image_stat.st_size,
+        'mtime': image_stat.st_mtime,
+        'width': width,
+        'height': height,
+        'label_mtime': label_stat.st_mtime if label_stat else None,
+        'boxes': 0,
+        'classes': {}
+    }
+    if label_stat:
+        label_path = os.path.join("annotations", session, "labels", os.path.splitext(filename)[0] + '.txt')
+        counts = Counter()
+        with open(label_path, 'r') as f:
+            for line in f:
+                try:
+                    box = parse_yolo_line(line)
+                except ValueError:
+                    continue
+                if box:
+                    counts[str(box[0])] += 1
+        entry['boxes'] = sum(counts.values())
+        entry['classes'] = dict(counts)
+    return entry
+
+
+def update_session_index(session, filenames=None):
+    """
+    Actualizar el índice de la sesión y devolverlo.
+
+    Sin `filenames` se recorre images/ y solo se releen las etiquetas de las
+    imágenes cuyo tamaño o mtime (de imagen o etiqueta) cambió; con
+    `filenames` se actualizan únicamente esas entradas (p. ej. al final de una
+    importación masiva).
+    """
+    index = load_session_index(session)
+    images = index['images']
+    images_path = os.path.join("annotations", session, "images")
+    labels_path = os.path.join("annotations", session, "labels")
+
+    if filenames is None:
+        current = set()
+        if os.path.isdir(images_path):
+            current = {f for f in os.listdir(images_path) if f.lower().endswith(IMAGE_EXTENSIONS)}
+        for filename in set(images) - current:
+            del images[filename]
+        candidates = current
+        force = False
+    else:
+        candidates = set(filenames)
+        force = True
+
+    for filename in candidates:
+        image_stat = _stat_or_none(os.path.join(images_path, filename))
+        if image_stat is None:
+            images.pop(filename, None)
+            continue
+        label_stat = _stat_or_none(os.path.join(labels_path, os.path.splitext(filename)[0] + '.txt'))
+        entry = images.get(filename)
+        if not force and entry and 'width' in entry and entry['size'] == image_stat.st_size \
+                and entry['mtime'] == image_stat.st_mtime \
+                and entry['label_mtime'] == (label_stat.st_mtime if label_stat else None):
+            continue
+        images[filename] = _image_entry(session, filename, image_stat, label_stat)
+
+    index['updated_at'] = time.time()
+    _save_session_index(index)
+    return index
+
+
+def image_dimensions(session):
+    """{imagen: (ancho, alto)} de la sesión, abriendo solo las imágenes nuevas o cambiadas"""
+    return {
+        filename: (entry['width'], entry['height'])
+        for filename, entry in update_session_index(session)['images'].items()
+    }
+
+
+def summarize_index(index):
+    """Totales de la sesión a partir del índice"""
+    class_counts = Counter()
+    labeled = 0
+    for entry in index['images'].values():
+        class_counts.update(entry['classes'])
+        if entry['boxes']:
+            labeled += 1
+    return {
+        'images': len(index['images']),
+        'labeled_images': labeled,
+        'boxes': sum(class_counts.values()),
+        'class_counts': {int(cid): count for cid, count in sorted(class_counts.items(), key=lambda item: int(item[0]))}
+    }
@@ -0,0 +1,257 @@
+"""
+Tests de la conversión de etiquetas YOLO a COCO y Pascal VOC (exportación e importación)
+"""
+
+import io
+import json
+import zipfile
+import xml.etree.ElementTree as ET
+import numpy as np
+import pytest
+
+import annotation_formats
+from annotation_formats import (
+    yolo_to_absolute, iter_annotation_format_entries, iter_json_items, read_coco, COCO_ANNOTATIONS_PATH
+)
+from import_dataset import import_dataset_zip, detect_dataset_format
+from training_export import session_images
+from label_store import get_label_store
+from session_index import image_dimensions
+from zip_stream import stream_zip
+from tests.test_image_processing import make_image_bytes
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    images = tmp_path / "annotations" / "sesion" / "images"
+    images.mkdir(parents=True)
+    (images / "a.jpg").write_bytes(make_image_bytes((200, 100), fmt='JPEG'))
+    (images / "b.png").write_bytes(make_image_bytes((400, 300)))
+    (images / "c.jpg").write_bytes(make_image_bytes((50, 50), fmt='JPEG'))
+    get_label_store("sesion").save_many({
+        "a.jpg": ["0 0.5 0.5 0.5 0.5", "1 0.95 0.1 0.2 0.4"],
+        "b.png": ["1 0.25 0.5 0.1 0.2"],
+    })
+    return images
+
+
+def export(export_format, class_names):
+    raw = b''.join(stream_zip(iter_annotation_format_entries("sesion", export_format, class_names)))
+    return zipfile.ZipFile(io.BytesIO(raw))
+
+
+@pytest.mark.unit
+class TestConversion:
+    """Tests de la conversión vectorizada"""
+
+    def test_yolo_to_absolute_matches_scalar(self):
+        rng = np.random.default_rng(0)
+        boxes = np.column_stack([rng.integers(0, 5, 1000), rng.random((1000, 4))])
+        widths, heights = rng.integers(10, 4000, 1000), rng.integers(10, 4000, 1000)
+        classes, corners = yolo_to_absolute(boxes, widths, heights)
+        for i in range(0, 1000, 97):
+            _, xc, yc, w, h = boxes[i]
+            expected = [max(0, (xc - w / 2) * widths[i]), max(0, (yc - h / 2) * heights[i]),
+                        min(widths[i], (xc + w / 2) * widths[i]), min(heights[i], (yc + h / 2) * heights[i])]
+            assert corners[i] == pytest.approx(expected)
+        assert classes.tolist() == boxes[:, 0].astype(int).tolist()
+        assert yolo_to_absolute([], [], [])[1].shape == (0, 4)
+
+    def test_dimensions_come_from_index(self, session):
+        assert image_dimensions("sesion") == {"a.jpg": (200, 100), "b.png": (400, 300), "c.jpg": (50, 50)}
+
+
+@pytest.mark.unit
+class TestCocoExport:
+    """Tests del JSON de COCO"""
+
+    @pytest.mark.parametrize("batch_size", [1, 500])
+    def test_coco_json(self, session, monkeypatch, batch_size):
+        monkeypatch.setattr(annotation_formats, "EXPORT_BATCH_SIZE", batch_size)
+        with export('coco', ["Persona", "Coche"]) as zf:
+            assert sorted(zf.namelist()) == [COCO_ANNOTATIONS_PATH, "images/a.jpg", "images/b.png", "images/c.jpg"]
+            coco = json.loads(zf.read(COCO_ANNOTATIONS_PATH))
+        assert coco['categories'] == [
+            {'id': 1, 'name': "Persona", 'supercategory': ''}, {'id': 2, 'name': "Coche", 'supercategory': ''}
+        ]
+        assert [(img['id'], img['file_name'], img['width'], img['height']) for img in coco['images']] == [
+            (1, "a.jpg", 200, 100), (2, "b.png", 400, 300), (3, "c.jpg", 50, 50)
+        ]
+        assert coco['annotations'] == [
+            {'id': 1, 'image_id': 1, 'category_id': 1, 'bbox': [50.0, 25.0, 100.0, 50.0], 'area': 5000.0, 'iscrowd': 0},
+            # Recortada al borde derecho y superior
+            {'id': 2, 'image_id': 1, 'category_id': 2, 'bbox': [170.0, 0.0, 30.0, 30.0], 'area': 900.0, 'iscrowd': 0},
+            {'id': 3, 'image_id': 2, 'category_id': 2, 'bbox': [80.0, 120.0, 40.0, 60.0], 'area': 2400.0, 'iscrowd': 0},
+        ]
+
+    def test_empty_session(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "annotations" / "sesion" / "images").mkdir(parents=True)
+        with export('coco', []) as zf:
+            assert json.loads(zf.read(COCO_ANNOTATIONS_PATH))['annotations'] == []
+
+
+@pytest.mark.unit
+class TestVocExport:
+    """Tests de los XML de Pascal VOC"""
+
+    def test_voc_xml(self, session):
+        with export('voc', ["Persona", "Coche & Moto"]) as zf:
+            assert sorted(zf.namelist()) == [
+                "Annotations/a.xml", "Annotations/b.xml", "Annotations/c.xml",
+                "JPEGImages/a.jpg", "JPEGImages/b.png", "JPEGImages/c.jpg"
+            ]
+            root = ET.fromstring(zf.read("Annotations/a.xml"))
+            assert root.findtext("filename") == "a.jpg"
+            assert (root.findtext("size/width"), root.findtext("size/height")) == ("200", "100")
+            objects = [
+                (obj.findtext("name"), [int(obj.findtext(f"bndbox/{k}")) for k in ("xmin", "ymin", "xmax", "ymax")])
+                for obj in root.iter("object")
+            ]
+            assert objects == [("Persona", [51, 26, 150, 75]), ("Coche & Moto", [171, 1, 200, 30])]
+            assert ET.fromstring(zf.read("Annotations/c.xml")).find("object") is None
+
+
+def imported_labels():
+    """Etiquetas de la sesión 'copia' por nombre original (sin el prefijo de sesión y fecha)"""
+    labels = get_label_store("copia").load_many(session_images("copia"))
+    return {name.split('_', 3)[3]: lines for name, lines in labels.items()}
+
+
+def reimport(archive, resolve_classes=None):
+    """Importar en la sesión 'copia' un ZIP exportado y devolver (informe, etiquetas)"""
+    report = import_dataset_zip(io.BytesIO(archive.fp.getvalue()), "copia", resolve_classes=resolve_classes)
+    return report, imported_labels()
+
+
+def rounded(labels):
+    return {
+        name: [[float(v) for v in line.split()] for line in lines]
+        for name, lines in labels.items()
+    }
+
+
+@pytest.mark.unit
+class TestCocoImport:
+    """Tests de la importación de datasets COCO"""
+
+    def test_streaming_parse(self):
+        text = json.dumps({
+            'info': {'year': 2024, 'nested': [1, {'a': "}]"}]},
+            'images': [{'id': 7, 'file_name': "x/a.jpg", 'width': 10, 'height': 20}],
+            'annotations': [
+                {'id': 1, 'image_id': 7, 'category_id': 3, 'bbox': [1, 2, 3, 4]},
+                {'id': 2, 'image_id': 7, 'category_id': 3, 'bbox': [0, 0, 5, 5], 'iscrowd': 1},
+            ],
+            'categories': [{'id': 3, 'name': "gato"}],
+        })
+        # Lecturas de 3 caracteres: los valores quedan partidos entre bloques
+        items = list(iter_json_items(io.StringIO(text), read_size=3))
+        assert [key for key, _ in items] == ['info', 'images', 'annotations', 'annotations', 'categories']
+        assert items[0][1] == {'year': 2024, 'nested': [1, {'a': "}]"}]}
+
+        images, categories, image_ids, category_ids, bboxes = read_coco(io.StringIO(text))
+        assert images == {7: ("x/a.jpg", 10, 20)} and categories == {3: "gato"}
+        assert image_ids.tolist() == [7] and category_ids.tolist() == [3]
+        assert bboxes.tolist() == [[1.0, 2.0, 3.0, 4.0]]
+
+    def test_round_trip(self, session):
+        created = []
+
+        def resolve_classes(names):
+            created.append(list(names))
+            return [5, 2]
+
+        with export('coco', ["Persona", "Coche"]) as zf:
+            assert detect_dataset_format(zf) == 'coco'
+            report, labels = reimport(zf, resolve_classes)
+        # Todas las clases se resuelven de una vez
+        assert created == [["Persona", "Coche"]]
+        assert report['format'] == 'coco'
+        # c.jpg está en el JSON sin anotaciones: etiqueta vacía (imagen negativa)
+        assert report['images'] == 3 and report['labels'] == 3 and report['boxes'] == 3
+        assert report['orphan_labels'] == 0 and report['dropped_boxes'] == 0
+        assert rounded(labels) == {
+            "a.jpg": [[5, 0.5, 0.5, 0.5, 0.5], [2, 0.925, 0.15, 0.15, 0.3]],
+            "b.png": [[2, 0.25, 0.5, 0.1, 0.2]],
+            "c.jpg": [],
+        }
+
+    def test_unmatched_images(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zf.writestr("annotations/instances_train.json", json.dumps({
+                'images': [
+                    {'id': 1, 'file_name': "train/a.jpg", 'width': 100, 'height': 100},
+                    {'id': 2, 'file_name': "falta.jpg", 'width': 100, 'height': 100},
+                ],
+                'annotations': [
+                    {'image_id': 1, 'category_id': 1, 'bbox': [10, 10, 20, 20]},
+                    {'image_id': 1, 'category_id': 1, 'bbox': [10, 10, 0, 20]},
+                    {'image_id': 2, 'category_id': 1, 'bbox': [10, 10, 20, 20]},
+                ],
+                'categories': [{'id': 1, 'name': "gato"}],
+            }))
+            zf.writestr("train/a.jpg", make_image_bytes(fmt='JPEG'))
+            zf.writestr("otra.png", make_image_bytes())
+        report = import_dataset_zip(buffer, "copia")
+        assert report['images'] == 2 and report['labels'] == 1
+        assert report['orphan_labels'] == 1 and report['dropped_boxes'] == 1
+        assert rounded(imported_labels()) == {"a.jpg": [[0, 0.2, 0.2, 0.2, 0.2]]}
+
+    def test_same_name_in_different_folders(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zf.writestr("annotations/instances.json", json.dumps({
+                'images': [
+                    {'id': 1, 'file_name': "train2017/000001.jpg", 'width': 100, 'height': 100},
+                    {'id': 2, 'file_name': "val2017/000001.jpg", 'width': 100, 'height': 100},
+                ],
+                'annotations': [
+                    {'image_id': 1, 'category_id': 1, 'bbox': [10, 10, 20, 20]},
+                    {'image_id': 2, 'category_id': 1, 'bbox': [50, 50, 20, 20]},
+                ],
+                'categories': [{'id': 1, 'name': "gato"}],
+            }))
+            zf.writestr("train2017/000001.jpg", make_image_bytes(fmt='JPEG'))
+            zf.writestr("val2017/000001.jpg", make_image_bytes(fmt='JPEG'))
+            zf.writestr("otras/b.jpg", make_image_bytes(fmt='JPEG'))
+        report = import_dataset_zip(buffer, "copia")
+        assert report['images'] == 3 and report['labels'] == 2
+        # Solo las que coinciden conservan la carpeta en el nombre
+        assert rounded(imported_labels()) == {
+            "train2017_000001.jpg": [[0, 0.2, 0.2, 0.2, 0.2]],
+            "val2017_000001.jpg": [[0, 0.6, 0.6, 0.2, 0.2]],
+        }
+        assert sorted(name.split('_', 3)[3] for name in session_images("copia")) == [
+            "b.jpg", "train2017_000001.jpg", "val2017_000001.jpg"
+        ]
+
+
+@pytest.mark.unit
+class TestVocImport:
+    """Tests de la importación de datasets Pascal VOC"""
+
+    def test_round_trip(self, session):
+        with export('voc', ["Persona", "Coche & Moto"]) as zf:
+            assert detect_dataset_format(zf) == 'voc'
+            report, labels = reimport(zf)
+        assert report['format'] == 'voc' and report['images'] == 3 and report['boxes'] == 3
+        # Sin resolutor las clases se numeran por orden de aparición
+        assert rounded(labels) == {
+            "a.jpg": [[0, 0.5, 0.5, 0.5, 0.5], [1, 0.925, 0.15, 0.15, 0.3]],
+            "b.png": [[1, 0.25, 0.5, 0.1, 0.2]],
+            "c.jpg": [],
+        }
+
+    def test_invalid_xml_is_skipped(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zf.writestr("Annotations/roto.xml", "<annotation><object>")
+            zf.writestr("JPEGImages/roto.jpg", make_image_bytes(fmt='JPEG'))
+        report = import_dataset_zip(buffer, "copia")
+        assert report['skipped'] == 1 and report['images'] == 1 and report['labels'] == 0
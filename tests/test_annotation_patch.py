@@ -0,0 +1,99 @@
+"""
+Tests de edición por parches, control de versión y deshacer
+"""
+
+import pytest
+
+import label_store
+from annotation_patch import (
+    apply_patch, revert_changes, box_ids, boxes_with_ids, label_version, patch_labels,
+    undo_last_patch, read_journal, PatchError, VersionConflict
+)
+from label_store import get_label_store
+
+LINES = ["0 0.5 0.5 0.2 0.2", "1 0.25 0.25 0.1 0.1", "0 0.5 0.5 0.2 0.2"]
+BOX = {'class_id': 2, 'x_center': 0.75, 'y_center': 0.75, 'width': 0.1, 'height': 0.1}
+
+
+@pytest.fixture(params=['txt', 'sqlite'])
+def session(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(label_store, "ANNOTATION_STORAGE", request.param)
+    (tmp_path / "annotations" / "sesion" / "labels").mkdir(parents=True)
+    get_label_store("sesion").save("a.jpg", LINES)
+    return "sesion"
+
+
+@pytest.mark.unit
+class TestApplyPatch:
+    """Tests de aplicación e inversión de operaciones"""
+
+    def test_ids_are_stable_and_unique(self):
+        ids = box_ids(LINES)
+        assert len(set(ids)) == 3
+        # Borrar otra caja no cambia el id de las demás
+        assert box_ids(LINES[1:])[0] == ids[1]
+        assert [box['index'] for box in boxes_with_ids(LINES)] == [0, 1, 2]
+
+    def test_operations_and_revert(self):
+        ids = box_ids(LINES)
+        operations = [
+            {'op': 'update', 'id': ids[1], 'box': {'class_id': 3}},
+            {'op': 'delete', 'index': 0},
+            {'op': 'add', 'box': BOX},
+        ]
+        lines, changes = apply_patch(LINES, operations)
+        assert lines == ["3 0.25 0.25 0.1 0.1", "0 0.5 0.5 0.2 0.2", "2 0.75 0.75 0.1 0.1"]
+        assert revert_changes(lines, changes) == LINES
+
+    @pytest.mark.parametrize("operations", [
+        [],
+        [{'op': 'move', 'index': 0}],
+        [{'op': 'delete', 'index': 5}],
+        [{'op': 'delete', 'id': 'no-existe'}],
+        [{'op': 'delete', 'index': 0}, {'op': 'update', 'index': 0, 'box': {'class_id': 1}}],
+        [{'op': 'update', 'index': 0, 'box': {'width': float('nan')}}],
+        [{'op': 'add', 'box': {'class_id': 1}}],
+    ])
+    def test_invalid_operations(self, operations):
+        with pytest.raises(PatchError):
+            apply_patch(LINES, operations)
+
+
+@pytest.mark.unit
+class TestPatchJournal:
+    """Tests de parches sobre el almacén de la sesión, versiones y deshacer"""
+
+    def test_patch_with_version_check(self, session):
+        version = label_version(LINES)
+        new_version, lines = patch_labels(session, "a.jpg", [{'op': 'delete', 'index': 1}], version)
+        assert get_label_store(session).load("a.jpg") == lines == [LINES[0], LINES[2]]
+
+        # Un cliente con la versión anterior no pisa la edición
+        with pytest.raises(VersionConflict) as conflict:
+            patch_labels(session, "a.jpg", [{'op': 'add', 'box': BOX}], version)
+        assert conflict.value.version == new_version
+        assert get_label_store(session).load("a.jpg") == lines
+
+    def test_undo_walks_back_through_journal(self, session):
+        patch_labels(session, "a.jpg", [{'op': 'add', 'box': BOX}])
+        patch_labels(session, "a.jpg", [{'op': 'update', 'index': 0, 'box': {'x_center': 0.4}}])
+        patch_labels(session, "b.jpg", [{'op': 'add', 'box': BOX}])
+
+        undo_last_patch(session, "a.jpg")
+        assert get_label_store(session).load("a.jpg") == LINES + ["2 0.75 0.75 0.1 0.1"]
+        _, lines = undo_last_patch(session, "a.jpg")
+        assert lines == get_label_store(session).load("a.jpg") == LINES
+        with pytest.raises(PatchError):
+            undo_last_patch(session, "a.jpg")
+
+        entries = read_journal(session, "a.jpg")
+        assert [entry['op'] for entry in entries] == ['patch', 'patch', 'undo', 'undo']
+        assert len(read_journal(session)) == 5
+
+    def test_undo_refuses_after_full_rewrite(self, session):
+        patch_labels(session, "a.jpg", [{'op': 'delete', 'index': 0}])
+        get_label_store(session).save("a.jpg", ["4 0.5 0.5 0.5 0.5"])
+        with pytest.raises(VersionConflict):
+            undo_last_patch(session, "a.jpg")
+        assert read_journal(session)[-1]['op'] == 'patch'
@@ -0,0 +1,97 @@
+"""
+Tests de las utilidades de etiquetas YOLO y formatos de respuesta
+"""
+
+import json
+import pytest
+
+from annotation_utils import (
+    BOX_FIELDS, COMPACT_DEFAULT_FIELDS,
+    read_yolo_labels, parse_fields, serialize_image_entry,
+    validate_annotations, duplicate_label_stems
+)
+
+
+@pytest.fixture
+def image_entry(tmp_path):
+    """Entrada de imagen con dos cajas leídas de un archivo YOLO real"""
+    label_path = tmp_path / "img.txt"
+    label_path.write_text("0 0.5 0.5 0.2 0.4\n\n1 0.25 0.75 0.1 0.1\nbasura\n")
+    annotations = read_yolo_labels(str(label_path), 640, 480)
+    return {
+        'name': 'img.jpg',
+        'labels': len(annotations),
+        'annotations': annotations,
+        'width': 640,
+        'height': 480
+    }
+
+
+@pytest.mark.unit
+class TestYoloLabels:
+    """Tests de lectura de etiquetas YOLO"""
+
+    def test_read_labels_full_format(self, image_entry):
+        annotations = image_entry['annotations']
+        assert len(annotations) == 2
+        assert tuple(annotations[0].keys()) == BOX_FIELDS
+        assert annotations[0]['x1'] == 256 and annotations[0]['y2'] == 336
+
+    def test_missing_label_file(self, tmp_path):
+        assert read_yolo_labels(str(tmp_path / "no_existe.txt"), 640, 640) == []
+
+
+@pytest.mark.unit
+class TestCompactFormat:
+    """Tests del formato columnar compacto y sparse fieldsets"""
+
+    def test_compact_layout_is_columnar(self, image_entry):
+        entry = serialize_image_entry(image_entry, 'compact')
+        assert 'annotations' not in entry
+        assert tuple(entry['boxes'].keys()) == COMPACT_DEFAULT_FIELDS
+        assert entry['boxes']['class_id'] == [0, 1]
+        assert entry['boxes']['x_center'] == [0.5, 0.25]
+
+    def test_compact_payload_is_smaller(self, image_entry):
+        full = json.dumps(serialize_image_entry(image_entry, 'full'))
+        compact = json.dumps(serialize_image_entry(image_entry, 'compact'))
+        assert len(compact) < len(full)
+
+    def test_sparse_fieldset(self, image_entry):
+        fields = parse_fields("class_id, x1,y1")
+        compact = serialize_image_entry(image_entry, 'compact', fields)
+        assert tuple(compact['boxes'].keys()) == ('class_id', 'x1', 'y1')
+
+        full = serialize_image_entry(image_entry, 'full', fields)
+        assert full['annotations'][1] == {'class_id': 1, 'x1': 128, 'y1': 336}
+
+    def test_parse_fields(self):
+        assert parse_fields(None) is None
+        assert parse_fields(" , ") is None
+        with pytest.raises(ValueError):
+            parse_fields("class_id,color")
+
+
+@pytest.mark.unit
+class TestAnnotationValidation:
+    """Tests de validación estricta de cajas"""
+
+    BOX = {'class_id': 1, 'x_center': 0.5, 'y_center': 0.5, 'width': 0.2, 'height': 0.3}
+
+    def test_validate_annotations(self):
+        assert validate_annotations([self.BOX]) == ["1 0.5 0.5 0.2 0.3"]
+        for invalid in ({**self.BOX, 'class_id': -1}, {**self.BOX, 'width': "0.2"},
+                        {**self.BOX, 'height': float('nan')}, {'class_id': 0}):
+            with pytest.raises(ValueError):
+                validate_annotations([invalid])
+        with pytest.raises(ValueError):
+            validate_annotations({"no": "lista"})
+
+    def test_coordinates_are_written_as_float(self):
+        # Igual que salen de SQLite, para que la versión no cambie al releer
+        box = {'class_id': 1, 'x_center': 1, 'y_center': 0, 'width': 0.5, 'height': 1}
+        assert validate_annotations([box]) == ["1 1.0 0.0 0.5 1.0"]
+
+    def test_duplicate_label_stems(self):
+        assert duplicate_label_stems(["a.jpg", "b.jpg", "a.png", "c.jpg"]) == {"a.jpg": ["a.png"], "a.png": ["a.jpg"]}
+        assert duplicate_label_stems(["a.jpg", "a.b.jpg"]) == {}
@@ -0,0 +1,105 @@
+"""
+Tests de subidas reanudables por fragmentos
+"""
+
+import os
+import time
+import asyncio
+import pytest
+
+import chunked_uploads
+from chunked_uploads import (
+    create_upload, write_chunk, finalize_upload, discard_upload,
+    expire_uploads, get_status, ChunkedUploadError
+)
+
+
+async def _stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def put(upload_id, offset, *chunks):
+    return asyncio.run(write_chunk(upload_id, offset, _stream(*chunks)))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.mark.images
+class TestChunkedUploads:
+    """Tests del protocolo crear → PUT con offset → finalizar"""
+
+    def test_upload_in_chunks_and_finalize(self, workdir):
+        data = os.urandom(3000)
+        upload_id = create_upload("sesion", "../foto.tiff", len(data), user_id=1)['upload_id']
+
+        status = put(upload_id, 0, data[:1000], data[1000:1500])
+        assert status['offset'] == 1500 and not status['complete']
+        assert put(upload_id, 1500, data[1500:])['complete']
+
+        meta, data_path = finalize_upload(upload_id)
+        assert meta['filename'] == "foto.tiff"
+        with open(data_path, 'rb') as f:
+            assert f.read() == data
+
+        discard_upload(upload_id)
+        with pytest.raises(ChunkedUploadError) as exc:
+            get_status(upload_id)
+        assert exc.value.status_code == 404
+
+    def test_wrong_offset_returns_current(self, workdir):
+        upload_id = create_upload("sesion", "foto.png", 100, user_id=1)['upload_id']
+        put(upload_id, 0, b"x" * 40)
+        with pytest.raises(ChunkedUploadError) as exc:
+            put(upload_id, 0, b"x" * 40)
+        assert exc.value.status_code == 409 and exc.value.offset == 40
+
+    def test_interrupted_chunk_keeps_received_bytes(self, workdir):
+        upload_id = create_upload("sesion", "foto.png", 100, user_id=1)['upload_id']
+
+        async def broken():
+            yield b"x" * 30
+            raise ConnectionError("cliente desconectado")
+
+        with pytest.raises(ConnectionError):
+            asyncio.run(write_chunk(upload_id, 0, broken()))
+        assert get_status(upload_id)['offset'] == 30
+
+    def test_overflow_discards_chunk(self, workdir):
+        upload_id = create_upload("sesion", "foto.png", 100, user_id=1)['upload_id']
+        put(upload_id, 0, b"x" * 60)
+        with pytest.raises(ChunkedUploadError) as exc:
+            put(upload_id, 60, b"x" * 30, b"x" * 30)
+        assert exc.value.status_code == 413
+        assert get_status(upload_id)['offset'] == 60
+
+    def test_finalize_incomplete(self, workdir):
+        upload_id = create_upload("sesion", "foto.png", 100, user_id=1)['upload_id']
+        put(upload_id, 0, b"x" * 10)
+        with pytest.raises(ChunkedUploadError) as exc:
+            finalize_upload(upload_id)
+        assert exc.value.status_code == 409
+
+    def test_rejects_invalid_requests(self, workdir):
+        with pytest.raises(ChunkedUploadError):
+            create_upload("sesion", "foto.png", 10, user_id=1, kind="otro")
+        with pytest.raises(ChunkedUploadError) as exc:
+            create_upload("sesion", "foto.png", chunked_uploads.MAX_CHUNKED_UPLOAD_SIZE + 1, user_id=1)
+        assert exc.value.status_code == 413
+        with pytest.raises(ChunkedUploadError):
+            get_status("../../etc")
+
+    def test_abandoned_uploads_expire(self, workdir):
+        old = create_upload("sesion", "a.png", 100, user_id=1)['upload_id']
+        recent = create_upload("sesion", "b.png", 100, user_id=1)['upload_id']
+        stale = time.time() - 2 * 3600
+        os.utime(os.path.join(chunked_uploads.UPLOADS_DIR, old, "data"), (stale, stale))
+
+        assert expire_uploads(ttl_hours=1) == 1
+        assert get_status(recent)['offset'] == 0
+        with pytest.raises(ChunkedUploadError):
+            get_status(old)
@@ -0,0 +1,141 @@
+"""
+Tests de la caché de exportaciones (huella de sesión, single-flight y LRU)
+"""
+
+import os
+import time
+import threading
+import pytest
+
+from export_cache import ExportCache, cache_key
+from session_export import session_fingerprint
+from label_store import get_label_store
+
+
+def counting_build(calls, data=b"zip", delay=0):
+    def build():
+        calls.append(1)
+        if delay:
+            time.sleep(delay)
+        for start in range(0, len(data), 2):
+            yield data[start:start + 2]
+    return build
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ExportCache(str(tmp_path / "cache"), 10_000)
+
+
+@pytest.mark.unit
+class TestExportCache:
+    """Tests de la caché de artefactos"""
+
+    def test_hit_after_first_build(self, cache):
+        calls = []
+        assert cache.status("k") == 'miss'
+        assert b''.join(cache.stream("k", counting_build(calls, b"contenido"))) == b"contenido"
+        assert cache.status("k") == 'hit'
+        assert b''.join(cache.stream("k", counting_build(calls), chunk_size=3)) == b"contenido"
+        assert len(calls) == 1
+
+    def test_concurrent_requests_share_one_build(self, cache):
+        calls, results = [], []
+        build = counting_build(calls, b"x" * 1000, delay=0.2)
+        threads = [threading.Thread(target=lambda: results.append(b''.join(cache.stream("k", build))))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert results == [b"x" * 1000] * 4
+
+    def test_waiter_builds_itself_after_timeout(self, tmp_path):
+        cache = ExportCache(str(tmp_path / "cache"), 10_000, wait_seconds=0.05)
+        calls, results = [], []
+        leader = threading.Thread(
+            target=lambda: results.append(b''.join(cache.stream("k", counting_build(calls, b"lento", delay=0.5))))
+        )
+        leader.start()
+        while cache.status("k") != 'shared':
+            time.sleep(0.01)
+        # No espera al líder: genera su copia y no la guarda
+        assert b''.join(cache.stream("k", counting_build(calls, b"lento"))) == b"lento"
+        assert len(calls) == 2 and results == []
+        leader.join()
+        assert results == [b"lento"] and cache.status("k") == 'hit'
+
+    def test_abandoned_build_is_not_cached(self, cache):
+        calls = []
+        stream = cache.stream("k", counting_build(calls, b"abcdef"))
+        next(stream)
+        stream.close()  # cliente desconectado a mitad
+        assert cache.status("k") == 'miss'
+        assert os.listdir(cache.directory) == []
+        assert b''.join(cache.stream("k", counting_build(calls, b"abcdef"))) == b"abcdef"
+        assert len(calls) == 2
+
+    def test_stale_build_is_not_cached(self, cache):
+        assert b''.join(cache.stream("k", counting_build([]), is_current=lambda: False)) == b"zip"
+        assert cache.status("k") == 'miss'
+
+    def test_lru_eviction_under_budget(self, cache):
+        for key in ("a", "b", "c"):
+            b''.join(cache.stream(key, counting_build([], b"0" * 3000)))
+            time.sleep(0.01)
+        # "a" se vuelve a usar: la expulsada es "b"
+        b''.join(cache.stream("a", counting_build([])))
+        b''.join(cache.stream("d", counting_build([], b"0" * 3000)))
+        assert {key: cache.status(key) for key in "abcd"} == {'a': 'hit', 'b': 'miss', 'c': 'hit', 'd': 'hit'}
+        assert cache.size() <= cache.max_bytes
+
+    def test_disabled_cache_streams_directly(self, tmp_path):
+        cache = ExportCache(str(tmp_path / "cache"), 0)
+        calls = []
+        for _ in range(2):
+            assert b''.join(cache.stream("k", counting_build(calls))) == b"zip"
+        assert len(calls) == 2
+        assert not os.path.exists(cache.directory)
+
+
+@pytest.mark.unit
+class TestSessionFingerprint:
+    """Tests de la huella de contenido de una sesión"""
+
+    @pytest.mark.parametrize("backend", ['txt', 'sqlite'])
+    def test_changes_with_labels_and_images(self, tmp_path, monkeypatch, backend):
+        import label_store
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(label_store, "ANNOTATION_STORAGE", backend)
+        (tmp_path / "annotations" / "sesion" / "images").mkdir(parents=True)
+        (tmp_path / "annotations" / "sesion" / "images" / "a.jpg").write_bytes(b"jpeg")
+        store = get_label_store("sesion")
+        store.save("a.jpg", ["0 0.5 0.5 0.1 0.1"])
+
+        first = session_fingerprint("sesion")
+        assert session_fingerprint("sesion") == first
+        store.save("a.jpg", ["1 0.5 0.5 0.1 0.1"])
+        second = session_fingerprint("sesion")
+        assert second != first
+        (tmp_path / "annotations" / "sesion" / "images" / "b.jpg").write_bytes(b"jpeg")
+        assert session_fingerprint("sesion") != second
+
+    def test_includes_coalesced_autosaves(self, tmp_path, monkeypatch):
+        import label_writer
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(label_writer, "coalescer", label_writer.LabelWriteCoalescer(60))
+        (tmp_path / "annotations" / "sesion" / "images").mkdir(parents=True)
+        (tmp_path / "annotations" / "sesion" / "images" / "a.jpg").write_bytes(b"jpeg")
+        store = get_label_store("sesion")
+        store.save("a.jpg", ["0 0.5 0.5 0.1 0.1"])
+
+        first = session_fingerprint("sesion")
+        # El autosave sigue pendiente en el coalescer (60 s): la huella debe cambiar igual
+        store.save("a.jpg", ["1 0.5 0.5 0.1 0.1"])
+        assert session_fingerprint("sesion") != first
+        assert store.load("a.jpg") == ["1 0.5 0.5 0.1 0.1"]
+
+    def test_key_depends_on_options(self):
+        assert cache_key("f", {'compression': 'fast'}) != cache_key("f", {'compression': 'small'})
+        assert cache_key("f", {'a': 1, 'b': 2}) == cache_key("f", {'b': 2, 'a': 1})
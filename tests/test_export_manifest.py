@@ -0,0 +1,125 @@
+"""
+Tests de los manifiestos de exportación y la exportación delta
+"""
+
+import io
+import os
+import json
+import zipfile
+import pytest
+
+import export_manifest
+from export_manifest import (
+    load_manifest, touch_manifest, write_manifest, write_delta_manifest, iter_delta_entries, check_delta_options,
+    UnknownExportToken, ExportOptionsMismatch, DELTA_FILENAME
+)
+from label_store import get_label_store
+from session_export import iter_session_entries
+from zip_stream import stream_zip
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    images = tmp_path / "annotations" / "sesion" / "images"
+    images.mkdir(parents=True)
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        (images / name).write_bytes(name.encode() * 100)
+    get_label_store("sesion").save_many({"a.jpg": ["0 0.5 0.5 0.1 0.1"], "b.jpg": ["1 0.5 0.5 0.1 0.1"]})
+    return images
+
+
+def full_export(token):
+    write_manifest("sesion", iter_session_entries("sesion"), token, {'format': 'raw'})
+    return list(iter_session_entries("sesion"))
+
+
+def delta_export(since, token):
+    manifest = write_delta_manifest("sesion", iter_session_entries("sesion"), load_manifest("sesion", since), token,
+                                    {'format': 'raw', 'since': since})
+    entries = iter_delta_entries(iter_session_entries("sesion"), manifest)
+    with zipfile.ZipFile(io.BytesIO(b''.join(stream_zip(entries)))) as zf:
+        delta = json.loads(zf.read(DELTA_FILENAME))
+        return sorted(name for name in zf.namelist() if name != DELTA_FILENAME), delta
+
+
+@pytest.mark.unit
+class TestDeltaExport:
+    """Tests de la exportación incremental"""
+
+    def test_full_export_records_manifest(self, session):
+        assert len(full_export("t1")) == 5
+        files = load_manifest("sesion", "t1")['files']
+        assert sorted(files) == ["images/a.jpg", "images/b.jpg", "images/c.jpg", "labels/a.txt", "labels/b.txt"]
+        assert files["images/a.jpg"][2] is None and files["labels/a.txt"][2]
+
+    def test_delta_contains_only_changes(self, session):
+        full_export("t1")
+        (session / "d.jpg").write_bytes(b"nueva")
+        (session / "b.jpg").write_bytes(b"modificada")
+        os.remove(session / "c.jpg")
+        get_label_store("sesion").save("a.jpg", ["2 0.5 0.5 0.1 0.1"])
+
+        names, delta = delta_export("t1", "t2")
+        assert names == ["images/b.jpg", "images/d.jpg", "labels/a.txt"]
+        assert delta == {
+            'token': "t2", 'since': "t1", 'added': ["images/d.jpg"],
+            'modified': ["images/b.jpg", "labels/a.txt"], 'deleted': ["images/c.jpg"]
+        }
+        # La delta también es base para la siguiente
+        assert delta_export("t2", "t3")[0] == []
+
+    def test_touched_file_is_hashed_not_resent(self, session, monkeypatch):
+        full_export("t1")
+        stat = os.stat(session / "a.jpg")
+        os.utime(session / "a.jpg", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        names, delta = delta_export("t1", "t2")
+        # Sin hash en la exportación completa no se puede saber: se reenvía
+        assert names == ["images/a.jpg"]
+
+        os.utime(session / "a.jpg", ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+        hashed = []
+        original = export_manifest._file_hash
+        monkeypatch.setattr(export_manifest, "_file_hash", lambda path: hashed.append(path) or original(path))
+        assert delta_export("t2", "t3")[0] == []
+        # Solo se relee el archivo cuyo mtime cambió
+        assert [os.path.basename(path) for path in hashed] == ["a.jpg"]
+
+    def test_options_must_match_base_export(self, session):
+        options = {'format': 'ultralytics', 'compression': 'fast', 'classes': ["a"], 'val_ratio': 0.2, 'seed': 0}
+        write_manifest("sesion", iter_session_entries("sesion"), "t1", options)
+        previous = load_manifest("sesion", "t1")
+        # La compresión y el propio since no cambian las entradas
+        check_delta_options(previous, {**options, 'compression': 'small', 'since': "t1"})
+        with pytest.raises(ExportOptionsMismatch, match="format, val_ratio"):
+            check_delta_options(previous, {**options, 'format': 'tiles', 'val_ratio': 0.1})
+        with pytest.raises(ExportOptionsMismatch, match="imgsz"):
+            write_delta_manifest("sesion", [], previous, "t2", {**options, 'imgsz': 640})
+
+    def test_unknown_token(self, session):
+        with pytest.raises(UnknownExportToken):
+            load_manifest("sesion", "noexiste")
+        with pytest.raises(UnknownExportToken):
+            load_manifest("sesion", "../otra")
+
+    def test_old_manifests_are_pruned(self, session, monkeypatch):
+        monkeypatch.setattr(export_manifest, "EXPORT_MANIFESTS_KEEP", 2)
+        for token in ("t1", "t2", "t3"):
+            full_export(token)
+        with pytest.raises(UnknownExportToken):
+            load_manifest("sesion", "t1")
+        assert load_manifest("sesion", "t3")['token'] == "t3"
+
+    def test_touched_manifest_survives_pruning(self, session, monkeypatch):
+        # Una descarga servida desde la caché refresca el manifiesto de su token
+        monkeypatch.setattr(export_manifest, "EXPORT_MANIFESTS_KEEP", 2)
+        for age, token in ((20, "t1"), (10, "t2")):
+            full_export(token)
+            path = export_manifest.manifest_path("sesion", token)
+            os.utime(path, (os.stat(path).st_atime - age, os.stat(path).st_mtime - age))
+        assert touch_manifest("sesion", "t1")
+        full_export("t3")
+        assert load_manifest("sesion", "t1")['token'] == "t1"
+        with pytest.raises(UnknownExportToken):
+            load_manifest("sesion", "t2")
+        assert not touch_manifest("sesion", "t2")
@@ -0,0 +1,386 @@
+"""
+Tests del pipeline de procesamiento de imágenes subidas
+"""
+
+import io
+import os
+import zlib
+import struct
+import subprocess
+import sys
+import asyncio
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from PIL import Image
+from starlette.datastructures import UploadFile
+
+import image_store
+from image_processing import (
+    create_canvas_with_image, process_upload, upload_executor,
+    spool_upload, UploadTooLarge, SPOOL_MAX_MEMORY, UPLOAD_CHUNK_SIZE,
+    build_preview, get_thumbnail_path, validate_image_header, ImageRejected, rejection_metrics
+)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_image_bytes(size=(320, 240), mode='RGB', fmt='PNG', color=(10, 120, 200)):
+    """Generar una imagen en memoria y devolver sus bytes codificados"""
+    if mode == 'RGBA':
+        color = color + (128,)
+    img = Image.new(mode, size, color)
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Ejecutar el test dentro de un directorio con annotations/ vacío"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("annotations/sesion/images")
+    return tmp_path
+
+
+@pytest.mark.images
+class TestCanvas:
+    """Tests de composición del canvas"""
+
+    def test_large_image_is_resized_and_centered(self):
+        canvas = create_canvas_with_image(make_image_bytes((1600, 800)), (1000, 1000), 0, 0, change_bg=False)
+        assert canvas.size == (1000, 1000)
+        assert canvas.getpixel((500, 500)) == (10, 120, 200)
+        assert canvas.getpixel((500, 50)) == (200, 200, 200)
+
+    def test_large_jpeg_uses_draft_decode(self):
+        jpeg = make_image_bytes((4000, 3000), fmt='JPEG')
+        for quality in ('quality', 'fast'):
+            canvas = create_canvas_with_image(jpeg, (800, 800), 0, 0, change_bg=False, resize_quality=quality)
+            # Imagen de 800x600 centrada: ocupa las filas 100 a 699
+            r, g, b = canvas.getpixel((400, 400))
+            assert abs(r - 10) < 8 and abs(g - 120) < 8 and abs(b - 200) < 8
+            assert canvas.getpixel((400, 99)) == (200, 200, 200)
+            assert canvas.getpixel((400, 700)) == (200, 200, 200)
+
+    def test_invalid_resize_quality_fails_at_import(self):
+        env = {**os.environ, "RESIZE_QUALITY": "rapida"}
+        result = subprocess.run(
+            [sys.executable, "-c", "import image_processing"], cwd=REPO_ROOT, env=env, capture_output=True, text=True
+        )
+        assert result.returncode != 0 and "RESIZE_QUALITY inválido: rapida" in result.stderr
+
+    def test_palette_png_is_resized(self):
+        img = Image.new('P', (1600, 1600), 3)
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG')
+        canvas = create_canvas_with_image(buffer.getvalue(), (800, 800), 0, 0, change_bg=False)
+        assert canvas.size == (800, 800)
+
+    def test_rgba_is_flattened(self):
+        canvas = create_canvas_with_image(make_image_bytes(mode='RGBA'), (320, 240), 0, 0)
+        assert canvas.mode == 'RGB'
+
+    def test_alpha_is_blended_on_white_inside_canvas(self):
+        # Alfa 128 sobre blanco; fuera de la imagen sigue el color de fondo
+        canvas = create_canvas_with_image(make_image_bytes(mode='RGBA'), (640, 480), 0, 0, change_bg=False)
+        assert canvas.getpixel((320, 240)) == (132, 187, 227)
+        assert canvas.getpixel((10, 10)) == (200, 200, 200)
+
+    def test_transparent_palette_png(self):
+        img = Image.new('P', (100, 100), 0)
+        img.putpalette([255, 0, 0] * 256)
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG', transparency=0)
+        canvas = create_canvas_with_image(buffer.getvalue(), (200, 200), 0, 0, change_bg=False)
+        assert canvas.getpixel((100, 100)) == (255, 255, 255)
+
+
+@pytest.mark.images
+class TestProcessUpload:
+    """Tests de guardado de imágenes subidas"""
+
+    def test_saves_into_session(self, workdir):
+        result = process_upload(make_image_bytes(), "foto.png", "sesion", (640, 640))
+        filename = result['filename']
+        assert filename.startswith("sesion_") and filename.endswith("_foto.png")
+        assert (workdir / "annotations" / "sesion" / "images" / filename).exists()
+        assert result['canvas'].size == (640, 640)
+        assert not result['duplicate']
+
+    def test_parallel_uploads(self, workdir):
+        futures = [
+            upload_executor.submit(
+                process_upload, make_image_bytes(color=(i, i, i)), f"foto{i}.png", "sesion", (320, 320)
+            )
+            for i in range(8)
+        ]
+        names = {future.result()['filename'] for future in futures}
+        assert len(names) == 8
+        assert len(os.listdir(workdir / "annotations" / "sesion" / "images")) == 8
+
+    def test_duplicate_names_in_batch(self, workdir):
+        # Mismo nombre original en el mismo segundo: no se sobrescriben
+        futures = [
+            upload_executor.submit(
+                process_upload, make_image_bytes(color=(i, i, i)), "foto.png", "sesion", (320, 320)
+            )
+            for i in range(8)
+        ]
+        names = {future.result()['filename'] for future in futures}
+        assert len(names) == 8 and all(name.endswith("_foto.png") for name in names)
+        assert sorted(os.listdir(workdir / "annotations" / "sesion" / "images")) == sorted(names)
+
+
+@pytest.mark.images
+class TestSpoolUpload:
+    """Tests de copia por bloques de las subidas con límite de tamaño"""
+
+    def test_spooled_upload_decodes_from_file(self):
+        upload = UploadFile(io.BytesIO(make_image_bytes()), filename="foto.png")
+        spooled = asyncio.run(spool_upload(upload))
+        canvas = create_canvas_with_image(spooled, (640, 640), 0, 0)
+        assert canvas.size == (640, 640)
+
+    def test_rejects_oversized_upload_early(self):
+        data = io.BytesIO(b"x" * (3 * UPLOAD_CHUNK_SIZE))
+        upload = UploadFile(data, filename="grande.png")
+        with pytest.raises(UploadTooLarge):
+            asyncio.run(spool_upload(upload, max_bytes=UPLOAD_CHUNK_SIZE))
+        # Se deja de leer en cuanto se supera el límite
+        assert data.tell() == 2 * UPLOAD_CHUNK_SIZE
+
+    def test_rejects_by_declared_size(self):
+        upload = UploadFile(io.BytesIO(b""), filename="grande.png", size=10 * 1024 * 1024)
+        with pytest.raises(UploadTooLarge):
+            asyncio.run(spool_upload(upload, max_bytes=1024 * 1024))
+
+    def test_memory_per_upload_is_bounded(self, tmp_path):
+        # Archivo de 32 MB en disco: la copia no debe cargarlo entero en memoria
+        source = tmp_path / "grande.bin"
+        with open(source, 'wb') as f:
+            for _ in range(32):
+                f.write(os.urandom(1024 * 1024))
+
+        with open(source, 'rb') as f:
+            upload = UploadFile(f, filename="grande.bin")
+            tracemalloc.start()
+            spooled = asyncio.run(spool_upload(upload, max_bytes=64 * 1024 * 1024))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        spooled.seek(0, os.SEEK_END)
+        assert spooled.tell() == 32 * 1024 * 1024
+        spooled.close()
+        assert peak < SPOOL_MAX_MEMORY + 4 * UPLOAD_CHUNK_SIZE
+
+
+@pytest.mark.images
+class TestPreview:
+    """Tests de vistas previas y miniaturas"""
+
+    def test_preview_modes(self, workdir):
+        result = process_upload(make_image_bytes(), "foto.png", "sesion", (640, 640))
+        filename, canvas = result['filename'], result['canvas']
+        assert build_preview("sesion", filename, canvas, "none") == {}
+
+        by_url = build_preview("sesion", filename, canvas, "url")
+        assert by_url["preview"] == f"/api/preview/sesion/{filename}"
+        assert by_url["thumbnail_url"].startswith(by_url["preview"] + "?max_size=")
+
+        inline = build_preview("sesion", filename, canvas, "inline")
+        assert inline["preview"].startswith("data:image/jpeg;base64,")
+        # Sin canvas en memoria (subida deduplicada) se lee la imagen guardada
+        assert build_preview("sesion", filename, None, "inline")["preview"].startswith("data:image/jpeg")
+
+    def test_preview_url_is_quoted(self, workdir):
+        result = process_upload(make_image_bytes(), "mi foto #1?.png", "sesion", (640, 640))
+        preview = build_preview("sesion", result['filename'], result['canvas'], "url")["preview"]
+        assert preview == "/api/preview/sesion/" + result['filename'].replace(' ', '%20').replace('#', '%23').replace('?', '%3F')
+
+    def test_thumbnail_is_cached(self, workdir):
+        filename = process_upload(make_image_bytes(), "foto.png", "sesion", (640, 480))['filename']
+        thumb_path = get_thumbnail_path("sesion", filename, 128)
+        with Image.open(thumb_path) as thumb:
+            assert thumb.size == (128, 96)
+
+        mtime = os.path.getmtime(thumb_path)
+        assert get_thumbnail_path("sesion", filename, 128) == thumb_path
+        assert os.path.getmtime(thumb_path) == mtime
+
+    def test_thumbnails_of_same_stem_do_not_collide(self, workdir):
+        images = os.path.join("annotations", "sesion", "images")
+        os.makedirs(images, exist_ok=True)
+        Image.new('RGB', (64, 64), (255, 0, 0)).save(os.path.join(images, "a.png"))
+        Image.new('RGB', (64, 64), (0, 0, 255)).save(os.path.join(images, "a.jpg"))
+
+        png_thumb, jpg_thumb = get_thumbnail_path("sesion", "a.png", 32), get_thumbnail_path("sesion", "a.jpg", 32)
+        assert png_thumb != jpg_thumb
+        with Image.open(png_thumb) as png, Image.open(jpg_thumb) as jpg:
+            assert png.getpixel((16, 16))[0] > 200 and jpg.getpixel((16, 16))[2] > 200
+
+    def test_concurrent_thumbnail_generation(self, workdir):
+        filename = process_upload(make_image_bytes(), "foto.png", "sesion", (640, 480))['filename']
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            paths = list(executor.map(lambda _: get_thumbnail_path("sesion", filename, 64), range(16)))
+        assert len(set(paths)) == 1
+        with Image.open(paths[0]) as thumb:
+            assert thumb.size == (64, 48)
+        assert os.listdir(os.path.dirname(paths[0])) == [os.path.basename(paths[0])]
+
+    def test_thumbnail_of_missing_image(self, workdir):
+        assert get_thumbnail_path("sesion", "no_existe.png") is None
+
+
+@pytest.mark.images
+class TestDeduplication:
+    """Tests del almacén direccionado por contenido"""
+
+    def test_reupload_returns_existing_file(self, workdir):
+        first = process_upload(make_image_bytes(), "foto.png", "sesion", (640, 640))
+        second = process_upload(make_image_bytes(), "foto.png", "sesion", (640, 640))
+        assert second['duplicate'] and second['canvas'] is None
+        assert second['filename'] == first['filename']
+        assert len(os.listdir(workdir / "annotations" / "sesion" / "images")) == 1
+
+    def test_other_session_gets_hardlink(self, workdir):
+        first = process_upload(make_image_bytes(), "foto.png", "sesion", (640, 640))
+        other = process_upload(make_image_bytes(), "foto.png", "otra", (640, 640))
+        assert not other['duplicate'] and other['canvas'] is None
+        path_a = workdir / "annotations" / "sesion" / "images" / first['filename']
+        path_b = workdir / "annotations" / "otra" / "images" / other['filename']
+        assert os.path.samefile(path_a, path_b)
+
+        report = image_store.dedup_report(hash_contents=True)
+        assert report['files'] == 2 and report['unique_files'] == 1
+        assert report['bytes_saved'] == os.path.getsize(path_a)
+        assert report['dedup_ratio'] == 2.0
+        assert report['potential_bytes_saved'] == 0
+
+    def test_concurrent_writes_of_same_blob(self, workdir):
+        # La misma imagen dos veces en un lote: varios hilos escriben las mismas rutas
+        data = make_image_bytes()
+        blob_name = image_store.store_source(data, ".png")
+        futures = [
+            upload_executor.submit(image_store.link_into_session, blob_name, "sesion", "foto.png")
+            for _ in range(16)
+        ] + [upload_executor.submit(image_store.store_source, data, ".png") for _ in range(16)]
+        for future in futures:
+            future.result()
+        assert (workdir / "annotations" / "sesion" / "images" / "foto.png").read_bytes() == data
+        assert not [name for name in os.listdir(workdir / "annotations" / "sesion" / "images") if ".tmp" in name]
+
+    def test_deleted_session_releases_blobs(self, workdir, monkeypatch):
+        import shutil
+        monkeypatch.setattr(image_store, "GC_GRACE_SECONDS", 0)
+        shared = make_image_bytes()
+        own = make_image_bytes(color=(200, 10, 10))
+        process_upload(shared, "foto.png", "sesion", (640, 640))
+        process_upload(own, "propia.png", "sesion", (640, 640))
+        process_upload(shared, "foto.png", "otra", (640, 640))
+        objects = workdir / "blobs" / "objects"
+        assert sum(len(os.listdir(objects / prefix)) for prefix in os.listdir(objects)) == 2
+
+        shutil.rmtree(workdir / "annotations" / "sesion")
+        released = image_store.release_session("sesion")
+        assert len(released) == 2
+        collected = image_store.collect_garbage(released)
+        # El blob compartido sigue enlazado desde 'otra'
+        assert collected['blobs'] == 1 and collected['bytes'] > 0
+        assert sum(len(os.listdir(objects / prefix)) for prefix in os.listdir(objects)) == 1
+        assert process_upload(own, "propia.png", "sesion", (640, 640))['duplicate'] is False
+
+        shutil.rmtree(workdir / "annotations" / "otra")
+        image_store.release_session("otra")
+        assert image_store.collect_garbage()['blobs'] == 1
+
+    def test_same_canvas_different_source(self, workdir):
+        # Mismos píxeles desde dos formatos distintos: un único blob (canvas
+        # mayor que la imagen para que ninguna de las dos se guarde tal cual)
+        png = process_upload(make_image_bytes(fmt='PNG'), "a.png", "sesion", (400, 300), change_bg=False)
+        bmp = process_upload(make_image_bytes(fmt='BMP'), "b.png", "sesion", (400, 300), change_bg=False)
+        assert bmp['duplicate'] and bmp['filename'] == png['filename']
+
+
+@pytest.mark.images
+class TestPassthrough:
+    """Tests de guardado sin recodificar cuando la imagen ya es el canvas"""
+
+    @pytest.mark.parametrize("dedup", [True, False])
+    def test_matching_image_is_stored_verbatim(self, workdir, monkeypatch, dedup):
+        monkeypatch.setattr("image_processing.DEDUP_UPLOADS", dedup)
+        jpeg = make_image_bytes((640, 480), fmt='JPEG')
+        result = process_upload(jpeg, "foto.jpg", "sesion", (640, 480))
+        stored = workdir / "annotations" / "sesion" / "images" / result['filename']
+        assert stored.read_bytes() == jpeg
+        assert result['canvas'] is None
+
+    def test_passthrough_from_spooled_file(self, workdir):
+        png = make_image_bytes((320, 240))
+        spooled = asyncio.run(spool_upload(UploadFile(io.BytesIO(png), filename="foto.png")))
+        result = process_upload(spooled, "foto.png", "sesion", (320, 240))
+        assert (workdir / "annotations" / "sesion" / "images" / result['filename']).read_bytes() == png
+
+    @pytest.mark.parametrize("image_bytes, filename, size", [
+        (make_image_bytes((320, 240)), "foto.png", (640, 480)),             # necesita fondo
+        (make_image_bytes((320, 240), mode='RGBA'), "foto.png", (320, 240)),  # alfa a aplanar
+        (make_image_bytes((320, 240)), "foto.jpg", (320, 240)),             # PNG con extensión .jpg
+        (make_image_bytes((1000, 1000)), "foto.png", (1000, 1000)),         # mayor que max_size
+    ])
+    def test_other_images_are_processed(self, workdir, image_bytes, filename, size):
+        result = process_upload(image_bytes, filename, "sesion", size)
+        assert result['canvas'] is not None
+
+
+def make_png_header(width, height):
+    """PNG que declara width x height con un IDAT vacío (sin píxeles que decodificar)"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", b"") + chunk(b"IEND", b"")
+
+
+@pytest.mark.images
+class TestImageGuard:
+    """Tests de validación de cabecera antes de decodificar"""
+
+    def test_accepts_regular_image(self):
+        assert validate_image_header(make_image_bytes(), "foto.png") == ('PNG', (320, 240), 1)
+
+    def test_rejects_bomb_from_header(self, workdir):
+        # La cabecera basta para rechazarla: no hay píxeles que decodificar
+        before = rejection_metrics()['by_reason'].get('pixels', 0)
+        with pytest.raises(ImageRejected) as exc:
+            process_upload(make_png_header(30000, 30000), "bomba.png", "sesion", (640, 640))
+        assert exc.value.reason == 'pixels' and "bomba.png" in str(exc.value)
+        assert rejection_metrics()['by_reason']['pixels'] == before + 1
+        assert os.listdir(workdir / "annotations" / "sesion" / "images") == []
+
+    def test_rejects_oversized_side(self):
+        with pytest.raises(ImageRejected) as exc:
+            validate_image_header(make_png_header(30000, 100))
+        assert exc.value.reason == 'dimensions' and "30000x100" in str(exc.value)
+
+    def test_pixel_limit_is_configurable(self, monkeypatch):
+        monkeypatch.setattr("image_processing.MAX_IMAGE_PIXELS", 10000)
+        with pytest.raises(ImageRejected) as exc:
+            validate_image_header(make_png_header(200, 200))
+        assert exc.value.reason == 'pixels'
+
+    def test_rejects_too_many_frames(self, monkeypatch):
+        monkeypatch.setattr("image_processing.MAX_IMAGE_FRAMES", 2)
+        frames = [Image.new('RGB', (32, 32), (i * 60, 0, 0)) for i in range(3)]
+        buffer = io.BytesIO()
+        frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:])
+        with pytest.raises(ImageRejected) as exc:
+            validate_image_header(buffer.getvalue())
+        assert exc.value.reason == 'frames'
+
+    @pytest.mark.parametrize("data, reason", [
+        (make_image_bytes(fmt='TIFF'), 'format'),
+        (b"esto no es una imagen", 'invalid'),
+    ])
+    def test_rejects_format_and_garbage(self, data, reason):
+        with pytest.raises(ImageRejected) as exc:
+            validate_image_header(data)
+        assert exc.value.reason == reason
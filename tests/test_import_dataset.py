@@ -0,0 +1,107 @@
+"""
+Tests de importación masiva de datasets YOLO
+"""
+
+import io
+import os
+import zipfile
+import pytest
+
+from import_dataset import (
+    import_yolo_zip, parse_data_yaml_names, read_class_names,
+    validate_label_text, DatasetImportError
+)
+from session_index import load_session_index, update_session_index, summarize_index
+from tests.test_image_processing import make_image_bytes
+
+
+def make_dataset_zip(num_images=4, extra=None):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr("dataset/classes.txt", "gato\nperro\n")
+        for i in range(num_images):
+            zf.writestr(f"dataset/images/train/img{i}.jpg", make_image_bytes(fmt='JPEG'))
+            zf.writestr(f"dataset/labels/train/img{i}.txt", f"{i % 2} 0.5 0.5 0.2 0.2\n")
+        for name, content in (extra or {}).items():
+            zf.writestr(name, content)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.mark.unit
+class TestDatasetMetadata:
+    """Tests de lectura de clases y validación de etiquetas"""
+
+    def test_data_yaml_names(self):
+        assert parse_data_yaml_names("names: ['gato', perro]") == ["gato", "perro"]
+        assert parse_data_yaml_names("nc: 2\nnames:\n  - gato\n  - perro\ntrain: x") == ["gato", "perro"]
+        assert parse_data_yaml_names("names:\n  1: perro\n  0: gato\n") == ["gato", "perro"]
+        assert parse_data_yaml_names("train: images") is None
+
+    def test_class_names_from_zip(self):
+        with zipfile.ZipFile(make_dataset_zip()) as zf:
+            assert read_class_names(zf) == ["gato", "perro"]
+
+    def test_validate_labels(self):
+        assert validate_label_text("0 0.5 0.5 0.1 0.1\n\n1 0.2 0.2 0.1 0.1", 2) == [
+            (0, ['0.5', '0.5', '0.1', '0.1']), (1, ['0.2', '0.2', '0.1', '0.1'])
+        ]
+        for text in ("2 0.5 0.5 0.1 0.1", "0 1.5 0.5 0.1 0.1", "0 0.5 0.5 0 0.1", "0 0.5 0.5", "a b c d e"):
+            with pytest.raises(ValueError):
+                validate_label_text(text, 2)
+
+
+@pytest.mark.images
+class TestImportYoloZip:
+    """Tests de importación de un ZIP en una sesión"""
+
+    def test_imports_images_and_labels(self, workdir):
+        report = import_yolo_zip(make_dataset_zip(), "sesion", class_map=[3, 0])
+        assert report['images'] == 4 and report['labels'] == 4 and report['skipped'] == 0
+
+        labels_dir = workdir / "annotations" / "sesion" / "labels"
+        contents = sorted((labels_dir / name).read_text() for name in os.listdir(labels_dir))
+        # Clases del dataset reasignadas a los índices de la sesión
+        assert contents == ["0 0.5 0.5 0.2 0.2"] * 2 + ["3 0.5 0.5 0.2 0.2"] * 2
+
+        summary = summarize_index(load_session_index("sesion"))
+        assert summary['images'] == 4 and summary['boxes'] == 4
+        assert summary['class_counts'] == {0: 2, 3: 2}
+
+    def test_invalid_entries_are_skipped(self, workdir):
+        archive = make_dataset_zip(2, extra={
+            "dataset/images/val/roto.png": b"no es una imagen",
+            "dataset/images/val/mala.png": make_image_bytes(),
+            "dataset/labels/val/mala.txt": "7 0.5 0.5 0.2 0.2",
+            "dataset/labels/val/huerfana.txt": "0 0.5 0.5 0.2 0.2",
+        })
+        report = import_yolo_zip(archive, "sesion", class_map=[0, 1])
+        assert report['images'] == 2 and report['skipped'] == 2
+        assert report['orphan_labels'] == 1
+        assert len(report['errors']) == 2
+        assert len(os.listdir(workdir / "annotations" / "sesion" / "images")) == 2
+
+    def test_rejects_non_dataset(self, workdir):
+        with pytest.raises(DatasetImportError):
+            import_yolo_zip(io.BytesIO(b"no es un zip"), "sesion")
+        empty = io.BytesIO()
+        with zipfile.ZipFile(empty, 'w') as zf:
+            zf.writestr("readme.txt", "hola")
+        with pytest.raises(DatasetImportError):
+            import_yolo_zip(empty, "sesion")
+
+    def test_index_tracks_label_changes(self, workdir):
+        import_yolo_zip(make_dataset_zip(1), "sesion")
+        labels_dir = workdir / "annotations" / "sesion" / "labels"
+        label_path = labels_dir / os.listdir(labels_dir)[0]
+        label_path.write_text("1 0.5 0.5 0.2 0.2\n1 0.1 0.1 0.1 0.1")
+        os.utime(label_path, (1, 1))
+
+        summary = summarize_index(update_session_index("sesion"))
+        assert summary['class_counts'] == {1: 2}
@@ -0,0 +1,181 @@
+"""
+Tests de los backends de almacenamiento de etiquetas (txt y SQLite)
+"""
+
+import os
+import sqlite3
+import threading
+import pytest
+
+import label_store
+from label_store import (
+    TxtLabelStore, SqliteLabelStore, get_label_store, migrate_session, label_version,
+    VersionConflict, LABEL_DB_FILENAME
+)
+from annotation_utils import validate_annotations
+from augment_dataset import augment_session
+from session_index import load_session_index
+from tests.test_image_processing import make_image_bytes
+
+BACKENDS = {'txt': TxtLabelStore, 'sqlite': SqliteLabelStore}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(tmp_path / "annotations" / "sesion" / "images")
+    os.makedirs(tmp_path / "annotations" / "sesion" / "labels")
+    return tmp_path
+
+
+@pytest.fixture(params=list(BACKENDS))
+def store(request, workdir):
+    return BACKENDS[request.param]("sesion")
+
+
+@pytest.mark.unit
+class TestLabelStores:
+    """Mismo comportamiento en los dos backends"""
+
+    def test_save_and_load(self, store):
+        store.save("a.jpg", ["0 0.5 0.5 0.2 0.2", "3 0.25 0.75 0.1 0.1"])
+        store.save_many({"b.png": [], "c.jpg": ["1 0.5 0.5 0.5 0.5"]})
+        store.save("c.jpg", ["2 0.5 0.5 0.5 0.5"])
+
+        assert store.load("a.jpg") == ["0 0.5 0.5 0.2 0.2", "3 0.25 0.75 0.1 0.1"]
+        assert store.load("sin_etiquetas.jpg") is None
+        assert store.load_many(["a.jpg", "b.png", "c.jpg", "d.jpg"]) == {
+            "a.jpg": ["0 0.5 0.5 0.2 0.2", "3 0.25 0.75 0.1 0.1"],
+            "b.png": [],
+            "c.jpg": ["2 0.5 0.5 0.5 0.5"]
+        }
+        assert store.count_labeled() == 3
+        assert store.class_ids() == {0, 2, 3}
+
+    def test_summary_and_export(self, store, workdir):
+        for name in ("a.jpg", "b.jpg", "c.jpg"):
+            (workdir / "annotations" / "sesion" / "images" / name).write_bytes(b"")
+        store.save_many({"a.jpg": ["0 0.5 0.5 0.2 0.2", "0 0.1 0.1 0.1 0.1"], "b.jpg": []})
+
+        assert store.summary() == {
+            'images': 3, 'labeled_images': 1, 'boxes': 2, 'class_counts': {0: 2}
+        }
+        assert list(store.iter_label_files()) == [
+            ("a.txt", b"0 0.5 0.5 0.2 0.2\n0 0.1 0.1 0.1 0.1"), ("b.txt", b"")
+        ]
+
+    def test_update_index_after_batch_save(self, store, workdir):
+        images = workdir / "annotations" / "sesion" / "images"
+        for name in ("a.jpg", "b.jpg"):
+            (images / name).write_bytes(make_image_bytes(size=(40, 20)))
+        store.save_many({"a.jpg": ["0 0.5 0.5 0.2 0.2"]})
+        store.update_index(["a.jpg"])
+
+        # Solo se recalcula la entrada indicada
+        entries = load_session_index("sesion")['images']
+        assert list(entries) == ["a.jpg"]
+        assert (entries["a.jpg"]['width'], entries["a.jpg"]['height']) == (40, 20)
+
+    def test_save_with_version(self, store):
+        empty = label_version([])
+        store.save("a.jpg", ["0 0.5 0.5 0.2 0.2"], empty)
+        current = label_version(store.load("a.jpg"))
+
+        # Versión antigua: no se escribe nada y se devuelve lo actual
+        with pytest.raises(VersionConflict) as conflict:
+            store.save("a.jpg", ["1 0.5 0.5 0.2 0.2"], empty)
+        assert conflict.value.version == current
+        assert conflict.value.image == "a.jpg"
+        with pytest.raises(VersionConflict):
+            store.save_many({"a.jpg": [], "b.jpg": ["2 0.5 0.5 0.1 0.1"]}, {"a.jpg": empty, "b.jpg": empty})
+        assert store.load_many(["a.jpg", "b.jpg"]) == {"a.jpg": ["0 0.5 0.5 0.2 0.2"]}
+
+        store.save_many({"a.jpg": [], "b.jpg": ["2 0.5 0.5 0.1 0.1"]}, {"a.jpg": current, "b.jpg": empty})
+        assert store.load_many(["a.jpg", "b.jpg"]) == {"a.jpg": [], "b.jpg": ["2 0.5 0.5 0.1 0.1"]}
+
+    def test_version_survives_reload(self, store):
+        lines = validate_annotations([{'class_id': 0, 'x_center': 1, 'y_center': 0.5, 'width': 1, 'height': 0.25}])
+        store.save("a.jpg", lines)
+        assert label_version(store.load("a.jpg")) == label_version(lines)
+
+    def test_concurrent_updates_are_not_lost(self, store):
+        # Cada hilo añade una caja con la versión que leyó; los que pierden
+        # la carrera reciben VersionConflict y reintentan con la nueva
+        store.save("a.jpg", [])
+
+        def add_box(class_id):
+            while True:
+                lines = store.load("a.jpg") or []
+                try:
+                    store.save("a.jpg", lines + [f"{class_id} 0.5 0.5 0.1 0.1"], label_version(lines))
+                    return
+                except VersionConflict:
+                    pass
+
+        threads = [threading.Thread(target=add_box, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(line.split()[0] for line in store.load("a.jpg")) == [str(i) for i in range(8)]
+
+
+@pytest.mark.unit
+class TestBackendSelection:
+    """Tests de elección de backend y migración"""
+
+    def test_default_backend_for_new_sessions(self, workdir, monkeypatch):
+        assert get_label_store("sesion").backend == 'txt'
+        monkeypatch.setattr(label_store, "ANNOTATION_STORAGE", "sqlite")
+        assert get_label_store("sesion").backend == 'sqlite'
+        # Una sesión con .txt sigue en txt hasta que se migre
+        (workdir / "annotations" / "sesion" / "labels" / "a.txt").write_text("0 0.5 0.5 0.1 0.1")
+        assert get_label_store("sesion").backend == 'txt'
+
+    def test_migration_round_trip(self, workdir):
+        labels_dir = workdir / "annotations" / "sesion" / "labels"
+        TxtLabelStore("sesion").save_many({"a.jpg": ["1 0.5 0.5 0.2 0.2"], "img.v2.png": []})
+
+        assert migrate_session("sesion", "sqlite") == 2
+        assert os.listdir(labels_dir) == []
+        store = get_label_store("sesion")
+        assert store.backend == 'sqlite'
+        assert store.load_many(["a.jpg", "img.v2.png"]) == {"a.jpg": ["1 0.5 0.5 0.2 0.2"], "img.v2.png": []}
+        assert migrate_session("sesion", "sqlite") == 0
+        with store._connect() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+        assert migrate_session("sesion", "txt") == 2
+        assert sorted(os.listdir(labels_dir)) == ["a.txt", "img.v2.txt"]
+        assert (labels_dir / "a.txt").read_text() == "1 0.5 0.5 0.2 0.2"
+        assert not any(f.startswith(LABEL_DB_FILENAME) for f in os.listdir(workdir / "annotations" / "sesion"))
+
+    def test_old_database_gets_versions(self, workdir):
+        db_path = workdir / "annotations" / "sesion" / LABEL_DB_FILENAME
+        conn = sqlite3.connect(db_path)
+        conn.executescript(
+            "CREATE TABLE labels (image TEXT PRIMARY KEY, updated_at REAL NOT NULL);"
+            "CREATE TABLE boxes (image TEXT NOT NULL, position INTEGER NOT NULL, class_id INTEGER NOT NULL, "
+            "x_center REAL NOT NULL, y_center REAL NOT NULL, width REAL NOT NULL, height REAL NOT NULL, "
+            "PRIMARY KEY (image, position));"
+            "INSERT INTO labels VALUES ('a', 0);"
+            "INSERT INTO boxes VALUES ('a', 0, 1, 0.5, 0.5, 0.2, 0.2);"
+        )
+        conn.commit()
+        conn.close()
+
+        store = SqliteLabelStore("sesion")
+        lines = store.load("a.jpg")
+        assert lines == ["1 0.5 0.5 0.2 0.2"]
+        store.save("a.jpg", [], label_version(lines))
+        assert store.load("a.jpg") == []
+
+    def test_augment_uses_session_store(self, workdir):
+        migrate_session("sesion", "sqlite")
+        (workdir / "annotations" / "sesion" / "images" / "a.jpg").write_bytes(make_image_bytes(fmt='JPEG'))
+        get_label_store("sesion").save("a.jpg", ["0 0.25 0.5 0.2 0.2"])
+
+        augment_session("sesion", ["espejo", "brillo"])
+        labels = get_label_store("sesion").load_many(["a_espejo.jpg", "a_brillo.jpg"])
+        assert labels == {"a_espejo.jpg": ["0 0.75 0.5 0.2 0.2"], "a_brillo.jpg": ["0 0.25 0.5 0.2 0.2"]}
+        assert os.listdir(workdir / "annotations" / "sesion" / "labels") == []
@@ -0,0 +1,131 @@
+"""
+Tests de escritura atómica, agrupación y fsync de archivos de etiquetas
+"""
+
+import os
+import time
+import pytest
+
+import label_writer
+from label_writer import LabelWriteCoalescer, write_label_file, write_label_files, flush_pending_labels
+
+
+@pytest.mark.unit
+class TestAtomicWrites:
+    """Tests de escritura atómica de un archivo"""
+
+    def test_write_replaces_without_leftovers(self, tmp_path):
+        path = str(tmp_path / "labels" / "a.txt")
+        write_label_file(path, ["0 0.5 0.5 0.1 0.1"])
+        write_label_file(path, ["1 0.5 0.5 0.2 0.2", "0 0.1 0.1 0.1 0.1"])
+        assert open(path).read() == "1 0.5 0.5 0.2 0.2\n0 0.1 0.1 0.1 0.1"
+        assert os.listdir(tmp_path / "labels") == ["a.txt"]
+
+    def test_failed_write_keeps_previous_content(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "a.txt")
+        write_label_file(path, ["0 0.5 0.5 0.1 0.1"])
+
+        def failing_replace(src, dst):
+            raise OSError("disco lleno")
+
+        monkeypatch.setattr(os, "replace", failing_replace)
+        with pytest.raises(OSError):
+            write_label_file(path, ["1 0.5 0.5 0.5 0.5"])
+        monkeypatch.undo()
+        assert open(path).read() == "0 0.5 0.5 0.1 0.1"
+        assert os.listdir(tmp_path) == ["a.txt"]
+
+    @pytest.mark.parametrize("policy", ["file", "dir"])
+    def test_fsync_policies(self, tmp_path, monkeypatch, policy):
+        synced = []
+        real_fsync = os.fsync
+        monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd) or real_fsync(fd))
+        write_label_file(str(tmp_path / "a.txt"), ["0 0.5 0.5 0.1 0.1"], fsync_policy=policy)
+        assert len(synced) == (1 if policy == "file" else 2)
+
+
+@pytest.mark.unit
+class TestCoalescer:
+    """Tests de agrupación de guardados seguidos"""
+
+    @pytest.fixture
+    def spy(self):
+        writes = []
+        return writes, lambda path, lines: writes.append((path, lines))
+
+    def test_burst_writes_latest_once(self, spy):
+        writes, writer = spy
+        coalescer = LabelWriteCoalescer(0.05, writer)
+        for version in range(5):
+            coalescer.submit("a.txt", [f"{version} 0.5 0.5 0.1 0.1"])
+        assert writes == []
+        time.sleep(0.2)
+        assert writes == [("a.txt", ["4 0.5 0.5 0.1 0.1"])]
+        assert coalescer.pending_count() == 0
+
+    def test_discard_and_flush_by_prefix(self, spy):
+        writes, writer = spy
+        coalescer = LabelWriteCoalescer(60, writer)
+        coalescer.submit("s1/a.txt", ["0 0.5 0.5 0.1 0.1"])
+        coalescer.submit("s1/b.txt", ["1 0.5 0.5 0.1 0.1"])
+        coalescer.submit("s2/a.txt", ["2 0.5 0.5 0.1 0.1"])
+        coalescer.discard("s1/b.txt")
+
+        coalescer.flush_all("s1/")
+        assert writes == [("s1/a.txt", ["0 0.5 0.5 0.1 0.1"])]
+        assert coalescer.pending_count() == 1
+        coalescer.flush_all()
+        assert writes[-1][0] == "s2/a.txt"
+
+    def test_batch_write_supersedes_pending_autosave(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(label_writer, "coalescer", LabelWriteCoalescer(60))
+        label_writer.save_label_file(
+            os.path.join("annotations", "sesion", "labels", "a.txt"), ["0 0.1 0.1 0.1 0.1"]
+        )
+        write_label_files("sesion", {"a.jpg": ["1 0.5 0.5 0.5 0.5"]})
+        flush_pending_labels("sesion")
+        labels_dir = tmp_path / "annotations" / "sesion" / "labels"
+        assert (labels_dir / "a.txt").read_text() == "1 0.5 0.5 0.5 0.5"
+
+
+@pytest.mark.unit
+class TestBatchLabelWrites:
+    """Tests de escritura todo o nada de varias etiquetas"""
+
+    def test_writes_all_files(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        write_label_files("sesion", {"a.jpg": ["0 0.5 0.5 0.1 0.1"], "b.png": []})
+        labels_dir = tmp_path / "annotations" / "sesion" / "labels"
+        assert (labels_dir / "a.txt").read_text() == "0 0.5 0.5 0.1 0.1"
+        assert (labels_dir / "b.txt").read_text() == ""
+        assert sorted(os.listdir(labels_dir)) == ["a.txt", "b.txt"]
+
+    def test_rejects_duplicate_stems_before_writing(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        with pytest.raises(ValueError, match="a.jpg"):
+            write_label_files("sesion", {"b.jpg": [], "a.jpg": ["0 0.5 0.5 0.1 0.1"], "a.png": []})
+        labels_dir = tmp_path / "annotations" / "sesion" / "labels"
+        assert not labels_dir.exists() or os.listdir(labels_dir) == []
+
+    def test_failure_restores_previous_labels(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        write_label_files("sesion", {"a.jpg": ["0 0.1 0.1 0.1 0.1"]})
+
+        real_replace = os.replace
+        calls = []
+
+        def failing_replace(src, dst):
+            calls.append(dst)
+            if len(calls) == 2:
+                raise OSError("disco lleno")
+            real_replace(src, dst)
+
+        monkeypatch.setattr(os, "replace", failing_replace)
+        with pytest.raises(OSError):
+            write_label_files("sesion", {"a.jpg": ["1 0.5 0.5 0.5 0.5"], "b.jpg": ["1 0.5 0.5 0.5 0.5"]})
+        monkeypatch.setattr(os, "replace", real_replace)
+
+        labels_dir = tmp_path / "annotations" / "sesion" / "labels"
+        assert (labels_dir / "a.txt").read_text() == "0 0.1 0.1 0.1 0.1"
+        assert os.listdir(labels_dir) == ["a.txt"]
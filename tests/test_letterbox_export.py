@@ -0,0 +1,114 @@
+"""
+Tests de la exportación con imágenes redimensionadas (letterbox)
+"""
+
+import io
+import json
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from PIL import Image
+
+from label_store import get_label_store
+from letterbox_export import (
+    letterbox_geometry, letterbox_boxes, iter_letterbox_entries, iter_in_pool, LETTERBOX_COLOR, LETTERBOX_METADATA
+)
+from training_export import split_for
+from zip_stream import stream_zip
+
+
+def write_image(path, size, fmt, box=None):
+    """Imagen negra con un rectángulo blanco en `box` (x_min, y_min, x_max, y_max)"""
+    img = Image.new('RGB', size, (0, 0, 0))
+    if box:
+        img.paste((255, 255, 255), box)
+    img.save(path, format=fmt)
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    images = tmp_path / "annotations" / "sesion" / "images"
+    images.mkdir(parents=True)
+    # Caja blanca de 100×50 centrada en (150, 75) en una imagen 400×200
+    write_image(images / "ancha.png", (400, 200), 'PNG', (100, 50, 200, 100))
+    write_image(images / "alta.jpg", (100, 300), 'JPEG')
+    get_label_store("sesion").save_many({
+        "ancha.png": ["1 0.375 0.375 0.25 0.25"],
+        "alta.jpg": ["0 0.5 0.5 1.0 1.0"],
+    })
+    return images
+
+
+@pytest.mark.unit
+class TestLetterboxGeometry:
+    """Tests de la transformación de cajas"""
+
+    def test_geometry(self):
+        scale, new_w, new_h, pad_x, pad_y = letterbox_geometry([400, 100, 640], [200, 300, 640], 640)
+        assert scale.tolist() == [1.6, 640 / 300, 1.0]
+        assert new_w.tolist() == [640, 213, 640] and new_h.tolist() == [320, 640, 640]
+        assert pad_x.tolist() == [0, 213, 0] and pad_y.tolist() == [160, 0, 0]
+
+    def test_boxes_follow_image_content(self):
+        boxes = np.array([[0.5, 0.5, 1.0, 1.0], [0.375, 0.375, 0.25, 0.25]])
+        result = letterbox_boxes(boxes, [400, 400], [200, 200], 640)
+        # La imagen completa ocupa la franja central del lienzo
+        np.testing.assert_allclose(result[0], [0.5, 0.5, 1.0, 0.5])
+        np.testing.assert_allclose(result[1], [0.375, (0.375 * 320 + 160) / 640, 0.25, 0.125])
+
+    def test_pool_window(self):
+        submitted = []
+
+        def items():
+            for i in range(20):
+                submitted.append(i)
+                yield (i,)
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = iter_in_pool(executor, lambda i: i * i, items(), 3)
+            assert next(results) == 0
+            # Hasta 2 × workers tareas enviadas antes de entregar la primera
+            assert len(submitted) == 6
+            assert list(results) == [i * i for i in range(1, 20)]
+
+
+@pytest.mark.unit
+@pytest.mark.images
+class TestLetterboxExport:
+    """Tests del ZIP con imágenes redimensionadas"""
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_layout(self, session, workers):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            entries = iter_letterbox_entries("sesion", ["a", "b"], 320, 0.5, 0, executor=executor, workers=workers)
+            raw = b''.join(stream_zip(entries))
+        with zipfile.ZipFile(io.BytesIO(raw)) as zf:
+            listing = zf.namelist()
+            wide = f"images/{split_for('ancha.png', 0.5)}/ancha.png"
+            tall = f"images/{split_for('alta.jpg', 0.5)}/alta.jpg"
+            assert listing[0] == "data.yaml" and listing[-1] == LETTERBOX_METADATA
+            assert wide in listing and tall in listing
+
+            metadata = json.loads(zf.read(LETTERBOX_METADATA))
+            assert metadata['imgsz'] == 320 and metadata['color'] == list(LETTERBOX_COLOR)
+            assert metadata['images'][wide] == {
+                'source': "ancha.png", 'original': [400, 200], 'resized': [320, 160], 'scale': 0.8, 'pad': [0, 80]
+            }
+
+            with Image.open(io.BytesIO(zf.read(wide))) as img:
+                assert img.size == (320, 320) and img.format == 'PNG'
+                assert img.getpixel((5, 5)) == LETTERBOX_COLOR
+                label = zf.read(f"labels/{split_for('ancha.png', 0.5)}/ancha.txt").decode().split()
+                # El centro de la caja ajustada cae sobre el rectángulo blanco
+                xc, yc = float(label[1]) * 320, float(label[2]) * 320
+                assert label[0] == "1" and img.getpixel((int(xc), int(yc))) == (255, 255, 255)
+                assert img.getpixel((int(xc), int(yc - float(label[4]) * 160 - 4))) == (0, 0, 0)
+
+            with Image.open(io.BytesIO(zf.read(tall))) as img:
+                assert img.size == (320, 320) and img.format == 'JPEG'
+            label = zf.read(f"labels/{split_for('alta.jpg', 0.5)}/alta.txt").decode()
+            # 100×300 → 107×320 con relleno izquierdo entero de 106 px
+            values = [float(v) for v in label.split()]
+            np.testing.assert_allclose(values, [0, (107 / 2 + 106) / 320, 0.5, 107 / 320, 1.0], atol=1e-6)
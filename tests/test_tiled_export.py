@@ -0,0 +1,107 @@
+"""
+Tests de la exportación en mosaicos solapados
+"""
+
+import io
+import json
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from PIL import Image
+
+from label_store import get_label_store
+from tiled_export import tile_grid, tile_boxes, default_stride, iter_tiled_entries, TILES_METADATA
+from training_export import split_for
+from zip_stream import stream_zip
+
+
+@pytest.mark.unit
+class TestTileGeometry:
+    """Tests de la rejilla de mosaicos y la intersección con las cajas"""
+
+    def test_grid(self):
+        tiles = tile_grid(1000, 500, 400, 300)
+        # Columnas en 0, 300 y 600 (la última ajustada al borde); filas en 0 y 100
+        assert tiles.tolist() == [
+            [0, 0, 400, 400], [300, 0, 700, 400], [600, 0, 1000, 400],
+            [0, 100, 400, 500], [300, 100, 700, 500], [600, 100, 1000, 500],
+        ]
+        assert tile_grid(200, 100, 400, 300).tolist() == [[0, 0, 200, 100]]
+        assert default_stride(640) == 512
+
+    def test_boxes_are_clipped_and_filtered(self):
+        tiles = np.array([[0, 0, 100, 100], [80, 0, 180, 100]])
+        corners = np.array([
+            [10, 10, 30, 30],    # solo en el primero
+            [70, 40, 90, 60],    # 100 % en el primero, 50 % en el segundo
+            [95, 0, 115, 10],    # 25 % en el primero: por debajo del umbral
+        ])
+        box_index, tile_index, boxes = tile_boxes(corners, tiles, min_visibility=0.3)
+        assert list(zip(box_index.tolist(), tile_index.tolist())) == [(0, 0), (1, 0), (1, 1), (2, 1)]
+        np.testing.assert_allclose(boxes, [
+            [0.2, 0.2, 0.2, 0.2],
+            [0.8, 0.5, 0.2, 0.2],
+            [0.05, 0.5, 0.1, 0.2],   # recortada al borde izquierdo del segundo mosaico
+            [0.25, 0.05, 0.2, 0.1],
+        ])
+
+    def test_degenerate_boxes(self):
+        box_index, _, boxes = tile_boxes(np.array([[10, 10, 10, 30]]), np.array([[0, 0, 100, 100]]), 0.1)
+        assert len(box_index) == 0 and boxes.shape == (0, 4)
+
+
+@pytest.mark.unit
+@pytest.mark.images
+class TestTiledExport:
+    """Tests del ZIP de mosaicos"""
+
+    @pytest.fixture
+    def session(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        images = tmp_path / "annotations" / "sesion" / "images"
+        images.mkdir(parents=True)
+        img = Image.new('RGB', (1000, 500), (0, 0, 0))
+        img.paste((255, 255, 255), (50, 50, 70, 70))
+        img.save(images / "aerea.png")
+        Image.new('RGB', (300, 200)).save(images / "vacia.jpg")
+        Image.new('RGB', (300, 200)).save(images / "sin_etiquetas.jpg")
+        get_label_store("sesion").save_many({
+            # Objeto de 20×20 píxeles en (50, 50)
+            "aerea.png": ["2 0.06 0.12 0.02 0.04"],
+            "vacia.jpg": [],
+        })
+        return images
+
+    def export(self, workers=1, **options):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            entries = iter_tiled_entries(
+                "sesion", ["a"], 400, 300, val_ratio=0.5, executor=executor, workers=workers, **options
+            )
+            return zipfile.ZipFile(io.BytesIO(b''.join(stream_zip(entries))))
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_only_tiles_with_objects(self, session, workers):
+        split = split_for("aerea.png", 0.5)
+        with self.export(workers) as zf:
+            assert zf.namelist() == [
+                "data.yaml", f"images/{split}/aerea_0_0.png", f"labels/{split}/aerea_0_0.txt", TILES_METADATA
+            ]
+            assert zf.read(f"labels/{split}/aerea_0_0.txt") == b"2 0.150000 0.150000 0.050000 0.050000"
+            with Image.open(io.BytesIO(zf.read(f"images/{split}/aerea_0_0.png"))) as tile:
+                assert tile.size == (400, 400)
+                assert tile.getpixel((60, 60)) == (255, 255, 255)
+            metadata = json.loads(zf.read(TILES_METADATA))
+            assert metadata['tile_size'] == 400 and metadata['stride'] == 300
+            assert metadata['tiles'] == {
+                f"images/{split}/aerea_0_0.png": {'source': "aerea.png", 'origin': [0, 0], 'size': [400, 400]}
+            }
+
+    def test_keep_empty(self, session):
+        with self.export(keep_empty=True) as zf:
+            images = [name for name in zf.namelist() if name.startswith("images/")]
+            labels = [name for name in zf.namelist() if name.startswith("labels/")]
+        # 6 mosaicos de aerea.png y 1 de vacia.jpg; sin_etiquetas.jpg no se exporta
+        assert len(images) == len(labels) == 7
+        assert not any("sin_etiquetas" in name for name in images)
+        assert any(name.endswith("/vacia_0_0.jpg") for name in images)
@@ -0,0 +1,73 @@
+"""
+Tests de la exportación lista para entrenar (train/val + data.yaml)
+"""
+
+import io
+import zipfile
+import pytest
+
+from label_store import get_label_store
+from training_export import original_stem, split_for, data_yaml, iter_training_entries
+from import_dataset import parse_data_yaml_names
+from zip_stream import stream_zip
+
+
+@pytest.mark.unit
+class TestTrainingSplit:
+    """Tests de la división determinista"""
+
+    def test_variants_share_original(self):
+        assert original_stem("foto.jpg") == "foto"
+        assert original_stem("foto_espejo.jpg") == "foto"
+        assert original_stem("foto_espejo_brillo.png") == "foto"
+        assert original_stem("_espejo.jpg") == "_espejo"
+
+    def test_split_is_deterministic_and_grouped(self):
+        names = [f"img{i}.jpg" for i in range(2000)]
+        splits = [split_for(name, 0.2) for name in names]
+        assert splits == [split_for(name, 0.2) for name in names]
+        assert 0.15 < splits.count('val') / len(names) < 0.25
+        for name, split in zip(names[:200], splits):
+            stem = name[:-4]
+            assert split_for(f"{stem}_espejo.jpg", 0.2) == split
+            assert split_for(f"{stem}_rotacion_negativo.jpg", 0.2) == split
+        assert {split_for(name, 0) for name in names} == {'train'}
+        assert [split_for(name, 0.2, seed=1) for name in names] != splits
+
+    def test_data_yaml_round_trip(self):
+        names = ["Persona", "Vehículo", "Señal: stop", "a, b"]
+        text = data_yaml(names).decode()
+        assert "train: images/train" in text and "nc: 4" in text
+        assert parse_data_yaml_names(text) == names
+
+
+@pytest.mark.unit
+class TestTrainingExport:
+    """Tests del contenido del ZIP de entrenamiento"""
+
+    @pytest.mark.parametrize("backend", ['txt', 'sqlite'])
+    def test_layout(self, tmp_path, monkeypatch, backend):
+        import label_store
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(label_store, "ANNOTATION_STORAGE", backend)
+        images = tmp_path / "annotations" / "sesion" / "images"
+        images.mkdir(parents=True)
+        names = [f"img{i}.jpg" for i in range(20)] + [f"img{i}_espejo.jpg" for i in range(20)]
+        for name in names:
+            (images / name).write_bytes(name.encode())
+        (tmp_path / "annotations" / "sesion" / "augmentation_log.json").write_text("{}")
+        get_label_store("sesion").save_many({name: ["3 0.5 0.5 0.1 0.1"] for name in names if name != "img0.jpg"})
+
+        raw = b''.join(stream_zip(iter_training_entries("sesion", ["a", "b"], val_ratio=0.3)))
+        with zipfile.ZipFile(io.BytesIO(raw)) as zf:
+            listing = zf.namelist()
+            assert listing[0] == "data.yaml"
+            assert parse_data_yaml_names(zf.read("data.yaml").decode()) == ["a", "b", "class_2", "class_3"]
+            assert "augmentation_log.json" not in listing
+            for name in names:
+                split = split_for(name, 0.3)
+                assert zf.read(f"images/{split}/{name}") == name.encode()
+                if name != "img0.jpg":
+                    assert zf.read(f"labels/{split}/{name[:-4]}.txt") == b"3 0.5 0.5 0.1 0.1"
+            assert not any(entry.startswith("labels/") and "img0.txt" in entry for entry in listing)
+            assert {entry.split('/')[1] for entry in listing if entry.startswith("images/")} == {'train', 'val'}
@@ -0,0 +1,166 @@
+"""
+Tests de generación de ZIP en streaming y del contenido de la exportación
+"""
+
+import io
+import os
+import zlib
+import struct
+import zipfile
+import pytest
+
+import label_store
+import zip_stream
+from label_store import get_label_store
+from annotation_patch import patch_labels
+from session_export import iter_session_entries
+from zip_stream import stream_zip
+
+
+def read_zip(chunks):
+    return zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+
+@pytest.mark.unit
+class TestStreamZip:
+    """Tests del escritor de ZIP sin seek"""
+
+    def test_round_trip_with_data_descriptors(self, tmp_path):
+        image = tmp_path / "a.jpg"
+        image.write_bytes(os.urandom(300_000))
+        with read_zip(stream_zip([("images/a.jpg", str(image)), ("labels/a.txt", b"0 0.5 0.5 0.1 0.1")])) as zf:
+            assert zf.testzip() is None
+            assert zf.read("images/a.jpg") == image.read_bytes()
+            assert zf.read("labels/a.txt") == b"0 0.5 0.5 0.1 0.1"
+            # Tamaños y CRC van detrás de los datos (bit 3 de flags)
+            assert all(info.flag_bits & 0x08 for info in zf.infolist())
+
+    def test_first_chunk_is_immediate_and_memory_bounded(self, tmp_path):
+        big = tmp_path / "big.png"
+        big.write_bytes(os.urandom(3 * 1024 * 1024))
+        chunk_size = 64 * 1024
+        chunks = list(stream_zip([("images/big.png", str(big))], chunk_size=chunk_size))
+        # La primera entrega es solo la cabecera local de la primera entrada
+        assert 0 < len(chunks[0]) < 200
+        assert max(len(chunk) for chunk in chunks) <= 2 * chunk_size
+        assert read_zip(chunks).read("images/big.png") == big.read_bytes()
+
+    def test_zip64_entries(self, monkeypatch):
+        # Bajar el límite permite comprobar los registros ZIP64 sin generar 4 GB
+        monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 4096)
+        data = os.urandom(10_000)
+        raw = b''.join(stream_zip([("grande.bin", data)]))
+        with zipfile.ZipFile(io.BytesIO(raw)) as zf:
+            assert zf.read("grande.bin") == data
+            extra = zf.getinfo("grande.bin").extra
+            assert struct.unpack('<H', extra[:2])[0] == 0x0001
+
+    def test_images_stored_and_text_deflated(self):
+        entries = [("images/a.JPG", os.urandom(5000)), ("labels/a.txt", b"0 0.5 0.5 0.1 0.1\n" * 200),
+                   ("augmentation_log.json", b'{"a": 1}' * 500)]
+        with read_zip(stream_zip(entries, compression='small')) as zf:
+            types = {info.filename: info.compress_type for info in zf.infolist()}
+            assert types == {"images/a.JPG": zipfile.ZIP_STORED, "labels/a.txt": zipfile.ZIP_DEFLATED,
+                             "augmentation_log.json": zipfile.ZIP_DEFLATED}
+            assert zf.getinfo("labels/a.txt").compress_size < 200
+            assert all(zf.read(name) == data for name, data in entries)
+        with read_zip(stream_zip(entries, compression='none')) as zf:
+            assert {info.compress_type for info in zf.infolist()} == {zipfile.ZIP_STORED}
+
+    def test_unknown_preset(self):
+        with pytest.raises(ValueError):
+            list(stream_zip([("a.txt", b"a")], compression='ultra'))
+
+
+@pytest.mark.unit
+class TestParallelCompression:
+    """Tests de la compresión de entradas en el pool de hilos"""
+
+    def entries(self, tmp_path):
+        text = b"".join(f"{i % 7} 0.{i:05d} 0.5 0.1 0.1\n".encode() for i in range(20_000))
+        big = tmp_path / "grande.json"
+        big.write_bytes(text * 3)
+        return [("labels/a.txt", b"0 0.5 0.5 0.1 0.1"), ("log.json", text), ("images/a.jpg", os.urandom(100_000)),
+                ("grande.json", str(big)), ("notas.txt", text[:70_000])]
+
+    def test_same_archive_content_as_single_thread(self, tmp_path):
+        entries = self.entries(tmp_path)
+        contents = []
+        for workers in (1, 4):
+            with read_zip(stream_zip(entries, workers=workers)) as zf:
+                assert zf.testzip() is None
+                contents.append([(info.filename, info.compress_type, info.CRC, zf.read(info)) for info in zf.infolist()])
+        assert contents[0] == contents[1]
+        assert [name for name, *_ in contents[1]] == [name for name, _ in entries]
+        assert contents[1][1][1] == zipfile.ZIP_DEFLATED
+
+    @pytest.mark.parametrize("zip64_limit", [None, 4096])
+    def test_precompressed_entries_are_valid(self, monkeypatch, zip64_limit):
+        # Entradas del pool entre entradas normales, con nombres no ASCII y offsets ZIP64
+        if zip64_limit:
+            monkeypatch.setattr(zipfile, "ZIP64_LIMIT", zip64_limit)
+        text = b"0 0.5 0.5 0.1 0.1\n" * 10_000
+        entries = [("a.txt", b"a"), ("etiquetas/ñandú.txt", text), ("images/b.jpg", os.urandom(70_000)),
+                   ("c.txt", text[::-1])]
+        with read_zip(stream_zip(entries, workers=2)) as zf:
+            assert zf.testzip() is None
+            assert zf.namelist() == [name for name, _ in entries]
+            assert all(zf.read(name) == data for name, data in entries)
+            info = zf.getinfo("etiquetas/ñandú.txt")
+            assert info.compress_type == zipfile.ZIP_DEFLATED and info.flag_bits & 0x800
+            # CRC y tamaños en la cabecera local, sin data descriptor
+            assert not info.flag_bits & 0x08
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_preset_level_is_applied(self, workers):
+        # Comprueba con este intérprete los internos de zipfile que usa
+        # zip_stream (nivel en la ZipInfo, registro de entradas del pool)
+        text = b"".join(f"{i % 7} 0.{i * 7919 % 100_000:05d} 0.5 0.1 0.1\n".encode() for i in range(10_000))
+        for preset in ('fast', 'small'):
+            compressor = zlib.compressobj(zip_stream.COMPRESSION_PRESETS[preset], zlib.DEFLATED, -15)
+            expected = len(compressor.compress(text) + compressor.flush())
+            with read_zip(stream_zip([("a.txt", text), ("b.txt", text)], compression=preset, workers=workers)) as zf:
+                assert zf.testzip() is None
+                assert [info.compress_size for info in zf.infolist()] == [expected, expected]
+
+    def test_bounded_entries_in_flight(self, tmp_path, monkeypatch):
+        pulled, written, lag = [0], [0], []
+        write = zip_stream._write_precompressed
+
+        def counting_write(*args):
+            written[0] += 1
+            lag.append(pulled[0] - written[0])
+            write(*args)
+
+        def entries():
+            for i in range(40):
+                pulled[0] += 1
+                yield f"e{i}.txt", b"abc" * 30_000
+
+        monkeypatch.setattr(zip_stream, "_write_precompressed", counting_write)
+        with read_zip(stream_zip(entries(), workers=3)) as zf:
+            assert len(zf.namelist()) == 40 and zf.read("e39.txt") == b"abc" * 30_000
+        assert written[0] == 40
+        assert max(lag) <= 2 * 3
+
+
+@pytest.mark.unit
+class TestSessionExport:
+    """Tests de qué se exporta de una sesión"""
+
+    @pytest.mark.parametrize("backend", ['txt', 'sqlite'])
+    def test_entries_materialize_labels(self, tmp_path, monkeypatch, backend):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(label_store, "ANNOTATION_STORAGE", backend)
+        session_path = tmp_path / "annotations" / "sesion"
+        (session_path / "images").mkdir(parents=True)
+        (session_path / "images" / "a.jpg").write_bytes(b"jpeg")
+        (session_path / "augmentation_log.json").write_text("{}")
+        patch_labels("sesion", "a.jpg", [{'op': 'add', 'box': {
+            'class_id': 1, 'x_center': 0.5, 'y_center': 0.5, 'width': 0.2, 'height': 0.2
+        }}])
+        assert get_label_store("sesion").backend == backend
+
+        with read_zip(stream_zip(iter_session_entries("sesion"))) as zf:
+            assert sorted(zf.namelist()) == ["augmentation_log.json", "images/a.jpg", "labels/a.txt"]
+            assert zf.read("labels/a.txt") == b"1 0.5 0.5 0.2 0.2"
@@ -0,0 +1,178 @@
+"""
+Exportación en mosaicos solapados (slicing al estilo SAHI) para objetos pequeños
+
+Con format=tiles cada imagen se corta en mosaicos de tile_size×tile_size
+píxeles cada tile_stride píxeles (stride < tamaño: los mosaicos se solapan y
+un objeto cortado en uno aparece entero en el vecino). El último mosaico de
+cada fila y columna se ajusta al borde de la imagen; las imágenes menores que
+el mosaico dan un único mosaico con su tamaño.
+
+- Las cajas se intersecan con todos los mosaicos de su imagen a la vez
+  (arrays cajas × mosaicos), se recortan al mosaico y se normalizan a él.
+  Una caja cuya parte visible en un mosaico es menor que min_visibility de su
+  área no se incluye en ese mosaico, y los mosaicos que se quedan sin cajas
+  se descartan (salvo keep_empty).
+- Las imágenes se cortan y codifican en el pool de letterbox_export, una
+  imagen por tarea, y los mosaicos se entregan a stream_zip según se generan.
+- Estructura de Ultralytics (images/ y labels/ en train/val, data.yaml): la
+  división se decide por la imagen original, así que todos sus mosaicos
+  quedan del mismo lado. tiles.json registra el origen de cada mosaico.
+"""
+import io
+import os
+import json
+import numpy as np
+from PIL import Image
+
+from label_store import get_label_store, label_stem
+from session_index import image_dimensions
+from training_export import (
+    data_yaml, session_images, split_for, training_class_names, DEFAULT_VAL_RATIO, EXPORT_BATCH_SIZE
+)
+from annotation_formats import yolo_to_absolute, group_yolo_lines
+from letterbox_export import letterbox_executor, iter_in_pool, is_jpeg, LETTERBOX_JPEG_QUALITY, LETTERBOX_WORKERS
+
+DEFAULT_TILE_SIZE = 640
+MIN_TILE_SIZE, MAX_TILE_SIZE = 32, 8192
+DEFAULT_TILE_OVERLAP = 0.2
+DEFAULT_MIN_VISIBILITY = 0.25
+TILES_METADATA = "tiles.json"
+
+
+def default_stride(tile_size):
+    """Paso por defecto: DEFAULT_TILE_OVERLAP de solape entre mosaicos vecinos"""
+    return max(1, int(round(tile_size * (1 - DEFAULT_TILE_OVERLAP))))
+
+
+def _axis_starts(length, tile_size, stride):
+    if length <= tile_size:
+        return np.zeros(1, dtype=np.int64)
+    starts = np.arange(0, length - tile_size, stride, dtype=np.int64)
+    return np.append(starts, length - tile_size)
+
+
+def tile_grid(width, height, tile_size, stride):
+    """Mosaicos de una imagen como array (K, 4): x_min, y_min, x_max, y_max"""
+    xs = _axis_starts(width, tile_size, stride)
+    ys = _axis_starts(height, tile_size, stride)
+    x0, y0 = np.meshgrid(xs, ys)
+    x0, y0 = x0.ravel(), y0.ravel()
+    return np.stack([x0, y0, np.minimum(x0 + tile_size, width), np.minimum(y0 + tile_size, height)], axis=1)
+
+
+def tile_boxes(corners, tiles, min_visibility):
+    """
+    Intersección de todas las cajas (B, 4 en píxeles) con todos los mosaicos
+    (K, 4). Devuelve (índice de caja, índice de mosaico, caja YOLO (M, 4)
+    recortada y normalizada al mosaico) de los pares con suficiente parte visible.
+    """
+    corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4)
+    tiles = np.asarray(tiles, dtype=np.float64).reshape(-1, 4)
+    # (B, K) de cada coordenada de la intersección
+    x1 = np.maximum(corners[:, None, 0], tiles[None, :, 0])
+    y1 = np.maximum(corners[:, None, 1], tiles[None, :, 1])
+    x2 = np.minimum(corners[:, None, 2], tiles[None, :, 2])
+    y2 = np.minimum(corners[:, None, 3], tiles[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (corners[:, 2] - corners[:, 0]) * (corners[:, 3] - corners[:, 1])
+    visible = np.divide(inter, area[:, None], out=np.zeros_like(inter), where=area[:, None] > 0)
+    box_index, tile_index = np.nonzero((inter > 0) & (visible >= min_visibility))
+
+    origin = tiles[tile_index, :2]
+    sizes = tiles[tile_index, 2:] - origin
+    low = np.stack([x1[box_index, tile_index], y1[box_index, tile_index]], axis=1) - origin
+    high = np.stack([x2[box_index, tile_index], y2[box_index, tile_index]], axis=1) - origin
+    boxes = np.concatenate([(low + high) / 2 / sizes, (high - low) / sizes], axis=1)
+    return box_index, tile_index, boxes
+
+
+def tile_filename(filename, x0, y0):
+    """'foto.png' → 'foto_640_0.png' (los mosaicos que no vienen de una JPEG van en PNG)"""
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}_{x0}_{y0}{'.jpg' if is_jpeg(filename) else '.png'}"
+
+
+def crop_tiles(path, tiles):
+    """Bytes de cada mosaico (K, 4) de la imagen. Se ejecuta en el pool."""
+    results = []
+    with Image.open(path) as img:
+        if img.mode == 'P':
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        jpeg = is_jpeg(path)
+        if jpeg and img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.load()
+        for box in tiles:
+            buffer = io.BytesIO()
+            tile = img.crop(tuple(box))
+            if jpeg:
+                tile.save(buffer, format='JPEG', quality=LETTERBOX_JPEG_QUALITY)
+            else:
+                tile.save(buffer, format='PNG')
+            results.append(buffer.getvalue())
+    return results
+
+
+def _plan_batch(batch, labels, dimensions, tile_size, stride, min_visibility, keep_empty):
+    """Mosaicos que se exportan de cada imagen del lote y las líneas YOLO de cada uno"""
+    counts = [len(labels.get(name, ())) for name in batch]
+    owners = np.repeat(np.arange(len(batch)), counts)
+    sizes = np.array([dimensions[name] for name in batch], dtype=np.float64).reshape(-1, 2)
+    classes, corners = yolo_to_absolute(
+        [box for name in batch for box in labels.get(name, ())], sizes[owners, 0], sizes[owners, 1]
+    )
+    bounds = np.searchsorted(owners, np.arange(len(batch) + 1))
+
+    plan = []
+    for offset, filename in enumerate(batch):
+        width, height = dimensions[filename]
+        tiles = tile_grid(width, height, tile_size, stride)
+        first, last = bounds[offset], bounds[offset + 1]
+        box_index, tile_index, boxes = tile_boxes(corners[first:last], tiles, min_visibility)
+        lines = group_yolo_lines(tile_index, classes[first:last][box_index], boxes, len(tiles))
+        kept = [k for k in range(len(tiles)) if lines[k] or keep_empty]
+        plan.append((filename, tiles[kept], [lines[k] for k in kept]))
+    return plan
+
+
+def iter_tiled_entries(session, class_names, tile_size=DEFAULT_TILE_SIZE, stride=None,
+                       min_visibility=DEFAULT_MIN_VISIBILITY, keep_empty=False,
+                       val_ratio=DEFAULT_VAL_RATIO, seed=0, executor=None, workers=None):
+    """
+    (nombre en el ZIP, bytes) del dataset en mosaicos con tiles.json al final.
+    Con otro `executor`, `workers` son sus hilos (por defecto el pool compartido).
+    """
+    executor, workers = executor or letterbox_executor, workers or LETTERBOX_WORKERS
+    stride = stride or default_stride(tile_size)
+    yield "data.yaml", data_yaml(training_class_names(session, class_names))
+
+    dimensions = image_dimensions(session)
+    store = get_label_store(session)
+    images_path = os.path.join("annotations", session, "images")
+    # Solo imágenes etiquetadas y con dimensiones conocidas
+    images = [name for name in session_images(session) if dimensions.get(name, (None, None))[0]]
+    metadata = {}
+    for start in range(0, len(images), EXPORT_BATCH_SIZE):
+        batch = images[start:start + EXPORT_BATCH_SIZE]
+        labels = store.load_boxes_many(batch)
+        batch = [name for name in batch if name in labels]
+        plan = [
+            item for item in _plan_batch(batch, labels, dimensions, tile_size, stride, min_visibility, keep_empty)
+            if len(item[1])
+        ]
+        crops = iter_in_pool(executor, crop_tiles, [
+            (os.path.join(images_path, filename), tiles.tolist()) for filename, tiles, _ in plan
+        ], workers)
+        for (filename, tiles, lines), tile_bytes in zip(plan, crops):
+            split = split_for(filename, val_ratio, seed)
+            for (x0, y0, x1, y1), data, tile_lines in zip(tiles.tolist(), tile_bytes, lines):
+                name = tile_filename(filename, x0, y0)
+                metadata[f"images/{split}/{name}"] = {'source': filename, 'origin': [x0, y0], 'size': [x1 - x0, y1 - y0]}
+                yield f"images/{split}/{name}", data
+                yield f"labels/{split}/{label_stem(name)}.txt", '\n'.join(tile_lines).encode()
+
+    yield TILES_METADATA, json.dumps({
+        'tile_size': tile_size, 'stride': stride, 'min_visibility': min_visibility,
+        # Píxel en la imagen original = píxel en el mosaico + origin
+        'tiles': metadata,
+    }, ensure_ascii=False).encode()
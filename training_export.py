@@ -0,0 +1,103 @@
+"""
+Exportación lista para entrenar (estructura de Ultralytics)
+
+    images/train/...  images/val/...
+    labels/train/...  labels/val/...
+    data.yaml         rutas de train/val y nombres de clase (AnnotationClass)
+
+División determinista: cada imagen va a val si el hash de (semilla, imagen
+original) cae por debajo de val_ratio. Las variantes de augmentación
+(foto_espejo.jpg, foto_brillo.jpg...) se agrupan con su original, así que
+nunca quedan a ambos lados de la división; y como la decisión depende solo
+del nombre, añadir imágenes a la sesión no mueve las que ya estaban.
+
+Las entradas se generan para stream_zip: las imágenes se leen de su ruta en
+la sesión y las etiquetas se cargan del almacén por lotes.
+"""
+import os
+import json
+import hashlib
+
+from augment_dataset import AVAILABLE_VARIANTS
+from label_store import get_label_store, label_stem
+from session_index import IMAGE_EXTENSIONS
+
+TRAINING_SPLITS = ('train', 'val')
+DEFAULT_VAL_RATIO = 0.2
+
+# Imágenes cuyas etiquetas se cargan a la vez del almacén
+EXPORT_BATCH_SIZE = 500
+
+
+def original_stem(filename):
+    """Nombre base de la imagen original: 'foto_espejo_brillo.jpg' → 'foto'"""
+    stem = os.path.splitext(filename)[0]
+    stripped = True
+    while stripped:
+        stripped = False
+        for variant in AVAILABLE_VARIANTS:
+            suffix = f"_{variant}"
+            if stem.endswith(suffix) and len(stem) > len(suffix):
+                stem = stem[:-len(suffix)]
+                stripped = True
+    return stem
+
+
+def split_for(filename, val_ratio=DEFAULT_VAL_RATIO, seed=0):
+    """'train' o 'val' para una imagen (el mismo para todas las variantes de un original)"""
+    digest = hashlib.sha1(f"{seed}:{original_stem(filename)}".encode()).digest()
+    return 'val' if int.from_bytes(digest[:8], 'big') / 2 ** 64 < val_ratio else 'train'
+
+
+def data_yaml(class_names):
+    """data.yaml de Ultralytics (nombres entre comillas dobles: JSON es YAML válido)"""
+    lines = [
+        "path: .",
+        "train: images/train",
+        "val: images/val",
+        f"nc: {len(class_names)}",
+        "names:",
+    ]
+    lines += [f"  {index}: {json.dumps(name, ensure_ascii=False)}" for index, name in enumerate(class_names)]
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def session_images(session):
+    images_path = os.path.join("annotations", session, "images")
+    if not os.path.isdir(images_path):
+        return []
+    with os.scandir(images_path) as entries:
+        return sorted(
+            entry.name for entry in entries
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+
+def training_class_names(session, class_names):
+    """
+    Nombres de la sesión completados hasta el mayor class_id usado en las
+    etiquetas, para que data.yaml cubra todas las clases del dataset
+    """
+    names = list(class_names)
+    used = get_label_store(session).class_ids()
+    for class_id in range(len(names), max(used, default=-1) + 1):
+        names.append(f"class_{class_id}")
+    return names
+
+
+def iter_training_entries(session, class_names, val_ratio=DEFAULT_VAL_RATIO, seed=0):
+    """(nombre en el ZIP, ruta o bytes) del dataset con división train/val"""
+    yield "data.yaml", data_yaml(training_class_names(session, class_names))
+
+    store = get_label_store(session)
+    images_path = os.path.join("annotations", session, "images")
+    images = session_images(session)
+    for start in range(0, len(images), EXPORT_BATCH_SIZE):
+        batch = images[start:start + EXPORT_BATCH_SIZE]
+        labels = store.load_many(batch)
+        for filename in batch:
+            split = split_for(filename, val_ratio, seed)
+            yield f"images/{split}/{filename}", os.path.join(images_path, filename)
+            lines = labels.get(filename)
+            if lines is not None:
+                yield f"labels/{split}/{label_stem(filename)}.txt", '\n'.join(lines).encode()
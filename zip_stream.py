@@ -0,0 +1,242 @@
+"""
+Generación de archivos ZIP en streaming (sin archivo temporal)
+
+zipfile escribe sobre un buffer que no admite seek: en ese modo usa data
+descriptors (tamaños y CRC después de los datos de cada entrada) y añade los
+registros ZIP64 que hagan falta, así que el ZIP se puede enviar según se
+genera. El buffer se vacía cada ZIP_CHUNK_SIZE bytes, por lo que la memoria
+usada no depende del tamaño de la sesión (solo crece el directorio central,
+unos pocos bytes por entrada).
+
+Compresión por entrada: las imágenes que ya están comprimidas (JPEG, PNG,
+WebP, GIF) se guardan sin comprimir, porque deflate apenas las reduce y es
+lo más caro de la exportación; etiquetas, JSON y demás se comprimen con
+deflate al nivel del preset (EXPORT_COMPRESSION o parámetro de la descarga).
+
+Compresión en paralelo: las entradas comprimibles de tamaño medio se
+comprimen enteras en un pool de hilos (zlib libera el GIL) mientras el hilo
+del generador escribe el ZIP en orden con los bloques ya comprimidos. Hay un
+número acotado de entradas y de bytes en vuelo; las muy pequeñas no compensan
+el paso por el pool y las muy grandes se comprimen por bloques al escribirlas
+para no tenerlas enteras en memoria.
+
+zipfile no tiene API pública para dos cosas que se necesitan aquí, y se usan
+sus atributos internos, estables en las versiones soportadas (Python 3.9 a
+3.13; tests/test_zip_stream.py los comprueba con el intérprete en uso):
+
+- Nivel de deflate por entrada con ZipFile.open(zinfo, 'w'): open toma el
+  nivel de la ZipInfo (ZipFile.compresslevel solo se aplica a las entradas
+  abiertas por nombre). Es `compress_level` desde 3.13 y `_compresslevel`
+  antes (ver _set_compress_level).
+- Entradas ya comprimidas en el pool: se escriben la cabecera local y el
+  bloque deflate y se registra la ZipInfo en filelist, NameToInfo y
+  start_dir, lo mismo que hacen writestr y mkdir dentro de zipfile (ver
+  _write_precompressed).
+"""
+import os
+import sys
+import time
+import zlib
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# Preset → nivel de deflate para las entradas comprimibles (None: todo sin comprimir)
+COMPRESSION_PRESETS = {'none': None, 'fast': 1, 'balanced': 6, 'small': 9}
+EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "balanced")
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+
+EXPORT_COMPRESSION_WORKERS = int(os.getenv("EXPORT_COMPRESSION_WORKERS", str(min(4, os.cpu_count() or 1))))
+PARALLEL_MIN_ENTRY_SIZE = 64 * 1024
+PARALLEL_MAX_ENTRY_SIZE = 32 * 1024 * 1024
+MAX_INFLIGHT_BYTES = 128 * 1024 * 1024
+
+# Pool compartido por todas las exportaciones (None: compresión en el hilo del generador)
+compression_executor = (
+    ThreadPoolExecutor(max_workers=EXPORT_COMPRESSION_WORKERS, thread_name_prefix="zip-deflate")
+    if EXPORT_COMPRESSION_WORKERS > 1 else None
+)
+
+
+class _ChunkBuffer:
+    """Destino de zipfile: acumula lo escrito hasta que el generador lo recoge"""
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        # zipfile necesita la posición para los offsets del directorio central
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pending(self):
+        return self._size
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        return data
+
+
+def compression_for(arcname, preset):
+    """(método, nivel) de zipfile para una entrada según el preset"""
+    level = COMPRESSION_PRESETS[preset]
+    if level is None or arcname.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED, None
+    return zipfile.ZIP_DEFLATED, level
+
+
+def _is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def _zip_info(arcname, source, preset):
+    if not _is_path(source):
+        zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+        # Contenido generado por bloques: tamaño desconocido hasta el final
+        zinfo.file_size = len(source) if isinstance(source, (bytes, bytearray)) else 0
+        zinfo.external_attr = 0o644 << 16
+    else:
+        # file_size conocido de antemano: zipfile decide si la entrada necesita ZIP64
+        zinfo = zipfile.ZipInfo.from_file(source, arcname)
+    zinfo.compress_type, level = compression_for(arcname, preset)
+    _set_compress_level(zinfo, level)
+    return zinfo
+
+
+def _set_compress_level(zinfo, level):
+    """Nivel de deflate que usará ZipFile.open(zinfo, 'w'): atributo público desde Python 3.13"""
+    if sys.version_info >= (3, 13):
+        zinfo.compress_level = level
+    else:
+        zinfo._compresslevel = level
+
+
+def _read_chunks(source, chunk_size):
+    if isinstance(source, (bytes, bytearray)):
+        for start in range(0, len(source), chunk_size):
+            yield source[start:start + chunk_size]
+        return
+    if not _is_path(source):
+        yield from source
+        return
+    with open(source, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _deflate(source, level):
+    """(CRC, tamaño, datos comprimidos) de una entrada completa, en un hilo del pool"""
+    if isinstance(source, (bytes, bytearray)):
+        data = source
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)  # deflate sin cabecera, como zipfile
+    return zlib.crc32(data), len(data), compressor.compress(data) + compressor.flush()
+
+
+def _write_precompressed(zf, buffer, zinfo, crc, size, blob):
+    """
+    Escribir una entrada comprimida en el pool: cabecera local con CRC y
+    tamaños ya conocidos (sin data descriptor) y el bloque deflate tal cual.
+    Después se registra la entrada como hace ZipFile.writestr, para que
+    zipfile la incluya al escribir el directorio central.
+    """
+    zinfo.file_size = size
+    zinfo.compress_size = len(blob)
+    zinfo.CRC = crc
+    zinfo.header_offset = buffer.tell()
+    buffer.write(zinfo.FileHeader())
+    buffer.write(blob)
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+    # El directorio central empieza después de la última entrada escrita
+    zf.start_dir = buffer.tell()
+
+
+def _pipeline(entries, preset, executor, max_inflight):
+    """
+    (ZipInfo, origen, future de _deflate o None) en el orden de `entries`,
+    adelantando la compresión de las siguientes entradas en el pool
+    """
+    window = deque()
+    inflight_bytes = 0
+    for arcname, source in entries:
+        zinfo = _zip_info(arcname, source, preset)
+        future = None
+        if (executor is not None and zinfo.compress_type == zipfile.ZIP_DEFLATED
+                and PARALLEL_MIN_ENTRY_SIZE <= zinfo.file_size <= PARALLEL_MAX_ENTRY_SIZE):
+            future = executor.submit(_deflate, source, compression_for(arcname, preset)[1])
+            inflight_bytes += zinfo.file_size
+        window.append((zinfo, source, future))
+        while window and (len(window) > max_inflight or inflight_bytes > MAX_INFLIGHT_BYTES):
+            item = window.popleft()
+            if item[2] is not None:
+                inflight_bytes -= item[0].file_size
+            yield item
+    yield from window
+
+
+def stream_zip(entries, chunk_size=ZIP_CHUNK_SIZE, compression=None, workers=None):
+    """
+    Generar un ZIP a partir de `entries`, iterable de (nombre en el ZIP,
+    ruta de archivo, bytes o iterable de bloques de bytes generados según se
+    escribe la entrada). Produce bloques de bytes de ~chunk_size; el
+    primero sale en cuanto está escrita la cabecera de la primera entrada.
+    `compression` es un preset de COMPRESSION_PRESETS (por defecto EXPORT_COMPRESSION)
+    y `workers` los hilos de compresión (por defecto el pool compartido).
+    """
+    preset = compression or EXPORT_COMPRESSION
+    if preset not in COMPRESSION_PRESETS:
+        raise ValueError(f"Compresión inválida: {preset}. Disponibles: {list(COMPRESSION_PRESETS)}")
+
+    executor, own_executor = compression_executor, False
+    if workers is None:
+        workers = EXPORT_COMPRESSION_WORKERS
+    elif workers != EXPORT_COMPRESSION_WORKERS:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zip-deflate") if workers > 1 else None
+        own_executor = executor is not None
+    max_inflight = 2 * max(workers, 1)
+
+    buffer = _ChunkBuffer()
+    first = True
+    try:
+        with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zf:
+            for zinfo, source, future in _pipeline(entries, preset, executor, max_inflight):
+                if future is not None:
+                    _write_precompressed(zf, buffer, zinfo, *future.result())
+                else:
+                    # Sin tamaño previo (contenido generado) se reserva ZIP64 por si pasa de 4 GB
+                    with zf.open(zinfo, 'w', force_zip64=not zinfo.file_size and not _is_path(source)) as dest:
+                        if first:
+                            first = False
+                            yield buffer.take()
+                        for chunk in _read_chunks(source, chunk_size):
+                            dest.write(chunk)
+                            if buffer.pending() >= chunk_size:
+                                yield buffer.take()
+                if first or buffer.pending() >= chunk_size:
+                    first = False
+                    yield buffer.take()
+        # Resto de la última entrada y directorio central
+        yield buffer.take()
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)